@@ -0,0 +1,157 @@
+import asyncio
+
+# --- CONFIGURATION ---
+DEFAULT_MAX_WAIT_MS = 5     # How long the first request in a batch may wait for company
+DEFAULT_MAX_BATCH_SIZE = 64 # Flush immediately once this many requests are pending
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for a few milliseconds (or until `max_batch_size`
+    items are pending) and scores them all with ONE call to `batch_fn`.
+
+    `batch_fn(items) -> results` must return one result per item, in order.
+    It runs in the default thread pool so the event loop keeps accepting requests
+    while sklearn is busy.
+
+    `submit_fn(items) -> concurrent.futures.Future`, if set, is used instead: it is
+    called on the event loop in batch order (so an ordered pipeline such as
+    scoring_pool.OrderedPipeline sees batches as they arrived), and up to
+    `max_in_flight` batches may be pending at once.
+
+    If a batch fails with one of `retry_on`, its items are retried one at a time so
+    only the bad item's request gets the error. List only exceptions that `batch_fn`
+    raises before it changes any state (bulk_ingest.MalformedLogError: prepare_batch
+    checks every log first); any other failure goes to every request in the batch,
+    since re-running the good items would apply their side effects twice.
+    """
+    def __init__(self, batch_fn, max_wait_ms=DEFAULT_MAX_WAIT_MS, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_in_flight=1, submit_fn=None, retry_on=()):
+        if max_batch_size < 1: raise ValueError("max_batch_size must be >= 1")
+        self.batch_fn = batch_fn
+        self.submit_fn = submit_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.retry_on = tuple(retry_on)
+        self._queue = None
+        self._worker = None
+        self.batches_run = 0
+        self.items_scored = 0
+
+    def _ensure_worker(self):
+        # Lazily bound to whatever loop is running (uvicorn's, or a test's)
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        """Queue one item and wait for its own result."""
+        self._ensure_worker()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, fut))
+        return await fut
+
+    async def _collect(self):
+        # Block for the first item, then wait at most `max_wait` for more
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0: break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        while True:
+            batch = await self._collect()
+            await slots.acquire()
+            items = [item for item, _ in batch]
+            try:
+                if self.submit_fn: pending = asyncio.wrap_future(self.submit_fn(items))
+                else: pending = loop.run_in_executor(None, self.batch_fn, items)
+            except Exception as e:
+                pending = loop.create_future()
+                pending.set_exception(e)
+            if self.max_in_flight == 1: await self._deliver(batch, pending, slots)
+            else: loop.create_task(self._deliver(batch, pending, slots))
+
+    async def _deliver(self, batch, pending, slots):
+        try:
+            results = await pending
+            if len(results) != len(batch):
+                raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            if len(batch) > 1 and isinstance(e, self.retry_on): await self._one_by_one(batch)
+            else:
+                for _, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+            return
+        finally:
+            slots.release()
+
+        self.batches_run += 1
+        self.items_scored += len(batch)
+        for (_, fut), res in zip(batch, results):
+            if not fut.done(): fut.set_result(res)
+
+    async def _one_by_one(self, batch):
+        loop = asyncio.get_running_loop()
+        for item, fut in batch:
+            try:
+                if self.submit_fn: results = await asyncio.wrap_future(self.submit_fn([item]))
+                else: results = await loop.run_in_executor(None, self.batch_fn, [item])
+                if len(results) != 1: raise RuntimeError(f"batch_fn returned {len(results)} results for 1 item")
+            except Exception as e:
+                if not fut.done(): fut.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.items_scored += 1
+            if not fut.done(): fut.set_result(results[0])
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try: await self._worker
+            except asyncio.CancelledError: pass
+            self._worker = None
+
+# --- SELF-CHECK ---
+#   python batching.py
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    class Refused(ValueError): pass
+    applied, calls = [], []
+    def score(items):
+        calls.append(len(items))
+        if any(i < 0 for i in items): raise Refused("negative item")         # Checked before anything moves
+        if 99 in items: applied.extend(items); raise RuntimeError("crashed")  # Fails after its side effects
+        applied.extend(items)
+        return [i * 10 for i in items]
+
+    async def burst(batcher, items):
+        out = await asyncio.gather(*[batcher.submit(i) for i in items], return_exceptions=True)
+        await batcher.close()
+        return [type(r).__name__ if isinstance(r, Exception) else r for r in out]
+
+    # Refused up front: retried one by one, only the bad item's request fails
+    b = MicroBatcher(score, max_wait_ms=20, retry_on=(Refused,))
+    assert asyncio.run(burst(b, [1, 2, -3, 4])) == [10, 20, "Refused", 40]
+    assert calls == [4, 1, 1, 1, 1] and applied == [1, 2, 4]
+    # Failed after its side effects: every request gets the error, nothing is applied twice
+    calls.clear(); applied.clear()
+    assert asyncio.run(burst(b, [1, 99, 3])) == ["RuntimeError"] * 3 and calls == [3] and applied == [1, 99, 3]
+    # Same through submit_fn with several batches in flight
+    pool = ThreadPoolExecutor(2)
+    calls.clear(); applied.clear()
+    b = MicroBatcher(score, max_wait_ms=20, max_batch_size=3, max_in_flight=2, retry_on=(Refused,),
+                     submit_fn=lambda items: pool.submit(score, items))
+    assert asyncio.run(burst(b, [1, -2, 3, 4, 5, 6])) == [10, "Refused", 30, 40, 50, 60]
+    assert sorted(applied) == [1, 3, 4, 5, 6] and b.items_scored == 5
+    pool.shutdown()
+    print(f"✅ MicroBatcher OK: {b.batches_run} batches, {b.items_scored} items")
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import threading
+import numpy as np
+from fleet_sim import FleetGenerator, MIXES
+
+# --- LOAD-TEST HARNESS ---
+# Drives each stage with a synthetic fleet at a fixed rate (open loop: latency is
+# measured from when a request was *scheduled*, so a stall shows up as latency
+# instead of silently lowering the offered load), or flat out with --rate 0.
+#
+#   python benchmark.py --stages analyze,encrypt --rate 500 --duration 5
+#   python benchmark.py --save laptop               # store a baseline
+#   python benchmark.py --compare laptop            # exit code 1 on regression
+
+# --- CONFIGURATION ---
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bench_baselines")
+STAGES = ("analyze", "encrypt", "ingest", "serial")
+DEFAULT_RATE = 0          # Requests per second (0 = as fast as possible)
+DEFAULT_DURATION_SEC = 3.0
+DEFAULT_DEVICES = 50
+INGEST_CONCURRENCY = 32   # In-flight /ingest calls when --rate 0
+SERIAL_LINKS = 4          # Pseudo-terminals for the serial stage
+REGRESSION_TOLERANCE = 0.2  # p99 up or throughput down by more than this = regression
+
+def summarize(latencies, elapsed, errors=0):
+    lat = np.asarray(latencies, dtype=np.float64) * 1000
+    if not len(lat): return {"count": 0, "errors": errors}
+    p50, p99, p999 = np.percentile(lat, [50, 99, 99.9])
+    return {"count": int(len(lat)), "errors": errors, "throughput": len(lat) / elapsed,
+            "p50_ms": float(p50), "p99_ms": float(p99), "p999_ms": float(p999),
+            "max_ms": float(lat.max()), "mean_ms": float(lat.mean())}
+
+def _pace(t0, i, rate):
+    """Sleep until request i is due; returns the time it was due (its latency clock starts there)."""
+    if not rate: return time.perf_counter()
+    due = t0 + i / rate
+    delay = due - time.perf_counter()
+    if delay > 0: time.sleep(delay)
+    return due
+
+def _count(rate, duration):
+    return int(rate * duration) if rate else None
+
+# --- STAGES ---
+def bench_analyze(fleet, rate, duration):
+    from iot_core import IoTIntelligenceCore
+    from reasoning import StubLLMClient
+    brain = IoTIntelligenceCore(llm_client=StubLLMClient())
+    brain.models.warm()
+    for log in fleet.take(500): brain.analyze(log) # Warm caches / compiled forest
+    n = _count(rate, duration)
+    lat, t0 = [], time.perf_counter()
+    i = 0
+    while (i < n) if n is not None else (time.perf_counter() - t0 < duration):
+        log = fleet.next_log()
+        start = _pace(t0, i, rate)
+        brain.analyze(log)
+        lat.append(time.perf_counter() - start)
+        i += 1
+    return summarize(lat, time.perf_counter() - t0)
+
+def bench_encrypt(fleet, rate, duration):
+    from crypto_layer import QuantumSecurityLayer
+    crypto = QuantumSecurityLayer(session_mode=True)
+    reports = [{"device_id": l["digitalTwin"]["deviceId"], "timestamp": l["telemetry"]["lastContactTime"],
+                "status": "BALANCED", "reasoning": "Logic Trigger: Model Analysis",
+                "metrics": {"anomaly_score": 0.05, "battery_prediction_hours": 40.0, "battery_status": "High"}}
+               for l in fleet.take(256)]
+    n = _count(rate, duration)
+    lat, t0 = [], time.perf_counter()
+    i = 0
+    while (i < n) if n is not None else (time.perf_counter() - t0 < duration):
+        start = _pace(t0, i, rate)
+        crypto.encrypt_payload(reports[i % len(reports)])
+        lat.append(time.perf_counter() - start)
+        i += 1
+    return summarize(lat, time.perf_counter() - t0)
+
+def bench_ingest(fleet, rate, duration, concurrency=INGEST_CONCURRENCY):
+    """POST /ingest on main.app in-process (httpx ASGI transport: no sockets, real FastAPI stack)."""
+    import httpx
+    import main
+    from reasoning import StubLLMClient
+    main.brain.llm_client = StubLLMClient()
+    main.send_to_cloud_node = lambda body, headers: None # Measure the gateway, not the demo printout
+    main.brain.models.warm()
+    logs = fleet.take(2048)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for log in logs[:50]: await client.post("/ingest", json=log)
+            lat, errors = [], 0
+
+            async def one(i, start):
+                nonlocal errors
+                r = await client.post("/ingest", json=logs[i % len(logs)])
+                if r.status_code != 200: errors += 1
+                lat.append(time.perf_counter() - start)
+
+            t0 = time.perf_counter()
+            if rate:
+                tasks = []
+                for i in range(int(rate * duration)):
+                    due = t0 + i / rate
+                    delay = due - time.perf_counter()
+                    if delay > 0: await asyncio.sleep(delay)
+                    tasks.append(asyncio.ensure_future(one(i, due)))
+                await asyncio.gather(*tasks)
+            else:
+                counter = iter(range(10 ** 9))
+                async def worker():
+                    while time.perf_counter() - t0 < duration:
+                        await one(next(counter), time.perf_counter())
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return summarize(lat, time.perf_counter() - t0, errors)
+
+    return asyncio.run(run())
+
+def bench_serial(fleet, rate, duration, links=SERIAL_LINKS):
+    """Logs written into pseudo-terminals -> DeviceGateway -> analyze_batch; latency = write to scored."""
+    if os.name == "nt": return {"skipped": "needs POSIX pseudo-terminals"}
+    import pty
+    import tty
+    from device_gateway import DeviceGateway
+    from iot_core import IoTIntelligenceCore
+    from reasoning import StubLLMClient
+    brain = IoTIntelligenceCore(llm_client=StubLLMClient())
+    brain.models.warm()
+    done, lat = threading.Event(), {}
+
+    def handle(items):
+        brain.analyze_batch([log for _, log in items])
+        now = time.perf_counter()
+        for _, log in items: lat[log["_bench_seq"]] = now
+        if expected is not None and len(lat) >= expected: done.set()
+
+    gw = DeviceGateway(handle).start()
+    masters = []
+    for _ in range(links):
+        master, slave = pty.openpty()
+        tty.setraw(master); tty.setraw(slave)
+        masters.append(master)
+        gw.open_link(os.ttyname(slave), 115200)
+
+    expected = _count(rate, duration)
+    sent, t0, i = {}, time.perf_counter(), 0
+    try:
+        while (i < expected) if expected is not None else (time.perf_counter() - t0 < duration):
+            log = fleet.next_log()
+            log["_bench_seq"] = i
+            line = (json.dumps(log) + "\n").encode()
+            sent[i] = _pace(t0, i, rate)
+            os.write(masters[i % links], line)
+            i += 1
+        expected = i
+        if len(lat) >= expected: done.set()
+        done.wait(max(5.0, duration))
+        elapsed = time.perf_counter() - t0
+    finally:
+        gw.stop()
+        for m in masters: os.close(m)
+    stats = summarize([lat[k] - sent[k] for k in lat], elapsed, errors=expected - len(lat))
+    stats["dropped"] = gw.logs_dropped
+    return stats
+
+RUNNERS = {"analyze": bench_analyze, "encrypt": bench_encrypt, "ingest": bench_ingest, "serial": bench_serial}
+
+# --- BASELINES ---
+def save_baseline(name, results, config):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    doc = {"name": name, "created": time.time(), "config": config, "results": results,
+           "host": {"python": platform.python_version(), "machine": platform.machine(),
+                    "system": platform.system(), "cpus": os.cpu_count()}}
+    with open(path, "w") as f: json.dump(doc, f, indent=2)
+    return path
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """-> list of (stage, metric, old, new, regressed)."""
+    rows = []
+    for stage, new in results.items():
+        old = baseline["results"].get(stage)
+        if not old or "p99_ms" not in old or "p99_ms" not in new: continue
+        rows.append((stage, "p99_ms", old["p99_ms"], new["p99_ms"], new["p99_ms"] > old["p99_ms"] * (1 + tolerance)))
+        rows.append((stage, "throughput", old["throughput"], new["throughput"],
+                     new["throughput"] < old["throughput"] * (1 - tolerance)))
+    return rows
+
+def print_results(results):
+    print(f"\n   {'stage':<9}{'count':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'max ms':>10}{'lost':>8}")
+    for stage, r in results.items():
+        if "skipped" in r:
+            print(f"   {stage:<9} skipped: {r['skipped']}")
+            continue
+        if not r.get("count"):
+            print(f"   {stage:<9} no samples")
+            continue
+        print(f"   {stage:<9}{r['count']:>8}{r['throughput']:>10,.0f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+              f"{r['p999_ms']:>10.3f}{r['max_ms']:>10.3f}{r['errors']:>8}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Cerberus gateway load test")
+    ap.add_argument("--stages", default=",".join(STAGES), help=f"comma list of {', '.join(STAGES)}")
+    ap.add_argument("--rate", type=float, default=DEFAULT_RATE, help="requests/s per stage (0 = max)")
+    ap.add_argument("--duration", type=float, default=DEFAULT_DURATION_SEC, help="seconds per stage")
+    ap.add_argument("--devices", type=int, default=DEFAULT_DEVICES)
+    ap.add_argument("--mix", default="mixed", choices=sorted(MIXES))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--save", metavar="NAME", help="store the results as baseline NAME")
+    ap.add_argument("--compare", metavar="NAME", help="compare against baseline NAME")
+    ap.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = ap.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in RUNNERS]
+    if unknown: ap.error(f"unknown stage(s): {', '.join(unknown)}")
+    config = {"rate": args.rate, "duration": args.duration, "devices": args.devices, "mix": args.mix,
+              "seed": args.seed}
+
+    results = {}
+    for stage in stages:
+        print(f"⏱️  {stage}: {'max rate' if not args.rate else f'{args.rate:g}/s'} for {args.duration:g}s "
+              f"({args.devices} devices, '{args.mix}' mix)...")
+        fleet = FleetGenerator(args.devices, args.mix, seed=args.seed)
+        results[stage] = RUNNERS[stage](fleet, args.rate, args.duration)
+    print_results(results)
+
+    status = 0
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f: baseline = json.load(f)
+        if baseline["config"] != config: print(f"   ⚠️ Baseline '{args.compare}' was run with {baseline['config']}")
+        print(f"\n   vs baseline '{args.compare}' (tolerance {args.tolerance:.0%}):")
+        for stage, metric, old, new, bad in compare(results, baseline, args.tolerance):
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"   {'❌' if bad else '✅'} {stage:<9}{metric:<12}{old:>12.3f} -> {new:>12.3f} ({change:+.1f}%)")
+            if bad: status = 1
+    if args.save: print(f"\n💾 Baseline saved to {save_baseline(args.save, results, config)}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
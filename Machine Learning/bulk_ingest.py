@@ -0,0 +1,179 @@
+import json
+import codecs
+
+# --- BULK INGEST PARSING ---
+# Incremental parser for /ingest/batch bodies: either one JSON array of logs or
+# NDJSON (one log per line), detected from the first non-blank byte. Chunks go
+# in as they arrive off the socket and complete logs come out, so a backlog of
+# thousands of messages is scored while the rest of the body is still uploading
+# and never has to sit in memory as a whole.
+
+# --- CONFIGURATION ---
+MAX_ITEM_BYTES = 64 * 1024    # One log bigger than this is a broken client, not a log
+SECTIONS = ("digitalTwin", "telemetry", "battery", "behaviour", "anomaly", "security") # = main.HardwareLog
+_NUMBER = (int, float)
+# Inner fields the pipeline reads (device_state, hard rules, governor, encoders): (section, key, required type)
+FIELDS = (("digitalTwin", "deviceId", None),
+          ("telemetry", "temperature", _NUMBER), ("telemetry", "batteryPercentage", _NUMBER),
+          ("telemetry", "uptimeSeconds", _NUMBER),
+          ("battery", "batteryConsumedThisPayload", _NUMBER), ("battery", "connectCount", _NUMBER),
+          ("battery", "connAttemptCount", _NUMBER), ("battery", "sendCount", _NUMBER),
+          ("battery", "sendIntervalSec", _NUMBER), ("battery", "firmwareUpdateCount", _NUMBER),
+          ("battery", "payloadSizeBytes", _NUMBER), ("battery", "retryCount", _NUMBER),
+          ("battery", "wifiRSSI", _NUMBER),
+          ("behaviour", "connectionPattern", str),
+          ("anomaly", "sensorJump", None), ("anomaly", "batterySpike", None), ("anomaly", "tampering", None))
+
+_WS = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+class IngestError(ValueError):
+    """The body can't be parsed past this point (items before it are still valid)."""
+    pass
+
+class MalformedLogError(ValueError):
+    """A batch was refused because of one log (see log_error), before any device state changed."""
+    pass
+
+def log_error(log):
+    """-> None if the pipeline can score `log`, else what is wrong with it (missing / mistyped inner fields)."""
+    if not isinstance(log, dict): return "Expected a JSON object"
+    missing, wrong = [], []
+    for section, key, kind in FIELDS:
+        sec = log.get(section)
+        if not isinstance(sec, dict) or key not in sec: missing.append(f"{section}.{key}")
+        elif kind is not None and not isinstance(sec[key], kind): wrong.append(f"{section}.{key}")
+    if missing: return f"Missing field(s): {', '.join(missing)}"
+    if wrong: return f"Wrong type for field(s): {', '.join(wrong)}"
+    return None
+
+def check_log(obj):
+    """-> (log dict with just the HardwareLog sections, None) or (None, error message); inner fields via log_error."""
+    if not isinstance(obj, dict): return None, "Expected a JSON object"
+    missing = [k for k in SECTIONS if k not in obj]
+    if missing: return None, f"Missing field(s): {', '.join(missing)}"
+    bad = [k for k in SECTIONS if not isinstance(obj[k], dict)]
+    if bad: return None, f"Field(s) must be objects: {', '.join(bad)}"
+    why = log_error(obj)
+    if why: return None, why
+    return {k: obj[k] for k in SECTIONS}, None
+
+class LogStreamParser:
+    """
+    parser.feed(chunk) -> [item, ...]   (item = parsed JSON value, or an IngestError
+    for an NDJSON line that isn't valid JSON; the next line parses fine again)
+    parser.close()     -> whatever was left once the body ends.
+    A malformed JSON array can't be resynchronised, so that raises IngestError.
+    """
+    def __init__(self, max_item_bytes=MAX_ITEM_BYTES):
+        self.max_item_bytes = max_item_bytes
+        self.mode = None          # "array" / "ndjson"
+        self.items = 0
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._expect = "value"    # array mode: "value" / "sep" / "end"
+
+    def feed(self, chunk):
+        self._buf += self._utf8.decode(chunk)
+        return self._drain(final=False)
+
+    def close(self):
+        self._buf += self._utf8.decode(b"", final=True)
+        out = self._drain(final=True)
+        if self.mode == "array" and self._expect != "end": raise IngestError("JSON array is not closed")
+        return out
+
+    def _drain(self, final):
+        if self.mode is None:
+            start = len(self._buf) - len(self._buf.lstrip(_WS))
+            if start == len(self._buf): return []
+            self.mode = "array" if self._buf[start] == "[" else "ndjson"
+            if self.mode == "array":
+                self._buf = self._buf[start + 1:]
+        return self._drain_array(final) if self.mode == "array" else self._drain_ndjson(final)
+
+    def _drain_ndjson(self, final):
+        out = []
+        lines = self._buf.split("\n")
+        self._buf = "" if final else lines.pop()
+        if len(self._buf) > self.max_item_bytes: raise IngestError(f"Line {self.items} exceeds {self.max_item_bytes} bytes")
+        for line in lines:
+            line = line.strip(_WS)
+            if not line: continue
+            try: out.append(json.loads(line))
+            except ValueError as e: out.append(IngestError(f"Invalid JSON: {e}"))
+            self.items += 1
+        return out
+
+    def _drain_array(self, final):
+        out, buf, pos = [], self._buf, 0
+        while True:
+            while pos < len(buf) and buf[pos] in _WS: pos += 1
+            if pos == len(buf): break
+            if self._expect == "end":
+                raise IngestError("Data after the end of the JSON array")
+            if self._expect == "sep":
+                ch = buf[pos]
+                if ch not in ",]": raise IngestError(f"Expected ',' or ']' after item {self.items - 1}")
+                pos += 1
+                self._expect = "value" if ch == "," else "end"
+                continue
+            if buf[pos] == "]" and self.items == 0:
+                pos += 1
+                self._expect = "end"
+                continue
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+            except ValueError as e:
+                # Usually just an item split across chunks: wait for more unless it can't be that
+                if final or len(buf) - pos > self.max_item_bytes:
+                    raise IngestError(f"Invalid JSON in item {self.items}: {e}") from None
+                break
+            if end == len(buf) and not final and not isinstance(value, (dict, list)):
+                break # A number or literal cut by the chunk boundary
+            out.append(value)
+            self.items += 1
+            self._expect = "sep"
+            pos = end
+        self._buf = buf[pos:]
+        return out
+
+# --- SELF-CHECK ---
+#   python bulk_ingest.py
+if __name__ == "__main__":
+    import time
+    from fleet_sim import FleetGenerator
+
+    logs = FleetGenerator(20, "mixed", seed=3).take(500)
+    body_array = json.dumps(logs, indent=1).encode()
+    body_ndjson = "".join(json.dumps(l) + "\n" for l in logs).encode()
+
+    def parse(body, step):
+        p, out = LogStreamParser(), []
+        for i in range(0, len(body), step): out += p.feed(body[i:i + step])
+        return out + p.close()
+
+    for step in (1, 7, 4096, len(body_array)):
+        assert parse(body_array, step) == logs, f"array, chunk {step}"
+        assert parse(body_ndjson, step) == logs, f"ndjson, chunk {step}"
+    assert parse(b"[]", 1) == [] and parse(b"", 4) == [] and parse(b' [ 1 , "\xc3\xa9" ] ', 1) == [1, "é"]
+
+    mixed = parse(b'{"a": 1}\nnot json\n{"b": 2}', 3)
+    assert mixed[0] == {"a": 1} and isinstance(mixed[1], IngestError) and mixed[2] == {"b": 2}
+    for broken in (b'[{"a": 1} {"b": 2}]', b'[{"a": 1},', b'[{"a": 1}] x', b'[{"a": tru}]'):
+        try: parse(broken, 2); raise AssertionError(f"accepted {broken!r}")
+        except IngestError: pass
+    assert check_log(logs[0])[1] is None and check_log({"telemetry": {}})[0] is None
+    assert check_log(dict(logs[0], telemetry=5))[1].startswith("Field(s) must be objects")
+    assert log_error(logs[0]) is None and log_error([]) == "Expected a JSON object"
+    bad = dict(logs[0], anomaly={}, telemetry=dict(logs[0]["telemetry"], temperature="hot"))
+    assert log_error(bad).startswith("Missing field(s): anomaly.sensorJump, anomaly.batterySpike, anomaly.tampering")
+    assert log_error(dict(bad, anomaly=logs[0]["anomaly"])) == "Wrong type for field(s): telemetry.temperature"
+    assert check_log(bad) == (None, log_error(bad))
+    print("✅ Stream parser OK (array + NDJSON, any chunking, per-line errors, broken arrays rejected)")
+
+    for label, body in (("JSON array", body_array), ("NDJSON", body_ndjson)):
+        t0 = time.perf_counter()
+        for _ in range(20): parse(body, 64 * 1024)
+        dt = (time.perf_counter() - t0) / 20
+        print(f"   {label:<11} {len(logs) / dt:>10,.0f} logs/s ({len(body) / dt / 1e6:.0f} MB/s) in 64 KB chunks")
@@ -0,0 +1,154 @@
+import time
+import metrics
+from metrics import lap
+
+# --- DEVICE COMMAND QUEUE ---
+# Every anomalous log asks for another LOCKDOWN and every low-battery log for
+# another DEEP_SLEEP, so a burst of bad telemetry used to queue hundreds of
+# identical commands (and even more while a flash held them back) ahead of an
+# operator's /act. Per device, this queue:
+#
+#   coalesces   a command already pending is not queued again (its priority is raised if needed)
+#   ranks       manual (/act) > security (LOCKDOWN) > automatic eco / everything else
+#   cools down  an automatic command sent less than its cooldown ago is suppressed
+#
+# Not thread-safe by itself: DeviceGateway uses it under the session lock.
+
+# --- CONFIGURATION ---
+MANUAL, SECURITY, ECO = 0, 1, 2              # Priority classes, lowest number is sent first
+PRIORITY_NAMES = {MANUAL: "manual", SECURITY: "security", ECO: "eco"}
+SECURITY_COMMANDS = {"LOCKDOWN"}             # Automatic commands that outrank eco ones
+COOLDOWN_SEC = {"LOCKDOWN": 5.0, "DEEP_SLEEP": 30.0} # Automatic repeats of these are suppressed meanwhile
+DEFAULT_COOLDOWN_SEC = 5.0
+MAX_PENDING = 32                             # Distinct commands waiting per device
+
+QUEUED, COALESCED, SUPPRESSED, DROPPED = "queued", "coalesced", "suppressed", "dropped"
+
+# --- INSTRUMENTATION ---
+_COMMANDS = metrics.counter("cerberus_commands_total", "Device commands offered to the queue, by outcome.", ("outcome",))
+OUTCOMES = {o: _COMMANDS.labels(o) for o in (QUEUED, COALESCED, SUPPRESSED, DROPPED)}
+COMMANDS_SENT = _COMMANDS.labels("sent")
+_LATENCY = metrics.histogram("cerberus_command_latency_seconds", "First request of a command -> handed to the link.",
+                             ("priority",))
+LATENCY = {p: _LATENCY.labels(name) for p, name in PRIORITY_NAMES.items()}
+
+def priority_of(cmd, manual=False):
+    if manual: return MANUAL
+    return SECURITY if cmd in SECURITY_COMMANDS else ECO
+
+class _Pending:
+    __slots__ = ("cmd", "priority", "seq", "t0", "requests")
+
+    def __init__(self, cmd, priority, seq, t0):
+        self.cmd = cmd
+        self.priority = priority
+        self.seq = seq
+        self.t0 = t0            # perf_counter of the first request
+        self.requests = 1
+
+class CommandQueue:
+    """
+    `q.push("LOCKDOWN")` -> "queued" / "coalesced" / "suppressed" / "dropped"
+    `q.pop_all()`        -> pending commands, highest priority first (FIFO within a class)
+    """
+    def __init__(self, max_pending=MAX_PENDING, cooldowns=None, clock=time.monotonic):
+        self.max_pending = max_pending
+        self.cooldowns = COOLDOWN_SEC if cooldowns is None else cooldowns
+        self.clock = clock
+        self._pending = {}      # cmd -> _Pending
+        self._last_sent = {}    # cmd -> clock() when it was last handed to the link
+        self._seq = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.suppressed = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push(self, cmd, manual=False):
+        priority = priority_of(cmd, manual)
+        entry = self._pending.get(cmd)
+        if entry is not None:
+            entry.requests += 1
+            entry.priority = min(entry.priority, priority)
+            self.coalesced += 1
+            OUTCOMES[COALESCED].inc()
+            return COALESCED
+        if not manual:
+            last = self._last_sent.get(cmd)
+            if last is not None and self.clock() - last < self.cooldowns.get(cmd, DEFAULT_COOLDOWN_SEC):
+                self.suppressed += 1
+                OUTCOMES[SUPPRESSED].inc()
+                return SUPPRESSED
+        if len(self._pending) >= self.max_pending:
+            worst = max(self._pending.values(), key=lambda e: (e.priority, e.seq))
+            if worst.priority <= priority: # Nothing less important to make room with
+                self.dropped += 1
+                OUTCOMES[DROPPED].inc()
+                return DROPPED
+            del self._pending[worst.cmd]
+            self.dropped += 1
+            OUTCOMES[DROPPED].inc()
+        self._seq += 1
+        self._pending[cmd] = _Pending(cmd, priority, self._seq, time.perf_counter())
+        OUTCOMES[QUEUED].inc()
+        return QUEUED
+
+    def pop_all(self):
+        if not self._pending: return []
+        entries = sorted(self._pending.values(), key=lambda e: (e.priority, e.seq))
+        self._pending.clear()
+        now = self.clock()
+        for e in entries:
+            self._last_sent[e.cmd] = now
+            lap(LATENCY[e.priority], e.t0)
+        self.sent += len(entries)
+        COMMANDS_SENT.inc(len(entries))
+        return [e.cmd for e in entries]
+
+    def pending(self):
+        return [{"command": e.cmd, "priority": PRIORITY_NAMES[e.priority], "requests": e.requests,
+                 "waiting_ms": (time.perf_counter() - e.t0) * 1000}
+                for e in sorted(self._pending.values(), key=lambda e: (e.priority, e.seq))]
+
+    def stats(self):
+        return {"pending": len(self._pending), "sent": self.sent, "coalesced": self.coalesced,
+                "suppressed": self.suppressed, "dropped": self.dropped}
+
+# --- SELF-CHECK ---
+#   python command_queue.py
+if __name__ == "__main__":
+    now = [0.0]
+    q = CommandQueue(max_pending=3, clock=lambda: now[0])
+
+    # A burst of anomalies + low battery, then the operator: one of each, operator first
+    outcomes = [q.push("DEEP_SLEEP") for _ in range(200)] + [q.push("LOCKDOWN") for _ in range(300)]
+    assert q.push("RESTART", manual=True) == QUEUED
+    assert outcomes.count(QUEUED) == 2 and outcomes.count(COALESCED) == 498
+    assert q.pop_all() == ["RESTART", "LOCKDOWN", "DEEP_SLEEP"] and len(q) == 0
+
+    # Cooldown: automatic repeats are suppressed until it expires, manual ones never are
+    now[0] = 1.0
+    assert q.push("LOCKDOWN") == SUPPRESSED and q.push("DEEP_SLEEP") == SUPPRESSED
+    assert q.push("LOCKDOWN", manual=True) == QUEUED
+    now[0] = 6.0
+    assert q.push("DEEP_SLEEP") == SUPPRESSED and q.pop_all() == ["LOCKDOWN"]
+    now[0] = 40.0
+    assert q.push("DEEP_SLEEP") == QUEUED
+
+    # A pending automatic command asked for manually moves up to the manual class
+    assert q.push("LOCKDOWN") == QUEUED and q.push("DEEP_SLEEP", manual=True) == COALESCED
+    assert q.pop_all() == ["DEEP_SLEEP", "LOCKDOWN"]
+
+    # Full: a manual command evicts the least important one, an eco one is refused
+    now[0] = 1000.0
+    for cmd in ("A", "B", "C"): q.push(cmd)
+    assert q.push("D") == DROPPED and q.push("STOP", manual=True) == QUEUED
+    assert q.pop_all() == ["STOP", "A", "B"]
+    print(f"✅ Command queue OK: {q.stats()}")
+
+    t0 = time.perf_counter()
+    for i in range(100_000): q.push("LOCKDOWN" if i & 1 else "DEEP_SLEEP")
+    dt = (time.perf_counter() - t0) / 100_000
+    print(f"   push() {dt * 1e6:.2f} µs per automatic command during a flood")
@@ -1,39 +1,84 @@
 import os
 import json
+import time
 import base64
+import struct
+import hashlib
+import threading
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
 from Crypto.Random import get_random_bytes
+import metrics
+from metrics import lap
 
 # --- CONFIGURATION ---
-# If you have actual liboqs installed, set this to FALSE
-SIMULATE_KYBER_FOR_DEMO = True 
+# Kyber is simulated on both ends (demo envelope). Real Kyber means swapping in
+# liboqs-python's oqs.KeyEncapsulation("Kyber512") for encapsulate AND decapsulate
+# together, with the receiver's key pair: one side alone can't talk to the other.
+ALGO = "Kyber512+AES256-GCM"
+
+# Session mode: one Kyber encapsulation per rotation window instead of per packet
+SESSION_MAX_PACKETS = 1000   # Rotate the AES key after this many packets...
+SESSION_MAX_AGE_SEC = 300    # ...or after 5 minutes, whichever comes first
+
+# --- INSTRUMENTATION ---
+_PHASE = metrics.histogram("cerberus_encrypt_phase_seconds", "Time per encryption phase.", ("phase",))
+PH_SERIALIZE, PH_KEM, PH_AES = (_PHASE.labels(p) for p in ("serialize", "kyber_encapsulate", "aes_gcm"))
+ENCRYPT_SECONDS = metrics.histogram("cerberus_encrypt_payload_seconds", "Total time per encrypt_payload call.").labels()
+
+class CryptoSession:
+    """
+    One AES-256 key + its Kyber blob, reused for a rotation window.
+    Nonces are [4 random bytes][8-byte counter], so they never repeat under a key.
+    """
+    def __init__(self, aes_key, key_blob, max_packets, max_age_sec):
+        self.aes_key = aes_key
+        self.key_blob = key_blob
+        self.key_blob_b64 = base64.b64encode(key_blob).decode('utf-8') # Encoded once, not per packet
+        self.key_id = hashlib.sha256(key_blob).hexdigest()[:16]
+        self.nonce_prefix = get_random_bytes(4)
+        self.counter = 0
+        self.created = time.monotonic()
+        self.max_packets = max_packets
+        self.max_age = max_age_sec
+
+    def expired(self):
+        return self.counter >= self.max_packets or time.monotonic() - self.created >= self.max_age
+
+    def next_nonce(self):
+        seq = self.counter
+        self.counter += 1
+        return seq, self.nonce_prefix + struct.pack(">Q", seq)
 
 class QuantumSecurityLayer:
-    def __init__(self):
+    def __init__(self, session_mode=False):
         print("🛡️ Initializing Post-Quantum Cryptography (Kyber-512)...")
+        # session_mode=True: encrypt_payload reuses one encapsulated key per rotation window
+        self.session_mode = session_mode
         # In a real app, you would load your Teammate's Public Key here
         self.teammate_public_key = b"simulate_public_key_bytes"
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.sessions_opened = 0
 
     def _kyber_encapsulate(self, aes_key):
         """
         Simulates Kyber-512 Key Encapsulation.
         In production, this uses 'oqs.KeyEncapsulation("Kyber512")'.
         """
-        if SIMULATE_KYBER_FOR_DEMO:
-            # HACKATHON MODE: We wrap the key in a dummy 'Kyber' envelope
-            # This looks exactly like real ciphertext to the receiver
-            # Structure: [Magic Header] + [AES Key] + [Noise]
-            fake_ciphertext = b"KYBER" + aes_key + os.urandom(16) 
-            shared_secret = aes_key # In real KEM, this is derived math
-            return fake_ciphertext, shared_secret
-        else:
-            # REAL CODE (Uncomment if you have liboqs-python installed)
-            # import oqs
-            # kem = oqs.KeyEncapsulation("Kyber512")
-            # ciphertext, shared_secret = kem.encap_secret(self.teammate_public_key)
-            # return ciphertext, shared_secret
-            pass
+        t = time.perf_counter()
+        # HACKATHON MODE: We wrap the key in a dummy 'Kyber' envelope
+        # This looks exactly like real ciphertext to the receiver
+        # Structure: [Magic Header] + [AES Key] + [Noise]
+        fake_ciphertext = b"KYBER" + aes_key + os.urandom(16) 
+        shared_secret = aes_key # In real KEM, this is derived math
+        lap(PH_KEM, t)
+        return fake_ciphertext, shared_secret
+
+    def _kyber_decapsulate(self, key_blob):
+        """Receiver side of the demo envelope."""
+        if not key_blob.startswith(b"KYBER"): raise ValueError("Not a Kyber key blob")
+        return key_blob[5:37]
 
     def encrypt_payload(self, json_data):
         """
@@ -41,14 +86,23 @@ class QuantumSecurityLayer:
         2. Encrypts Data with AES-GCM (Military Grade).
         3. Hides AES Key inside Kyber-512 (Quantum Grade).
         """
+        t0 = time.perf_counter()
+        if self.session_mode:
+            packet = self.encrypt_payload_session(json_data)
+            lap(ENCRYPT_SECONDS, t0)
+            return packet
+
         # A. Generate Session Key (AES-256)
         aes_key = get_random_bytes(32)
         
         # B. Encrypt Data (AES-GCM)
         cipher_aes = AES.new(aes_key, AES.MODE_GCM)
         # Convert JSON to string -> bytes
+        t = time.perf_counter()
         data_bytes = json.dumps(json_data).encode('utf-8')
+        t = lap(PH_SERIALIZE, t)
         ciphertext_data, tag = cipher_aes.encrypt_and_digest(data_bytes)
+        lap(PH_AES, t)
         
         # C. Encrypt the Key (Kyber-512)
         kyber_encapsulated_key, _ = self._kyber_encapsulate(aes_key)
@@ -56,10 +110,116 @@ class QuantumSecurityLayer:
         # D. Package for Node.js Server
         # We send Base64 strings so JSON doesn't break
         packet = {
-            "algo": "Kyber512+AES256-GCM",
+            "algo": ALGO,
             "kyber_key_blob": base64.b64encode(kyber_encapsulated_key).decode('utf-8'),
             "iv": base64.b64encode(cipher_aes.nonce).decode('utf-8'),
             "tag": base64.b64encode(tag).decode('utf-8'),
             "encrypted_data": base64.b64encode(ciphertext_data).decode('utf-8')
         }
-        return packet
\ No newline at end of file
+        lap(ENCRYPT_SECONDS, t0)
+        return packet
+
+    # --- SESSION MODE ---
+    def _current_session(self):
+        # Caller holds _session_lock
+        if self._session is None or self._session.expired():
+            aes_key = get_random_bytes(32)
+            key_blob, _ = self._kyber_encapsulate(aes_key)
+            self._session = CryptoSession(aes_key, key_blob, SESSION_MAX_PACKETS, SESSION_MAX_AGE_SEC)
+            self.sessions_opened += 1
+        return self._session
+
+    def _seal_raw(self, data_bytes, use_session, aad=None):
+        if use_session:
+            with self._session_lock:
+                session = self._current_session()
+                seq, nonce = session.next_nonce()
+        else:
+            aes_key = get_random_bytes(32)
+            key_blob, _ = self._kyber_encapsulate(aes_key)
+            session = CryptoSession(aes_key, key_blob, 1, 0)
+            seq, nonce = session.next_nonce()
+        t = time.perf_counter()
+        cipher_aes = AES.new(session.aes_key, AES.MODE_GCM, nonce=nonce)
+        if aad is not None: cipher_aes.update(aad(session, seq, nonce) if callable(aad) else aad)
+        ciphertext_data, tag = cipher_aes.encrypt_and_digest(data_bytes)
+        lap(PH_AES, t)
+        return session, seq, nonce, tag, ciphertext_data
+
+    def seal_bytes(self, data_bytes, aad=None):
+        """
+        AES-GCM seal raw bytes -> (session, seq, nonce, tag, ciphertext).
+        Session mode reuses the current key; otherwise a one-packet key is made.
+        `aad`: bytes authenticated but not encrypted, or fn(session, seq, nonce) -> bytes
+        for a header that carries the sequence number.
+        """
+        return self._seal_raw(data_bytes, self.session_mode, aad)
+
+    def open_bytes(self, key_blob, nonce, tag, ciphertext_data, aad=None):
+        """Inverse of seal_bytes (raises ValueError if the tag doesn't verify, associated data included)."""
+        aes_key = self._kyber_decapsulate(key_blob)
+        cipher_aes = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
+        if aad is not None: cipher_aes.update(aad)
+        return cipher_aes.decrypt_and_verify(ciphertext_data, tag)
+
+    def _seal(self, data_bytes):
+        """AES-GCM under the current session key with a counter nonce."""
+        session, seq, nonce, tag, ciphertext_data = self._seal_raw(data_bytes, True)
+        return {
+            "algo": ALGO,
+            "kyber_key_blob": session.key_blob_b64,
+            "key_id": session.key_id,  # Lets the receiver cache the decapsulated key
+            "seq": seq,
+            "iv": base64.b64encode(nonce).decode('utf-8'),
+            "tag": base64.b64encode(tag).decode('utf-8'),
+            "encrypted_data": base64.b64encode(ciphertext_data).decode('utf-8')
+        }
+
+    def encrypt_payload_session(self, json_data):
+        """Same packet shape as encrypt_payload, but the Kyber step is amortized over a session."""
+        t = time.perf_counter()
+        data_bytes = json.dumps(json_data).encode('utf-8')
+        lap(PH_SERIALIZE, t)
+        return self._seal(data_bytes)
+
+    def encrypt_batch(self, payloads):
+        """Seal many payloads into ONE envelope (plaintext is a JSON array)."""
+        packet = self._seal(json.dumps(list(payloads)).encode('utf-8'))
+        packet["count"] = len(payloads)
+        return packet
+
+    def decrypt_packet(self, packet):
+        """Inverse of encrypt_payload / encrypt_payload_session / encrypt_batch (verifies the tag)."""
+        data_bytes = self.open_bytes(base64.b64decode(packet["kyber_key_blob"]), base64.b64decode(packet["iv"]),
+                                     base64.b64decode(packet["tag"]), base64.b64decode(packet["encrypted_data"]))
+        return json.loads(data_bytes)
+
+# --- ROUND-TRIP CHECK & BENCHMARK ---
+#   python crypto_layer.py
+if __name__ == "__main__":
+    layer = QuantumSecurityLayer()
+    assert layer.decrypt_packet(QuantumSecurityLayer(session_mode=True).encrypt_payload({"a": 1})) == {"a": 1}
+    sample = {"device_id": "ESP32-001", "timestamp": 1700000000, "status": "BALANCED",
+              "reasoning": "Logic Trigger: System Nominal",
+              "metrics": {"anomaly_score": 0.042, "battery_prediction_hours": 123.4, "battery_status": "High"}}
+
+    # Round trips
+    assert layer.decrypt_packet(layer.encrypt_payload(sample)) == sample
+    packets = [layer.encrypt_payload_session(dict(sample, seq=i)) for i in range(50)]
+    assert [layer.decrypt_packet(p)["seq"] for p in packets] == list(range(50))
+    assert len({p["iv"] for p in packets}) == 50, "Nonce reused inside a session"
+    batch = [dict(sample, seq=i) for i in range(100)]
+    assert layer.decrypt_packet(layer.encrypt_batch(batch)) == batch
+    tampered = dict(packets[0], encrypted_data=packets[1]["encrypted_data"])
+    try: layer.decrypt_packet(tampered); raise AssertionError("Tampered packet was accepted")
+    except ValueError: pass
+    print("✅ Round-trip decrypt OK (per-packet, session, batch, tamper detection)")
+
+    # Throughput
+    n = 5000
+    def bench(label, fn):
+        t0 = time.perf_counter(); fn(); dt = time.perf_counter() - t0
+        print(f"   {label:<22} {n / dt:>10,.0f} payloads/s")
+    bench("per-packet (current)", lambda: [layer.encrypt_payload(sample) for _ in range(n)])
+    bench("session", lambda: [layer.encrypt_payload_session(sample) for _ in range(n)])
+    bench("batch of 100", lambda: [layer.encrypt_batch([sample] * 100) for _ in range(n // 100)])
@@ -1,242 +1,232 @@
-import serial
-import json
-import time
-import requests
 import threading
-import queue
-import os
 from datetime import datetime
-from fastapi import FastAPI, BackgroundTasks, HTTPException, UploadFile, File
+from typing import Optional
+from fastapi import FastAPI, BackgroundTasks, HTTPException
 from pydantic import BaseModel
 import uvicorn
 import uvicorn
 from iot_core import IoTIntelligenceCore
 from crypto_layer import QuantumSecurityLayer
+from envelope import encode_for_upload
+from uplink import Uplink
+from device_gateway import DeviceGateway
+from firmware_store import FirmwareStore
+from ota_rollout import RolloutScheduler, ROLLOUT_WAVES, ROLLOUT_MAX_CONCURRENT
+from scoring_pool import start_pool
+import telemetry_store
+from telemetry_store import TelemetryStore
+import metrics
 
 # --- CONFIGURATION ---
 SERIAL_PORT = "COM11"
+SERIAL_PORTS = {SERIAL_PORT: None} # port -> device id (None = learn it from the device's telemetry)
 BAUD_RATE = 115200
 NODE_SERVER_REPORT_URL = "http://10.89.204.138:3000/report/report"
 NODE_SERVER_ACTION_URL = "http://10.89.204.138:3000/api/action"
-CHUNK_SIZE = 1024
 DEFAULT_FIRMWARE_URL = "http://10.89.204.138:3000/file/firmware/latest"
-
-# --- SHARED STATE ---
-# This queue allows the API to talk to the Serial Thread safely
-command_queue = queue.Queue()
-ota_event = threading.Event()
+CRYPTO_SESSIONS = True # One Kyber encapsulation per key rotation window, not per report
+UPLINK_FORMAT = "json" # "binary" = compact envelope.py framing (Node server must accept it)
+UPLINK_BATCH_MAX = 1   # >1 = several reports per POST (JSON array / concatenated envelopes; Node server must accept it)
+STORE_TELEMETRY = True # Keep every serial log + analysis in .telemetry/ (telemetry_store.py)
+SCORING_WORKERS = 0    # N or "auto" = models run in scoring_pool worker processes (big batches split across cores)
 
 # Initialize Systems
 app = FastAPI(title="Cerberus Unified Gateway")
+app.include_router(metrics.fastapi_router()) # /metrics + /debug/profile
 brain = IoTIntelligenceCore()
-crypto = QuantumSecurityLayer()
-
-# --- OTA ENGINE (Handles the file streaming) ---
-def perform_ota_update(ser):
-    print("\n🔁 STARTING OTA FIRMWARE UPDATE...")
-    try:
-        file_path = "latest_firmware.bin"
-        
-        # 1. Validation
-        if not os.path.exists(file_path):
-            print("❌ Error: No firmware file found to flash.")
-            return
-
-        file_size = os.path.getsize(file_path)
-        
-        # 2. Handshake (Tell ESP32 to get ready)
-        print(f"   1. Sending OTA Start Command ({file_size} bytes)...")
-        # We send size so ESP32 knows when to stop
-        ser.write(f"OTA_START {file_size}\n".encode())
-        
-        # IMPORTANT: Wait for ESP32 to erase flash memory (takes 1-2s)
-        time.sleep(2) 
-        
-        # 3. Stream File
-        print("   2. Streaming Data...")
-        with open(file_path, "rb") as f:
-            chunk_num = 0
-            while True:
-                # Read 1KB chunk
-                chunk = f.read(CHUNK_SIZE)
-                if not chunk: break
-                
-                # Send Chunk
-                ser.write(chunk)
-                chunk_num += 1
-                
-                # FLOW CONTROL (Crucial for Bluetooth Serial)
-                # Bluetooth buffers are small. If we send too fast, packets get dropped.
-                # A small sleep allows the ESP32 to process the chunk.
-                time.sleep(0.05) 
-                
-                if chunk_num % 10 == 0:
-                    print(f"      -> Sent Chunk {chunk_num}...")
-
-        # 4. Finish
-        print("   3. Sending End Signal...")
-        time.sleep(1) # Ensure buffer is clear
-        ser.write(b"OTA_END\n")
-        print("✅ OTA UPDATE COMPLETE. Device Rebooting.")
-        
-    except Exception as e:
-        print(f"❌ OTA FAILED: {e}")
+analyzer = brain # .analyze_batch; a scoring_pool.OrderedPipeline once serial_engine starts the pool
+store = TelemetryStore() if STORE_TELEMETRY else None
+if store: app.include_router(telemetry_store.fastapi_router(store)) # /telemetry range scans
+crypto = QuantumSecurityLayer(session_mode=CRYPTO_SESSIONS)
+# Pooled senders (batching opt-in, UPLINK_BATCH_MAX): a slow Node server no longer stalls the serial reads
+report_uplink = Uplink(NODE_SERVER_REPORT_URL, name="reports", batch_max=UPLINK_BATCH_MAX)
+action_uplink = Uplink(NODE_SERVER_ACTION_URL, name="actions", batch_max=1)
+
+# --- ANALYSIS STAGE (runs on the gateway worker, never on the I/O loop) ---
+def process_logs(items):
+    # 1. Analyze (one vectorized pass for everything that arrived together, from every device)
+    logs = [log for _, log in items]
+    results = analyzer.analyze_batch(logs)
+
+    for (session, log_data), ai_result in zip(items, results):
+        if store: store.append(log_data, ai_result)
+
+        # 2. Auto-Action (back to the device that sent the log)
+        if ai_result['status'] == "SECURITY_PRIORITY":
+            gateway.send_command(session.port, "LOCKDOWN")
+        elif ai_result['status'] == "ECO_SAVER":
+            gateway.send_command(session.port, "DEEP_SLEEP")
+
+        # 3. Prepare & Encrypt
+        full_payload = log_data.copy()
+        full_payload["cerberus_analysis"] = {
+            "decision": ai_result['status'],
+            "reasoning": ai_result['explanation'],
+            "metrics": ai_result['metrics'],
+            "processed_at": datetime.now().isoformat()
+        }
+        body, headers = encode_for_upload(crypto, full_payload, UPLINK_FORMAT)
+
+        # 4. Send to Cloud (queued; retried / spooled by the uplink)
+        report_uplink.send(body, headers)
+
+# --- SERIAL HANDLER (One I/O loop for every device) ---
+# Links are read/written by a single selector thread; each device has its own
+# command queue and OTA state, so flashing one never stalls the others.
+gateway = DeviceGateway(process_logs)
+# Content-addressed image cache (images an OTA is still reading are never evicted)
+firmware = FirmwareStore(in_use=gateway.active_ota_paths)
+rollouts = RolloutScheduler(gateway, firmware)
 
-# --- SERIAL HANDLER (Updated Main Loop) ---
 def serial_engine():
-    print(f"⚡ Opening Serial Connection on {SERIAL_PORT}...")
-    try:
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1)
-        print("✅ Serial Online.")
-    except Exception as e:
-        print(f"❌ Serial Failed: {e}")
-        return
-
-    while True:
-        # --- PRIORITY 1: CHECK FOR OTA REQUEST (New) ---
-        # If the API triggered an update, we pause everything else
-        if ota_event.is_set():
-            perform_ota_update(ser)
-            ota_event.clear() # Reset flag so we go back to normal mode
-            continue # Skip the rest of the loop to let device reboot
-
-        # --- PRIORITY 2: WRITE ACTIONS (Existing) ---
-        if not command_queue.empty():
-            cmd = command_queue.get()
-            try:
-                print(f"   ⚡ SENDING ACTION: {cmd}")
-                ser.write(f"{cmd}\n".encode())
-            except Exception as e:
-                print(f"   ❌ Write Error: {e}")
-
-        # --- PRIORITY 3: READ TELEMETRY (Existing) ---
+    global analyzer
+    if SCORING_WORKERS: analyzer = start_pool(brain, SCORING_WORKERS)
+    for port, device_id in SERIAL_PORTS.items():
+        print(f"⚡ Opening Serial Connection on {port}...")
         try:
-            if ser.in_waiting > 0:
-                line = ser.readline().decode('utf-8').strip()
-                if not line.startswith("{"): continue
-
-                # 1. Parse & Analyze
-                log_data = json.loads(line)
-                ai_result = brain.analyze(log_data)
-
-                # 2. Auto-Action
-                if ai_result['status'] == "SECURITY_PRIORITY":
-                    command_queue.put("LOCKDOWN")
-                elif ai_result['status'] == "ECO_SAVER":
-                    command_queue.put("DEEP_SLEEP")
-
-                # 3. Prepare & Encrypt
-                full_payload = log_data.copy()
-                full_payload["cerberus_analysis"] = {
-                    "decision": ai_result['status'],
-                    "reasoning": ai_result['explanation'],
-                    "metrics": ai_result['metrics'],
-                    "processed_at": datetime.now().isoformat()
-                }
-                secure_packet = crypto.encrypt_payload(full_payload)
-
-                # 4. Send to Cloud
-                try:
-                    requests.post(NODE_SERVER_REPORT_URL, json=secure_packet)
-                except: pass
-
+            gateway.open_link(port, BAUD_RATE, device_id)
+            print(f"✅ Serial Online ({port}).")
         except Exception as e:
-            pass
-        
-        time.sleep(0.05)
+            print(f"❌ Serial Failed on {port}: {e}")
+    gateway.start()
+
+def resolve_device(device_id):
+    """Session for `device_id`; with a single link the id may be omitted (older dashboard calls)."""
+    if device_id is None:
+        sessions = gateway.sessions()
+        if len(sessions) != 1: raise HTTPException(status_code=400, detail="device_id is required")
+        return sessions[0]
+    try: return gateway.session(device_id)
+    except KeyError: raise HTTPException(status_code=404, detail=f"Unknown device {device_id}")
 
 # --- API ENDPOINTS (The Interface) ---
 
 class ActionRequest(BaseModel):
     action_type: str  # e.g., "RESTART", "LOCKDOWN", "BLINK_LED"
     reason: str       # "Manual override by admin"
+    device_id: Optional[str] = None # Target device (deviceId or serial port)
 
-def notify_node_of_action(action, reason):
+def notify_node_of_action(action, reason, device_id=None):
     """Tells the Node server that an action was taken"""
     payload = {
         "event": "ACTION_TAKEN",
+        "device_id": device_id,
         "action": action,
         "initiator": "API_REQUEST",
         "reason": reason,
         "timestamp": datetime.now().isoformat()
     }
     # Encrypt this too so the dashboard is secure!
-    secure = crypto.encrypt_payload(payload)
-    try:
-        requests.post(NODE_SERVER_ACTION_URL, json=secure)
-        print("   ☁️  Action Logged to Cloud")
-    except:
-        print("   ⚠️ Failed to log action to cloud")
+    body, headers = encode_for_upload(crypto, payload, UPLINK_FORMAT)
+    if action_uplink.send(body, headers):
+        print("   ☁️  Action Queued for Cloud")
+    else:
+        print("   ⚠️ Uplink backlog full, action spooled to disk")
 
 class FirmwareRequest(BaseModel):
     url: str = DEFAULT_FIRMWARE_URL
+    device_id: Optional[str] = None # Device to flash (deviceId or serial port)
 
 @app.post("/trigger-ota-pull")
 async def trigger_update(req: FirmwareRequest):
     """
-    1. Downloads .bin from Node Server.
-    2. Saves it as 'latest_firmware.bin'.
-    3. Tells Serial Engine to flash it.
+    1. Downloads .bin from Node Server (without blocking the event loop).
+    2. Saves it in the firmware cache as '<sha256>.bin'.
+    3. Queues a flash of that device (the other devices keep running).
     """
-    print(f"\n📥 INITIATING OTA PULL FROM: {req.url}")
+    session = resolve_device(req.device_id)
+    print(f"\n📥 INITIATING OTA PULL FOR {session.key} FROM: {req.url}")
     
     try:
-        # 1. Download
-        with requests.get(req.url, stream=True) as r:
-            r.raise_for_status()
-            with open("latest_firmware.bin", "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192): 
-                    f.write(chunk)
-        
-        size = os.path.getsize("latest_firmware.bin")
-        print(f"   💾 Downloaded {size} bytes.")
-        
-        # 2. Trigger Flash
-        ota_event.set()
+        # 1. Download (streamed on the event loop into the hash-named cache)
+        image = await firmware.fetch(req.url)
+        print(f"   💾 Downloaded {image.size} bytes ({image.sha256[:12]}).")
+    except Exception as e:
+        print(f"   ❌ Download Failed: {e}")
+        raise HTTPException(status_code=400, detail=f"Download Failed: {e}")
         
-        return {"status": "OTA Started", "file_size": size}
+    try:
+        # 2. Trigger Flash (the image is fine from here on: a failure is the gateway's / device's)
+        job = gateway.start_ota(session.port, image.path)
+    except Exception as e:
+        print(f"   ❌ OTA could not start on {session.key}: {e}")
+        raise HTTPException(status_code=503, detail=f"OTA could not start on {session.key}: {e}")
         
+    return {"status": "OTA Started", "device_id": session.key, "file_size": image.size,
+            "sha256": image.sha256, "ota": job.report()}
+
+class RolloutRequest(BaseModel):
+    url: str = DEFAULT_FIRMWARE_URL
+    sha256: Optional[str] = None            # Flash an image already in the cache instead of downloading
+    device_ids: Optional[list[str]] = None  # Default: every online device
+    waves: list[float] = list(ROLLOUT_WAVES)
+    max_concurrent: int = ROLLOUT_MAX_CONCURRENT
+
+@app.post("/rollouts")
+async def start_rollout(req: RolloutRequest):
+    """Push one image to many devices in staged waves (canary first)."""
+    try:
+        image = firmware.get(req.sha256) if req.sha256 else await firmware.fetch(req.url)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Firmware {req.sha256} is not cached")
     except Exception as e:
-        print(f"   ❌ Download Failed: {e}")
         raise HTTPException(status_code=400, detail=str(e))
+    devices = req.device_ids or [s.key for s in gateway.sessions() if s.online]
+    if not devices: raise HTTPException(status_code=400, detail="No devices to flash")
+    ro = rollouts.start(image, devices, waves=req.waves, max_concurrent=max(1, req.max_concurrent))
+    return ro.report()
+
+@app.get("/rollouts")
+async def list_rollouts():
+    return rollouts.stats()
+
+@app.get("/rollouts/{rollout_id}")
+async def rollout_status(rollout_id: str):
+    try: return rollouts.get(rollout_id).report()
+    except KeyError: raise HTTPException(status_code=404, detail="Unknown rollout")
+
+@app.post("/rollouts/{rollout_id}/cancel")
+async def cancel_rollout(rollout_id: str):
+    try: return rollouts.cancel(rollout_id).report()
+    except KeyError: raise HTTPException(status_code=404, detail="Unknown rollout")
+
+@app.get("/firmware")
+async def firmware_cache():
+    return {"images": [i.report() for i in firmware.images()], **firmware.stats()}
 
 @app.post("/act")
 async def take_action(req: ActionRequest, background_tasks: BackgroundTasks):
     """
     ENDPOINT: Tells the hardware to do something via Bluetooth.
-    Example Body: { "action_type": "FORCE_RESET", "reason": "Demo" }
+    Example Body: { "action_type": "FORCE_RESET", "reason": "Demo", "device_id": "ESP32-001" }
     """
-    print(f"\n🎮 API RECEIVED COMMAND: {req.action_type}")
+    session = resolve_device(req.device_id)
+    print(f"\n🎮 API RECEIVED COMMAND for {session.key}: {req.action_type}")
     
-    # 1. Add to Queue (The Serial Thread will pick this up instantly)
-    command_queue.put(req.action_type)
+    # 1. Add to that device's queue, ahead of automatic commands (the I/O loop writes it right away, or after its OTA)
+    outcome = gateway.send_command(session.port, req.action_type, manual=True)
+    if outcome == "dropped": raise HTTPException(status_code=503, detail=f"Command queue of {session.key} is full")
     
     # 2. Notify Cloud (Background)
-    background_tasks.add_task(notify_node_of_action, req.action_type, req.reason)
+    background_tasks.add_task(notify_node_of_action, req.action_type, req.reason, session.key)
     
-    return {"status": "Queued", "command": req.action_type}
-
-# --- STARTUP ---
-    """
-    Node.js sends the .bin file here.
-    We save it and trigger the Serial Engine to flash it.
-    """
-    try:
-        print(f"\n📥 RECEIVED FIRMWARE: {file.filename}")
-        
-        # 1. Save File Locally
-        with open("latest_firmware.bin", "wb") as f:
-            content = await file.read()
-            f.write(content)
-            
-        print("   💾 Saved to disk. Queuing Update...")
-        
-        # 2. Trigger the Serial Loop
-        ota_event.set()
-        
-        return {"status": "Update Queued", "size": len(content)}
-    except Exception as e:
-        return {"status": "Error", "detail": str(e)}
+    return {"status": "Queued", "command": req.action_type, "device_id": session.key, "queue": outcome}
+
+@app.get("/uplink")
+async def uplink_status():
+    """Queue depth, in-flight requests, retries, spool & drops for both uplinks."""
+    return {"reports": report_uplink.stats(), "actions": action_uplink.stats()}
+
+@app.get("/serial")
+async def serial_status():
+    """Per-device link counters, command queues and OTA progress."""
+    return gateway.stats()
+
+@app.get("/devices/{device_id}")
+async def device_status(device_id: str):
+    session = resolve_device(device_id)
+    with session.lock: pending = session.commands.pending()
+    return {**session.stats(), "commands_queued": pending}
 
 # --- STARTUP ---
 if __name__ == "__main__":
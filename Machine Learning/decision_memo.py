@@ -0,0 +1,175 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import metrics
+
+# --- DECISION MEMO ---
+# Most reports from a healthy device say what its last one said. Per device we
+# keep the last fully computed report together with the inputs it came from:
+#
+#   fingerprint  exact: Sentinel feature row (binary flags), eco threshold
+#   band         continuous: Analyst features + battery %, each within abs + rel * |last value|
+#
+# A report that matches both is answered from the memo: no Sentinel, no Analyst,
+# no governor. Its explanation is looked up again (the LLM sentence may have
+# landed since the entry was stored), so entries keep their trigger. Hard-rule hits (tampering, overheat) never look here
+# and wipe the device's entry. The band is centred on the last *computed* input,
+# so drift adds up until it leaves the band; MAX_AGE_SEC / MAX_REUSES bound how
+# long one answer can be repeated at all. IoTIntelligenceCore clears the memo when
+# a model is hot-reloaded.
+
+# --- CONFIGURATION ---
+MAX_AGE_SEC = 60.0     # Recompute a device's report at least this often
+MAX_REUSES = 50        # ...and after this many answers from the memo
+MAX_DEVICES = 50000    # Least-recently-seen devices are forgotten first
+
+HIT, MISS, STALE, BYPASS = "hit", "miss", "stale", "bypass"
+
+_LOOKUPS = metrics.counter("cerberus_decision_memo_total", "Decision memo lookups, by outcome.", ("outcome",))
+OUTCOMES = {o: _LOOKUPS.labels(o) for o in (HIT, MISS, STALE, BYPASS)}
+
+class _Entry:
+    __slots__ = ("key", "bounds", "report", "trigger", "at", "reuses")
+
+class DecisionMemo:
+    """
+    `memo.lookup(device, key, vec)` -> (copy of the last report, its trigger), or None (compute it, then `memo.store(...)`)
+    `memo.bypass(device)`           -> hard rule fired: forget the device
+    """
+    def __init__(self, abs_tol, rel_tol, max_age_sec=MAX_AGE_SEC, max_reuses=MAX_REUSES,
+                 max_devices=MAX_DEVICES, clock=time.monotonic):
+        self.abs_tol = np.asarray(abs_tol, dtype=np.float64)
+        self.rel_tol = np.asarray(rel_tol, dtype=np.float64)
+        self.max_age = max_age_sec
+        self.max_reuses = max_reuses
+        self.max_devices = max_devices
+        self.clock = clock
+        self._entries = OrderedDict() # device -> _Entry
+        self._lock = threading.Lock()
+        self.counts = {o: 0 for o in OUTCOMES}
+
+    def lookup(self, device, key, vec):
+        return self.lookup_batch([device], [key], np.asarray([vec], dtype=np.float64))[0]
+
+    def lookup_batch(self, devices, keys, vecs):
+        """lookup() for a whole batch, band check in one NumPy pass -> [(report copy, trigger) or None, ...]."""
+        out = [None] * len(devices)
+        stale = 0
+        with self._lock:
+            entries = [self._entries.get(d) for d in devices]
+            cand = [i for i, e in enumerate(entries) if e is not None and e.key == keys[i]]
+            if cand:
+                bounds = np.array([entries[i].bounds for i in cand]) # (n, 2, features): low, high
+                v = vecs[cand]
+                inside = ((v >= bounds[:, 0]) & (v <= bounds[:, 1])).all(axis=1)
+                now = self.clock()
+                for i, ok in zip(cand, inside.tolist()):
+                    if not ok: continue
+                    e = entries[i]
+                    if e.reuses >= self.max_reuses or now - e.at > self.max_age:
+                        stale += 1
+                        continue
+                    e.reuses += 1
+                    self._entries.move_to_end(devices[i])
+                    out[i] = e
+        hits = sum(r is not None for r in out)
+        for outcome, k in ((HIT, hits), (STALE, stale), (MISS, len(out) - hits - stale)):
+            if k:
+                self.counts[outcome] += k
+                OUTCOMES[outcome].inc(k)
+        return [None if e is None else (dict(e.report, metrics=dict(e.report["metrics"])), e.trigger) for e in out]
+
+    def store(self, device, key, vec, report, trigger=None):
+        self.store_batch([device], [key], np.asarray([vec], dtype=np.float64), [report], [trigger])
+
+    def store_batch(self, devices, keys, vecs, reports, triggers=None):
+        """`triggers`: what the governor decided on, so a reused report's explanation can be looked up again."""
+        vecs = np.asarray(vecs, dtype=np.float64)
+        band = self.abs_tol + self.rel_tol * np.abs(vecs)
+        bounds = np.stack([vecs - band, vecs + band], axis=1)
+        now = self.clock()
+        with self._lock:
+            for device, key, b, report, trigger in zip(devices, keys, bounds, reports, triggers or [None] * len(reports)):
+                e = _Entry()
+                e.key, e.bounds, e.trigger, e.at, e.reuses = key, b, trigger, now, 0
+                e.report = dict(report, metrics=dict(report["metrics"]))
+                self._entries[device] = e
+                self._entries.move_to_end(device)
+            while len(self._entries) > self.max_devices: self._entries.popitem(last=False)
+
+    def bypass(self, device):
+        with self._lock:
+            self._entries.pop(device, None)
+        self.counts[BYPASS] += 1
+        OUTCOMES[BYPASS].inc()
+
+    def clear(self):
+        with self._lock: self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        looked = self.counts[HIT] + self.counts[MISS] + self.counts[STALE]
+        return {"devices": len(self._entries), **self.counts,
+                "hit_rate": round(self.counts[HIT] / looked, 4) if looked else None}
+
+# --- SELF-CHECK ---
+#   python decision_memo.py
+if __name__ == "__main__":
+    from fleet_sim import FleetGenerator
+    from iot_core import IoTIntelligenceCore
+    from reasoning import StubLLMClient
+
+    now = [0.0]
+    memo = DecisionMemo([0, 1.0], [0, 0.1], max_age_sec=10, max_reuses=2, clock=lambda: now[0])
+    report = {"status": "BALANCED", "metrics": {"anomaly_score": 0.1}}
+    memo.store("d", "k", [3, 100], report, "System Nominal")
+    assert memo.lookup("d", "k", np.array([3, 110.5])) == (report, "System Nominal") # Inside the band
+    assert memo.lookup("d", "k", np.array([4, 100])) is None          # Exact feature moved
+    assert memo.lookup("d", "other", np.array([3, 100])) is None      # Fingerprint differs
+    got, _ = memo.lookup("d", "k", np.array([3, 100]))
+    got["metrics"]["anomaly_score"] = 9                               # Callers get copies
+    assert memo.lookup("d", "k", np.array([3, 100])) is None and memo.counts[STALE] == 1 # 2 reuses max
+    memo.store("d", "k", [3, 100], report)
+    now[0] = 11.0
+    assert memo.lookup("d", "k", np.array([3, 100])) is None and memo.counts[STALE] == 2 # Too old
+    memo.bypass("d")
+    assert len(memo) == 0
+    print(f"✅ Memo band / fingerprint / staleness OK: {memo.stats()}")
+
+    # Simulated fleet: same decisions as a full re-score on almost every log, hard rules untouched
+    logs = FleetGenerator(200, "normal", seed=5).take(20_000) # As generated, nothing smoothed out
+    results, brains = {}, {}
+    for label, memo_on in (("full", False), ("memo", True)) * 2: # Best of two, the first pass warms caches
+        brain = IoTIntelligenceCore(llm_client=StubLLMClient())
+        if not memo_on: brain.memo = None
+        brain.analyze_batch(logs[:64]) # Load models outside the timing
+        brain.device_states = type(brain.device_states)()
+        if brain.memo is not None: brain.memo.clear()
+        t0 = time.perf_counter()
+        out = [r for i in range(0, len(logs), 64) for r in brain.analyze_batch(logs[i:i + 64])]
+        dt = time.perf_counter() - t0
+        brains[label] = brain
+        if label not in results or dt < results[label][1]:
+            results[label] = (out, dt, brain.memo.stats() if brain.memo else None)
+    full, memo_out = results["full"][0], results["memo"][0]
+    hard = [i for i, log in enumerate(logs) if log["anomaly"]["tampering"] or log["telemetry"]["temperature"] > 80]
+    assert all(full[i]["status"] == memo_out[i]["status"] == "SECURITY_PRIORITY" for i in hard)
+    same = sum(a["status"] == b["status"] for a, b in zip(full, memo_out)) / len(logs)
+    hours_err = np.mean([abs(a["metrics"]["battery_prediction_hours"] - b["metrics"]["battery_prediction_hours"])
+                         / max(1.0, a["metrics"]["battery_prediction_hours"]) for a, b in zip(full, memo_out)])
+    stats = results["memo"][2]
+    assert same > 0.99, f"only {same:.2%} of decisions agree"
+    print(f"✅ {len(logs):,} logs from 200 simulated devices (\"normal\" mix): hit rate {stats['hit_rate']:.1%}, "
+          f"{same:.2%} same decision, battery hours off by {hours_err:.1%} on average, {len(hard)} hard-rule logs exact")
+    # Reused reports pick up the LLM sentence once it has landed, not the placeholder stored with them
+    brain = IoTIntelligenceCore(llm_client=StubLLMClient(latency_sec=0.05))
+    first = brain.analyze_batch(logs[:200]) # 200 devices, explanations still being generated
+    assert all(r["explanation"].startswith("Logic Trigger") for r in first)
+    while brain.reasoner.stats()["pending"]: time.sleep(0.01)
+    again = brain.analyze_batch(logs[:200]) # Same inputs: reused, or recomputed under a cached key
+    assert brain.memo.counts[HIT] and not [r for r in again if r["explanation"].startswith("Logic Trigger")]
+    print(f"   full pipeline {len(logs) / results['full'][1]:,.0f} logs/s | with memo "
+          f"{len(logs) / results['memo'][1]:,.0f} logs/s")
@@ -0,0 +1,417 @@
+import os
+import json
+import time
+import queue
+import socket
+import selectors
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from serial_pipeline import LineFramer, CONTROL_PREFIX, CONTROL_QUEUE_SIZE, LOG_QUEUE_SIZE, BATCH_MAX
+from ota_protocol import OtaTransfer, OtaNotSupported, legacy_stream
+from command_queue import CommandQueue
+import metrics
+from metrics import lap
+
+# --- CONFIGURATION ---
+OTA_WORKERS = 2           # Devices flashed at the same time (the rest wait in QUEUED)
+OTA_ATTEMPTS = 3          # Windowed OTA retries (each one resumes from the last ACKed byte)
+POLL_SEC = 0.02           # Wake-up for links select() can't watch (COM ports on Windows)
+MAX_READ = 65536
+
+# --- INSTRUMENTATION ---
+SERIAL_READ = metrics.histogram("cerberus_serial_read_seconds", "Serial read + framing + JSON parse, per readable event.").labels()
+SERIAL_WRITE = metrics.histogram("cerberus_serial_write_seconds", "Serial write call, per flush.").labels()
+SERIAL_HANDLE = metrics.histogram("cerberus_serial_handle_seconds", "Analysis/encryption of one batch of serial logs.").labels()
+_SERIAL_BYTES = metrics.counter("cerberus_serial_bytes_total", "Bytes moved over serial links.", ("direction",))
+BYTES_IN, BYTES_OUT = _SERIAL_BYTES.labels("in"), _SERIAL_BYTES.labels("out")
+LOG_QUEUE = metrics.gauge("cerberus_serial_log_queue", "Parsed logs waiting for analysis.", ("gateway",))
+COMMAND_QUEUE = metrics.gauge("cerberus_command_queue_depth", "Device commands waiting to be written.", ("gateway",))
+
+# OTA state machine, one per device:  IDLE -> QUEUED -> FLASHING -> DONE | FAILED
+OTA_IDLE, OTA_QUEUED, OTA_FLASHING, OTA_DONE, OTA_FAILED = "IDLE", "QUEUED", "FLASHING", "DONE", "FAILED"
+
+class OtaJob:
+    def __init__(self, path):
+        self.path = path
+        self.state = OTA_QUEUED
+        self.transfer = None
+        self.attempts = 0
+        self.error = None
+        self.stats = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def active(self):
+        return self.state in (OTA_QUEUED, OTA_FLASHING)
+
+    def report(self):
+        t = self.transfer
+        return {"state": self.state, "file": os.path.basename(self.path), "attempts": self.attempts,
+                "bytes_acked": t.acked if t else 0, "bytes_total": t.size if t else None,
+                "error": self.error, "queued_at": self.queued_at, "started_at": self.started_at,
+                "finished_at": self.finished_at}
+
+class DeviceSession:
+    """One serial / Bluetooth link. All reads and writes happen on the gateway's I/O thread."""
+    def __init__(self, port, ser, device_id=None):
+        self.port = port
+        self.ser = ser
+        self.device_id = device_id   # Learned from digitalTwin.deviceId if not configured
+        self.framer = LineFramer()
+        self.commands = CommandQueue() # Coalesced + prioritized; held while this device is being flashed
+        self.outbuf = bytearray()    # Bytes accepted for writing, not yet taken by the driver
+        self.lock = threading.Lock() # outbuf / commands are filled from API and OTA threads
+        self.control = queue.Queue(maxsize=CONTROL_QUEUE_SIZE)
+        self.ota = None
+        self.online = True
+        self.selectable = os.name != "nt" and hasattr(ser, "fileno")
+
+        self.lines_read = 0
+        self.bad_json = 0
+        self.logs = 0
+        self.commands_sent = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    @property
+    def key(self):
+        return self.device_id or self.port
+
+    def stats(self):
+        return {"device_id": self.device_id, "port": self.port, "online": self.online,
+                "lines_read": self.lines_read, "bad_json": self.bad_json, "logs": self.logs,
+                "commands_pending": len(self.commands), "commands_sent": self.commands_sent,
+                "commands": self.commands.stats(),
+                "bytes_written": self.bytes_written, "out_buffer": len(self.outbuf), "errors": self.errors,
+                "ota": self.ota.report() if self.ota else {"state": OTA_IDLE}}
+
+class DeviceGateway:
+    """
+    Serves many ESP32 links from one process:
+
+      I/O thread      : one selector over every link (reads, buffered writes, commands)
+      worker thread   : logs from all devices -> handle_logs([(session, log), ...])
+      OTA pool        : OTA_WORKERS transfers at a time, each feeding its link through the I/O thread
+
+    A firmware push to one device only holds back that device's commands;
+    everyone else keeps streaming telemetry and receiving actions.
+    """
+    def __init__(self, handle_logs, log_queue_size=LOG_QUEUE_SIZE, batch_max=BATCH_MAX,
+                 ota_workers=OTA_WORKERS, name="gateway"):
+        self.handle_logs = handle_logs
+        self.batch_max = batch_max
+        self.name = name
+        self.logs = queue.Queue(maxsize=log_queue_size)
+        self.selector = selectors.DefaultSelector()
+        self.ota_pool = ThreadPoolExecutor(max_workers=ota_workers, thread_name_prefix=f"{name}-ota")
+        self._sessions = {}          # port -> session
+        self._aliases = {}           # device id -> session
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._stop = threading.Event()
+        self._threads = []
+
+        self.logs_dropped = 0
+        self.logs_handled = 0
+        self.handler_errors = 0
+        LOG_QUEUE.set_function((name,), self.logs.qsize)
+        COMMAND_QUEUE.set_function((name,), lambda: sum(len(s.commands) for s in self.sessions()))
+
+    # --- LINKS ---
+    def add_link(self, port, ser, device_id=None):
+        ser.timeout = 0          # Non-blocking: the selector decides when to read
+        ser.write_timeout = 0    # ser.write returns how much the driver took
+        sess = DeviceSession(port, ser, device_id)
+        with self._lock:
+            self._sessions[port] = sess
+            if device_id: self._aliases[device_id] = sess
+        if sess.selectable: self.selector.register(ser.fileno(), selectors.EVENT_READ, sess)
+        self._wake()
+        return sess
+
+    def open_link(self, port, baud, device_id=None):
+        import serial
+        return self.add_link(port, serial.Serial(port, baud, timeout=0, write_timeout=0), device_id)
+
+    def session(self, device):
+        """Session by device id or port name (KeyError if unknown)."""
+        with self._lock:
+            sess = self._aliases.get(device) or self._sessions.get(device)
+        if sess is None: raise KeyError(device)
+        return sess
+
+    def sessions(self):
+        with self._lock: return list(self._sessions.values())
+
+    def _drop_link(self, sess, err):
+        print(f"   ❌ {self.name}: link {sess.port} lost: {err}")
+        sess.online = False
+        if sess.selectable:
+            try: self.selector.unregister(sess.ser.fileno())
+            except (KeyError, ValueError, OSError): pass
+        try: sess.ser.close()
+        except Exception: pass
+
+    # --- LIFECYCLE ---
+    def start(self):
+        for fn in (self._io_loop, self._worker):
+            t = threading.Thread(target=fn, daemon=True, name=f"{self.name}{fn.__name__}")
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        self._wake()
+        for t in self._threads: t.join(timeout)
+        self.ota_pool.shutdown(wait=False, cancel_futures=True)
+        for sess in self.sessions():
+            try: sess.ser.close()
+            except Exception: pass
+
+    def _wake(self):
+        try: self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError): pass # Already pending
+
+    # --- I/O LOOP ---
+    def _io_loop(self):
+        while not self._stop.is_set():
+            polled = False
+            for sess in self.sessions():
+                if not sess.online: continue
+                self._pump_commands(sess)
+                if sess.selectable:
+                    want = selectors.EVENT_READ | (selectors.EVENT_WRITE if sess.outbuf else 0)
+                    try: self.selector.modify(sess.ser.fileno(), want, sess)
+                    except (KeyError, ValueError, OSError): pass
+                else:
+                    polled = True
+            for key, mask in self.selector.select(POLL_SEC if polled else 0.5):
+                sess = key.data
+                if sess is None:
+                    try: self._wake_r.recv(4096)
+                    except (BlockingIOError, OSError): pass
+                    continue
+                if mask & selectors.EVENT_READ: self._read(sess)
+                if mask & selectors.EVENT_WRITE and sess.online: self._flush(sess)
+            if polled:
+                for sess in self.sessions():
+                    if sess.online and not sess.selectable:
+                        self._read(sess)
+                        if sess.outbuf: self._flush(sess)
+
+    def _read(self, sess):
+        t = time.perf_counter()
+        try:
+            data = sess.ser.read(sess.ser.in_waiting or MAX_READ)
+        except Exception as e:
+            sess.errors += 1
+            self._drop_link(sess, e)
+            return
+        if not data: return
+        BYTES_IN.inc(len(data))
+        for line in sess.framer.feed(data):
+            sess.lines_read += 1
+            if line.startswith(CONTROL_PREFIX):
+                try: sess.control.put_nowait(line)
+                except queue.Full: pass # Nobody is listening (no OTA running)
+                continue
+            if not line.startswith("{"): continue
+            try: log = json.loads(line)
+            except ValueError:
+                sess.bad_json += 1
+                continue
+            self._learn_id(sess, log)
+            sess.logs += 1
+            self._enqueue((sess, log))
+        lap(SERIAL_READ, t)
+
+    def _learn_id(self, sess, log):
+        twin = log.get("digitalTwin") if isinstance(log, dict) else None
+        dev = twin.get("deviceId") if isinstance(twin, dict) else None
+        if dev and dev != sess.device_id:
+            with self._lock:
+                if sess.device_id and self._aliases.get(sess.device_id) is sess: del self._aliases[sess.device_id]
+                sess.device_id = dev
+                self._aliases[dev] = sess
+
+    def _enqueue(self, item):
+        while True:
+            try:
+                self.logs.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.logs.get_nowait() # Drop the oldest; fresh telemetry matters more
+                    self.logs_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _pump_commands(self, sess):
+        if not sess.commands or sess.ota is not None and sess.ota.active: return
+        with sess.lock:
+            for cmd in sess.commands.pop_all():
+                print(f"   ⚡ SENDING ACTION to {sess.key}: {cmd}")
+                sess.outbuf += f"{cmd}\n".encode()
+                sess.commands_sent += 1
+
+    def _flush(self, sess):
+        with sess.lock:
+            if not sess.outbuf: return
+            chunk = bytes(sess.outbuf[:MAX_READ])
+            t = time.perf_counter()
+            try:
+                n = sess.ser.write(chunk)
+            except Exception as e:
+                sess.errors += 1
+                self._drop_link(sess, e)
+                return
+            lap(SERIAL_WRITE, t)
+            if n is None: n = len(chunk)
+            BYTES_OUT.inc(n)
+            del sess.outbuf[:n]
+            sess.bytes_written += n
+
+    # --- ANALYSIS WORKER ---
+    def _worker(self):
+        while not self._stop.is_set():
+            try: batch = [self.logs.get(timeout=0.5)]
+            except queue.Empty: continue
+            while len(batch) < self.batch_max:
+                try: batch.append(self.logs.get_nowait())
+                except queue.Empty: break
+            t = time.perf_counter()
+            try:
+                self.handle_logs(batch)
+                self.logs_handled += len(batch)
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"   ❌ {self.name}: analysis failed: {e}")
+            lap(SERIAL_HANDLE, t)
+
+    # --- COMMANDS ---
+    def send_command(self, device, cmd, manual=False):
+        """
+        Queue a text command for one device; written by the I/O thread (after any running OTA).
+        -> "queued", or "coalesced" / "suppressed" / "dropped" (see command_queue.py).
+        """
+        sess = self.session(device)
+        with sess.lock: outcome = sess.commands.push(cmd, manual)
+        if outcome == "queued": self._wake()
+        return outcome
+
+    def write(self, device, data):
+        sess = device if isinstance(device, DeviceSession) else self.session(device)
+        with sess.lock: sess.outbuf += data
+        self._wake()
+
+    # --- OTA ---
+    def start_ota(self, device, path, attempts=OTA_ATTEMPTS):
+        """Queue a firmware push to one device. Returns its OtaJob (or the one already running)."""
+        sess = self.session(device)
+        if sess.ota is not None and sess.ota.active: return sess.ota
+        job = OtaJob(path)
+        sess.ota = job
+        self.ota_pool.submit(self._run_ota, sess, job, attempts)
+        return job
+
+    def _run_ota(self, sess, job, attempts):
+        job.state, job.started_at = OTA_FLASHING, time.time()
+        write = lambda data: self.write(sess, data)
+        print(f"\n🔁 STARTING OTA FIRMWARE UPDATE on {sess.key}...")
+        try:
+            while job.attempts < attempts:
+                job.attempts += 1
+                job.transfer = OtaTransfer(write, sess.control, job.path)
+                try:
+                    job.stats = job.transfer.run()
+                    break
+                except OtaNotSupported as e:
+                    if job.attempts > 1: # It spoke the protocol before, so it's gone quiet, not old
+                        job.error = str(e)
+                        continue
+                    job.stats = legacy_stream(write, job.path)
+                    break
+                except Exception as e:
+                    job.error = str(e)
+                    print(f"❌ OTA attempt {job.attempts}/{attempts} on {sess.key} failed: {e}")
+            if job.stats is None: raise RuntimeError(job.error or "OTA failed")
+            job.state, job.error = OTA_DONE, None
+            print(f"✅ OTA UPDATE COMPLETE on {sess.key}. Device Rebooting.")
+        except Exception as e:
+            job.state, job.error = OTA_FAILED, str(e)
+            print(f"❌ OTA FAILED on {sess.key}: {e} (the device keeps the partial image; the next push resumes it)")
+        finally:
+            job.finished_at = time.time()
+            job.done.set()
+            self._wake() # Release the commands held during the flash
+
+    def active_ota_paths(self):
+        return {s.ota.path for s in self.sessions() if s.ota is not None and s.ota.active}
+
+    def stats(self):
+        return {"devices": [s.stats() for s in self.sessions()], "log_queue": self.logs.qsize(),
+                "logs_handled": self.logs_handled, "logs_dropped": self.logs_dropped,
+                "handler_errors": self.handler_errors}
+
+# --- SELF-CHECK OVER PSEUDO-TERMINALS ---
+#   python device_gateway.py   (POSIX only)
+if __name__ == "__main__":
+    import pty
+    import tty
+    import tempfile
+    from ota_protocol import OtaDeviceSimulator
+
+    N = 8
+    got = []
+    gw = DeviceGateway(got.extend).start()
+    masters = []
+    for i in range(N):
+        master, slave = pty.openpty()
+        tty.setraw(master); tty.setraw(slave)
+        masters.append(master)
+        gw.open_link(os.ttyname(slave), 115200)
+
+    # Telemetry from every device; ids are learned from the logs
+    per_dev = 500
+    t0 = time.perf_counter()
+    for seq in range(per_dev):
+        for i, m in enumerate(masters):
+            os.write(m, b'{"digitalTwin": {"deviceId": "ESP32-%03d"}, "seq": %d}\n' % (i, seq))
+    while len(got) < N * per_dev and time.perf_counter() - t0 < 10: time.sleep(0.005)
+    dt = time.perf_counter() - t0
+    assert len(got) == N * per_dev, gw.stats()
+    for i in range(N):
+        seqs = [log["seq"] for sess, log in got if sess.device_id == f"ESP32-{i:03d}"]
+        assert seqs == list(range(per_dev)), f"device {i} out of order"
+    print(f"✅ {N} links, {len(got)} logs in {dt * 1000:.0f} ms on one I/O thread ({len(got) / dt:,.0f}/s)")
+
+    # Flash device 0 while device 1 keeps receiving commands and streaming
+    firmware = os.urandom(200 * 1024)
+    path = os.path.join(tempfile.mkdtemp(), "latest_firmware.bin")
+    with open(path, "wb") as f: f.write(firmware)
+    dev0 = OtaDeviceSimulator(masters[0], erase_sec=0.3, loss=0.02).start()
+    job = gw.start_ota("ESP32-000", path)
+    for _ in range(100): gw.send_command("ESP32-000", "LOCKDOWN")  # Held until the flash is done, sent once
+    t0 = time.perf_counter()
+    gw.send_command("ESP32-001", "DEEP_SLEEP")
+    echoed = b""
+    while not echoed.endswith(b"\n"): echoed += os.read(masters[1], 64)
+    latency_ms = (time.perf_counter() - t0) * 1000
+    assert echoed == b"DEEP_SLEEP\n" and job.state == OTA_FLASHING
+    before = len(got)
+    os.write(masters[1], b'{"digitalTwin": {"deviceId": "ESP32-001"}, "seq": -1}\n')
+    while len(got) == before: time.sleep(0.005)
+    assert job.state == OTA_FLASHING, "Telemetry from other devices should not wait for the OTA"
+    while job.active: time.sleep(0.01)
+    assert job.state == OTA_DONE and dev0.flashed == firmware, job.report()
+    time.sleep(0.1)
+    assert dev0.commands == ["LOCKDOWN"], dev0.commands
+    print(f"✅ OTA on ESP32-000 ({len(firmware) // 1024} KB) while ESP32-001 got a command in {latency_ms:.1f} ms")
+    dev0.stop(); gw.stop()
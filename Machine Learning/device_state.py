@@ -0,0 +1,197 @@
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+# --- CONFIGURATION ---
+EWMA_ALPHA = 0.2          # Weight of the newest sample in every rolling average
+JITTER_GAIN = 1 / 16      # RFC 3550 inter-arrival jitter gain
+WARMUP_SAMPLES = 3        # No derived flags until a device has sent this many reports
+JUMP_FACTOR = 4.0         # |dT| > 4x its usual size = sudden jump
+JUMP_MIN_DELTA = 2.0      # ...and at least 2 °C, so a dead-flat sensor doesn't trip on 0.1 °C
+JITTER_RATIO = 0.5        # Jitter above 50% of the mean interval = irregular sending
+SPIKE_FACTOR = 3.0        # Drain rate > 3x its average = battery drain spike
+IDLE_TIMEOUT_SEC = 3600   # Forget devices that have been silent for an hour
+MAX_DEVICES = 50000       # Hard cap, least-recently-seen devices go first
+
+def _contact_seconds(value):
+    """lastContactTime as epoch seconds (accepts s, ms, or ISO strings); None if unusable."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value / 1000.0 if value > 1e11 else float(value)
+    if isinstance(value, str):
+        try: return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            try: return _contact_seconds(float(value))
+            except ValueError: return None
+    return None
+
+class DeviceState:
+    """Rolling statistics for one device, updated in O(1) per report."""
+    __slots__ = ("samples", "seen_at", "last_temp", "temp_delta", "temp_delta_ewma",
+                 "last_contact", "interval_ewma", "last_interval", "jitter",
+                 "drain_rate", "drain_rate_ewma")
+
+    def __init__(self):
+        self.samples = 0
+        self.seen_at = 0.0
+        self.last_temp = None
+        self.temp_delta = 0.0
+        self.temp_delta_ewma = 0.0  # EWMA of |dT| between reports
+        self.last_contact = None
+        self.interval_ewma = 0.0    # EWMA of the gap between reports (s)
+        self.last_interval = None
+        self.jitter = 0.0           # Smoothed |change in gap| (s)
+        self.drain_rate = 0.0       # batteryConsumedThisPayload per second
+        self.drain_rate_ewma = 0.0  # Drain slope
+
+    def update(self, log: dict, now: float):
+        self.samples += 1
+        self.seen_at = now
+
+        # 1. Temperature delta
+        temp = log['telemetry']['temperature']
+        if self.last_temp is not None:
+            self.temp_delta = temp - self.last_temp
+            self.temp_delta_ewma += EWMA_ALPHA * (abs(self.temp_delta) - self.temp_delta_ewma)
+        self.last_temp = temp
+
+        # 2. Inter-arrival interval & jitter (device clock, gateway clock as fallback)
+        contact = _contact_seconds(log['telemetry'].get('lastContactTime'))
+        if contact is None: contact = now
+        interval = None
+        if self.last_contact is not None and contact > self.last_contact:
+            interval = contact - self.last_contact
+            if self.last_interval is None: self.interval_ewma = interval
+            else:
+                self.interval_ewma += EWMA_ALPHA * (interval - self.interval_ewma)
+                self.jitter += JITTER_GAIN * (abs(interval - self.last_interval) - self.jitter)
+            self.last_interval = interval
+        self.last_contact = contact
+
+        # 3. Drain slope
+        consumed = log['battery']['batteryConsumedThisPayload']
+        dt = interval or log['battery'].get('sendIntervalSec') or 1.0
+        self.drain_rate = consumed / dt
+        if self.samples == 1: self.drain_rate_ewma = self.drain_rate
+        else: self.drain_rate_ewma += EWMA_ALPHA * (self.drain_rate - self.drain_rate_ewma)
+        return self
+
+    # --- DERIVED FLAGS (fed into the Sentinel features) ---
+    def sudden_jump(self):
+        if self.samples <= WARMUP_SAMPLES: return False
+        d = abs(self.temp_delta)
+        return d >= JUMP_MIN_DELTA and d > JUMP_FACTOR * self.temp_delta_ewma
+
+    def irregular_sending(self):
+        if self.samples <= WARMUP_SAMPLES or self.interval_ewma <= 0: return False
+        return self.jitter > JITTER_RATIO * self.interval_ewma
+
+    def drain_spike(self):
+        if self.samples <= WARMUP_SAMPLES or self.drain_rate_ewma <= 0: return False
+        return self.drain_rate > SPIKE_FACTOR * self.drain_rate_ewma
+
+    def flags(self):
+        return (self.sudden_jump(), self.irregular_sending(), self.drain_spike())
+
+    def snapshot(self):
+        return {s: getattr(self, s) for s in self.__slots__}
+
+class DeviceStateStore:
+    """
+    device_id -> DeviceState, ordered by last report so idle devices are
+    evicted from the front in O(1) each.
+    """
+    def __init__(self, idle_timeout_sec=IDLE_TIMEOUT_SEC, max_devices=MAX_DEVICES, clock=time.monotonic):
+        self.idle_timeout = idle_timeout_sec
+        self.max_devices = max_devices
+        self.clock = clock
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def update(self, log: dict):
+        """Fold one report in -> its (sudden jump, irregular sending, drain spike) flags, read under the lock."""
+        device_id = log['digitalTwin']['deviceId']
+        now = self.clock()
+        with self._lock:
+            st = self._states.get(device_id)
+            if st is None:
+                st = self._states[device_id] = DeviceState()
+            else:
+                self._states.move_to_end(device_id)
+            flags = st.update(log, now).flags()
+            self._evict(now)
+        return flags
+
+    def _evict(self, now):
+        cutoff = now - self.idle_timeout
+        while self._states:
+            oldest = next(iter(self._states.values()))
+            if oldest.seen_at >= cutoff and len(self._states) <= self.max_devices: break
+            self._states.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, device_id):
+        return self._states.get(device_id)
+
+    def __len__(self):
+        return len(self._states)
+
+# --- SELF-CHECK ---
+#   python device_state.py
+if __name__ == "__main__":
+    from fleet_sim import FleetGenerator
+
+    def log(device, temp, contact, consumed=0.02, interval=10):
+        return {"digitalTwin": {"deviceId": device}, "telemetry": {"temperature": temp, "lastContactTime": contact},
+                "battery": {"batteryConsumedThisPayload": consumed, "sendIntervalSec": interval}}
+
+    # Derived flags, only after the warm-up
+    store = DeviceStateStore()
+    for i in range(6): assert store.update(log("a", 25 + 0.2 * (i % 2), 1000 + 10 * i)) == (False, False, False)
+    assert store.update(log("a", 45, 1060)) == (True, False, False)           # Sudden jump
+    assert store.update(log("a", 45, 1070, consumed=0.5)) == (False, False, True) # Drain spike
+    for t in (1071, 1100, 1102, 1140, 1141): flags = store.update(log("a", 45, t))
+    assert flags[1] and store.get("a").samples == 13                          # Irregular sending
+    assert store.update(log("b", 30, "2024-01-01T00:00:00Z")) == (False, False, False) and len(store) == 2
+
+    # Eviction: idle devices, then the device cap (least recently seen first)
+    now = [0.0]
+    small = DeviceStateStore(idle_timeout_sec=60, max_devices=3, clock=lambda: now[0])
+    for d in "wxyz": small.update(log(d, 20, 0))
+    assert len(small) == 3 and small.get("w") is None and small.evictions == 1
+    now[0] = 61.0
+    small.update(log("z", 20, 61))
+    assert len(small) == 1 and small.evictions == 3
+    print(f"✅ Device flags / eviction OK: {store.get('a').snapshot()['samples']} samples, {small.evictions} evicted")
+
+    # Concurrency: threads feeding one store (as the batcher's executor and /ingest/batch threads do)
+    # get the same flags as a serial replay, and no update is lost
+    import sys
+    logs = FleetGenerator(40, "anomalous", seed=3).take(8000)
+    serial = DeviceStateStore()
+    expected = [serial.update(l) for l in logs]
+    shared, results = DeviceStateStore(), [None] * len(logs)
+    def feed(part):
+        for i, l in enumerate(logs):
+            if hash(l["digitalTwin"]["deviceId"]) % 4 == part: results[i] = shared.update(l)
+    # One device, two writers: light reports can never be a drain spike themselves, so one reported
+    # as a spike saw the heavy writer's update (flags read outside the lock)
+    light_spikes = []
+    def light():
+        light_spikes.append(sum(shared.update(log("shared", 20, 1000, consumed=0.001))[2] for _ in range(50_000)))
+    def heavy():
+        for _ in range(1000):
+            shared.update(log("shared", 20, 1000, consumed=1.0))
+            time.sleep(0)
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # Make the threads interleave as often as possible
+    threads = [threading.Thread(target=f, args=(p,)) for f, p in zip([feed] * 4, range(4))]
+    threads += [threading.Thread(target=light), threading.Thread(target=heavy)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    sys.setswitchinterval(switch)
+    assert results == expected, "flags differ from a serial replay"
+    assert light_spikes == [0], f"{light_spikes[0]} light reports got another update's flags"
+    assert shared.get("shared").samples == 51_000 and len(shared) == 41
+    print(f"✅ DeviceStateStore concurrency OK: {len(logs):,} fleet logs on 4 threads + 51,000 updates of one device")
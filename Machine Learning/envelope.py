@@ -0,0 +1,195 @@
+import json
+import struct
+
+# --- BINARY ENVELOPE ---
+# Compact alternative to the base64-in-JSON packet from encrypt_payload.
+#
+#   header (fixed, 24 bytes, big-endian):
+#     magic "CRB1" | version u8 | algo u8 | codec u8 | flags u8
+#     key_blob_len u16 | nonce_len u8 | tag_len u8 | ciphertext_len u32 | seq u64
+#   then: key_blob | nonce | tag | ciphertext
+#
+# The header is AES-GCM associated data: changing the codec, flags or seq (or
+# any length) makes the tag fail, just like changing the ciphertext.
+#
+# The plaintext inside the ciphertext is serialized with `codec`:
+#   CODEC_JSON   - json.dumps, works for anything (the full serial-log payloads)
+#   CODEC_REPORT - fixed struct layout for the /ingest cloud report, no text at all
+
+MAGIC = b"CRB1"
+VERSION = 2 # v2: header authenticated as associated data
+TAG_BYTES = 16 # AES-GCM default tag
+HEADER = struct.Struct(">4sBBBBHBBIQ")
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_BINARY = "application/x-cerberus-envelope"
+
+ALGO_IDS = {"Kyber512+AES256-GCM": 1}
+ALGO_NAMES = {v: k for k, v in ALGO_IDS.items()}
+
+CODEC_JSON = 0
+CODEC_REPORT = 1
+FLAG_BATCH = 0x01
+
+class EnvelopeError(ValueError):
+    pass
+
+# --- REPORT CODEC (fixed struct layout) ---
+STATUSES = ["BALANCED", "SECURITY_PRIORITY", "ECO_SAVER"]
+BATTERY_TAGS = ["High", "Moderate", "Low"]
+REPORT_KEYS = {"device_id", "timestamp", "status", "reasoning", "metrics"}
+METRIC_KEYS = {"anomaly_score", "battery_prediction_hours", "battery_status"}
+# status u8 | battery tag u8 | timestamp f64 | anomaly score f64 | hours f64 | device_id len u8 | reasoning len u16
+REPORT = struct.Struct(">BBdddBH")
+_STATUS_IDX = {s: i for i, s in enumerate(STATUSES)}
+_BATTERY_IDX = {s: i for i, s in enumerate(BATTERY_TAGS)}
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+def fits_report(payload):
+    """True if `payload` is exactly the /ingest report shape the struct layout can carry losslessly."""
+    if not isinstance(payload, dict) or payload.keys() != REPORT_KEYS: return False
+    m, ts = payload["metrics"], payload["timestamp"]
+    return (isinstance(m, dict) and m.keys() == METRIC_KEYS
+            and payload["status"] in _STATUS_IDX and m["battery_status"] in _BATTERY_IDX
+            and _is_number(ts) and abs(ts) < 2 ** 53
+            and _is_number(m["anomaly_score"]) and _is_number(m["battery_prediction_hours"])
+            and isinstance(payload["device_id"], str) and isinstance(payload["reasoning"], str))
+
+def pack_report(payload):
+    m = payload["metrics"]
+    dev = payload["device_id"].encode("utf-8")
+    why = payload["reasoning"].encode("utf-8")
+    if len(dev) > 0xFF or len(why) > 0xFFFF: raise EnvelopeError("Report strings too long for the struct layout")
+    ts = payload["timestamp"]
+    # Integer timestamps are flagged in the high bit of the battery byte so they decode as int again
+    tag = _BATTERY_IDX[m["battery_status"]] | (0x80 if isinstance(ts, int) else 0)
+    head = REPORT.pack(_STATUS_IDX[payload["status"]], tag, float(ts),
+                       float(m["anomaly_score"]), float(m["battery_prediction_hours"]), len(dev), len(why))
+    return head + dev + why
+
+def unpack_report(data):
+    status, tag, ts, score, hours, dev_len, why_len = REPORT.unpack_from(data)
+    off = REPORT.size
+    dev = data[off:off + dev_len].decode("utf-8"); off += dev_len
+    why = data[off:off + why_len].decode("utf-8")
+    return {
+        "device_id": dev,
+        "timestamp": int(ts) if tag & 0x80 else ts,
+        "status": STATUSES[status],
+        "reasoning": why,
+        "metrics": {"anomaly_score": score, "battery_prediction_hours": hours,
+                    "battery_status": BATTERY_TAGS[tag & 0x7F]},
+    }
+
+def encode_plaintext(payload, batch=False):
+    """-> (codec id, bytes). Picks the struct layout whenever every item fits it."""
+    items = payload if batch else [payload]
+    if items and all(fits_report(p) for p in items):
+        packed = [pack_report(p) for p in items]
+        if not batch: return CODEC_REPORT, packed[0]
+        return CODEC_REPORT, struct.pack(">I", len(packed)) + b"".join(struct.pack(">I", len(p)) + p for p in packed)
+    return CODEC_JSON, json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+def decode_plaintext(codec, data, batch=False):
+    if codec == CODEC_JSON: return json.loads(data)
+    if codec != CODEC_REPORT: raise EnvelopeError(f"Unknown codec {codec}")
+    if not batch: return unpack_report(data)
+    count, = struct.unpack_from(">I", data)
+    off, out = 4, []
+    for _ in range(count):
+        n, = struct.unpack_from(">I", data, off)
+        out.append(unpack_report(data[off + 4:off + 4 + n]))
+        off += 4 + n
+    return out
+
+# --- FRAMING ---
+def pack_header(key_len, nonce_len, tag_len, ciphertext_len, seq=0, codec=CODEC_JSON, flags=0,
+                algo="Kyber512+AES256-GCM"):
+    return HEADER.pack(MAGIC, VERSION, ALGO_IDS[algo], codec, flags, key_len, nonce_len, tag_len, ciphertext_len, seq)
+
+def pack_envelope(key_blob, nonce, tag, ciphertext, seq=0, codec=CODEC_JSON, flags=0, algo="Kyber512+AES256-GCM"):
+    header = pack_header(len(key_blob), len(nonce), len(tag), len(ciphertext), seq, codec, flags, algo)
+    return b"".join((header, key_blob, nonce, tag, ciphertext))
+
+def unpack_envelope(blob):
+    if len(blob) < HEADER.size: raise EnvelopeError("Envelope shorter than its header")
+    magic, version, algo, codec, flags, k_len, n_len, t_len, c_len, seq = HEADER.unpack_from(blob)
+    if magic != MAGIC: raise EnvelopeError("Bad magic")
+    if version != VERSION: raise EnvelopeError(f"Unsupported envelope version {version}")
+    if algo not in ALGO_NAMES: raise EnvelopeError(f"Unknown algorithm id {algo}")
+    if len(blob) != HEADER.size + k_len + n_len + t_len + c_len: raise EnvelopeError("Envelope length mismatch")
+    view = memoryview(blob)
+    off = HEADER.size
+    key_blob = bytes(view[off:off + k_len]); off += k_len
+    nonce = bytes(view[off:off + n_len]); off += n_len
+    tag = bytes(view[off:off + t_len]); off += t_len
+    return {"algo": ALGO_NAMES[algo], "codec": codec, "flags": flags, "seq": seq, "header": bytes(view[:HEADER.size]),
+            "key_blob": key_blob, "nonce": nonce, "tag": tag, "ciphertext": bytes(view[off:])}
+
+# --- ENCRYPT / DECRYPT ---
+def encrypt_binary(crypto, payload, batch=False):
+    """Like crypto.encrypt_payload (or encrypt_batch with batch=True) but returns one bytes envelope."""
+    codec, data = encode_plaintext(payload, batch)
+    flags = FLAG_BATCH if batch else 0
+    # GCM ciphertext is as long as the plaintext, so the header is known before sealing
+    header = lambda session, seq, nonce: pack_header(len(session.key_blob), len(nonce), TAG_BYTES, len(data),
+                                                     seq, codec, flags)
+    session, seq, nonce, tag, ciphertext = crypto.seal_bytes(data, aad=header)
+    return pack_envelope(session.key_blob, nonce, tag, ciphertext, seq=seq, codec=codec, flags=flags)
+
+def decrypt_binary(crypto, blob):
+    env = unpack_envelope(blob)
+    data = crypto.open_bytes(env["key_blob"], env["nonce"], env["tag"], env["ciphertext"], aad=env["header"])
+    return decode_plaintext(env["codec"], data, batch=bool(env["flags"] & FLAG_BATCH))
+
+# --- CONTENT-TYPE SWITCH ---
+def encode_for_upload(crypto, payload, fmt="json", batch=False):
+    """-> (body bytes, headers) ready for requests.post(data=..., headers=...). batch=True seals a list in one envelope."""
+    if fmt == "binary":
+        return encrypt_binary(crypto, payload, batch), {"Content-Type": CONTENT_TYPE_BINARY}
+    packet = crypto.encrypt_batch(payload) if batch else crypto.encrypt_payload(payload)
+    return json.dumps(packet).encode("utf-8"), {"Content-Type": CONTENT_TYPE_JSON}
+
+# --- ROUND-TRIP CHECK & BENCHMARK ---
+#   python envelope.py
+if __name__ == "__main__":
+    import time
+    from crypto_layer import QuantumSecurityLayer
+
+    crypto = QuantumSecurityLayer(session_mode=True)
+    report = {"device_id": "ESP32-001", "timestamp": 1700000000, "status": "SECURITY_PRIORITY",
+              "reasoning": "Logic Trigger: Physical Tampering",
+              "metrics": {"anomaly_score": -0.073, "battery_prediction_hours": 41.2, "battery_status": "Moderate"}}
+    full_log = {"digitalTwin": {"deviceId": "ESP32-001"}, "telemetry": {"temperature": 41.5, "batteryPercentage": 63},
+                "cerberus_analysis": {"decision": "BALANCED", "metrics": report["metrics"]}}
+
+    assert decrypt_binary(crypto, encrypt_binary(crypto, report)) == report
+    assert unpack_envelope(encrypt_binary(crypto, report))["codec"] == CODEC_REPORT
+    assert decrypt_binary(crypto, encrypt_binary(crypto, full_log)) == full_log
+    assert decrypt_binary(crypto, encrypt_binary(crypto, [report] * 3, batch=True)) == [report] * 3
+    assert decrypt_binary(crypto, encrypt_binary(crypto, [report, full_log], batch=True)) == [report, full_log]
+    assert decrypt_binary(QuantumSecurityLayer(), encrypt_binary(QuantumSecurityLayer(), report)) == report
+    blob = bytearray(encrypt_binary(crypto, report)); blob[-1] ^= 1
+    try: decrypt_binary(crypto, bytes(blob)); raise AssertionError("Tampered envelope was accepted")
+    except ValueError: pass
+    good = encrypt_binary(crypto, [report] * 2, batch=True)
+    for name, field in (("codec", 6), ("flags", 7), ("seq", HEADER.size - 1)): # Header edits fail the tag too
+        blob = bytearray(good); blob[field] ^= 1
+        try: decrypt_binary(crypto, bytes(blob)); raise AssertionError(f"Envelope with a changed {name} was accepted")
+        except ValueError: pass
+    print("✅ Binary envelope round trips OK (report codec, JSON codec, batch, tamper detection incl. header)")
+
+    n = 5000
+    for label, payload in (("report", report), ("full log", full_log)):
+        json_body, _ = encode_for_upload(crypto, payload, "json")
+        bin_body, _ = encode_for_upload(crypto, payload, "binary")
+        t0 = time.perf_counter()
+        for _ in range(n): encode_for_upload(crypto, payload, "json")
+        t_json = (time.perf_counter() - t0) / n * 1e6
+        t0 = time.perf_counter()
+        for _ in range(n): encode_for_upload(crypto, payload, "binary")
+        t_bin = (time.perf_counter() - t0) / n * 1e6
+        print(f"   {label:<9} json+base64: {len(json_body):4d} B {t_json:6.1f} µs | "
+              f"binary: {len(bin_body):4d} B {t_bin:6.1f} µs | size -{100 - 100 * len(bin_body) / len(json_body):.0f}%")
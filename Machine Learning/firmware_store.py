@@ -0,0 +1,206 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+import httpx
+
+# --- CONFIGURATION ---
+FIRMWARE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".firmware_cache")
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_IMAGES = 8
+MAX_IMAGE_BYTES = 16 * 1024 * 1024   # ESP32 app partitions are a few MB; anything bigger is a mistake
+DOWNLOAD_CHUNK = 64 * 1024
+DOWNLOAD_TIMEOUT_SEC = 60.0
+
+class FirmwareError(Exception):
+    pass
+
+class FirmwareImage:
+    def __init__(self, sha256, path, size, source=None):
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.source = source
+
+    def report(self):
+        return {"sha256": self.sha256, "size": self.size, "source": self.source,
+                "file": os.path.basename(self.path)}
+
+class FirmwareStore:
+    """
+    Content-addressed firmware cache: every image lives in <sha256>.bin, so the
+    same build pulled twice is stored once, and a new download never touches a
+    file an OTA is still reading. Least recently used images are evicted past
+    max_bytes / max_images, except pinned ones and those `in_use()` reports.
+    """
+    def __init__(self, directory=FIRMWARE_DIR, max_bytes=MAX_CACHE_BYTES, max_images=MAX_IMAGES, in_use=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_images = max_images
+        self.in_use = in_use or (lambda: set())
+        self._lock = threading.Lock()
+        self._pins = {}          # sha256 -> count (rollouts in progress)
+        self._sources = {}       # sha256 -> last URL it came from
+        self._inflight = {}      # url -> asyncio.Task (concurrent pulls of one URL share a download)
+        self.downloads = 0
+        self.dedup_hits = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sha256):
+        return os.path.join(self.directory, f"{sha256}.bin")
+
+    def get(self, sha256):
+        path = self._path(sha256)
+        if not os.path.exists(path): raise KeyError(sha256)
+        os.utime(path) # LRU by mtime
+        return FirmwareImage(sha256, path, os.path.getsize(path), self._sources.get(sha256))
+
+    def images(self):
+        out = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin"):
+                sha = name[:-4]
+                out.append(FirmwareImage(sha, self._path(sha), os.path.getsize(self._path(sha)), self._sources.get(sha)))
+        return out
+
+    # --- ADDING IMAGES ---
+    def _commit(self, tmp, sha256, size, source):
+        """Move a fully written temp file into place (or drop it if we already had those bytes)."""
+        path = self._path(sha256)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(tmp)
+                os.utime(path)
+                self.dedup_hits += 1
+            else:
+                os.replace(tmp, path)
+            if source: self._sources[sha256] = source
+        self.evict()
+        return FirmwareImage(sha256, path, size, source)
+
+    def add_bytes(self, data, source=None):
+        if len(data) > MAX_IMAGE_BYTES: raise FirmwareError(f"Image larger than {MAX_IMAGE_BYTES} bytes")
+        tmp = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+        with open(tmp, "wb") as f: f.write(data)
+        return self._commit(tmp, hashlib.sha256(data).hexdigest(), len(data), source)
+
+    async def fetch(self, url, client=None):
+        """Stream `url` into the cache without blocking the event loop. Returns a FirmwareImage."""
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._download(url, client))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, url, client=None):
+        tmp = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+        digest, size = hashlib.sha256(), 0
+        own = client is None
+        if own: client = httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT_SEC, follow_redirects=True)
+        try:
+            async with client.stream("GET", url) as r:
+                r.raise_for_status()
+                with open(tmp, "wb") as f:
+                    async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK):
+                        size += len(chunk)
+                        if size > MAX_IMAGE_BYTES: raise FirmwareError(f"Image larger than {MAX_IMAGE_BYTES} bytes")
+                        digest.update(chunk)
+                        f.write(chunk)
+        except BaseException:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+        finally:
+            if own: await client.aclose()
+        self.downloads += 1
+        return self._commit(tmp, digest.hexdigest(), size, url)
+
+    # --- PINNING & EVICTION ---
+    def pin(self, sha256):
+        with self._lock: self._pins[sha256] = self._pins.get(sha256, 0) + 1
+
+    def unpin(self, sha256):
+        with self._lock:
+            n = self._pins.get(sha256, 0) - 1
+            if n > 0: self._pins[sha256] = n
+            else: self._pins.pop(sha256, None)
+
+    def evict(self):
+        with self._lock:
+            keep = set(self._pins) | {os.path.basename(p)[:-4] for p in self.in_use()}
+            entries = sorted((os.path.getmtime(img.path), img) for img in self.images())
+            total = sum(img.size for _, img in entries)
+            count = len(entries)
+            for _, img in entries: # Oldest first
+                if total <= self.max_bytes and count <= self.max_images: break
+                if img.sha256 in keep: continue
+                try: os.remove(img.path)
+                except OSError: continue
+                self._sources.pop(img.sha256, None)
+                total -= img.size
+                count -= 1
+                self.evictions += 1
+
+    def stats(self):
+        images = self.images()
+        return {"images": len(images), "bytes": sum(i.size for i in images), "downloads": self.downloads,
+                "dedup_hits": self.dedup_hits, "evictions": self.evictions, "pinned": sorted(self._pins)}
+
+# --- SELF-CHECK AGAINST A LOCAL STAND-IN SERVER ---
+#   python firmware_store.py
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    blobs = {f"/fw/{i}": os.urandom(200_000 + i) for i in range(4)}
+    blobs["/fw/copy"] = blobs["/fw/0"]
+    hits = {"n": 0}
+    class StandIn(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits["n"] += 1
+            body = blobs[self.path]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            for i in range(0, len(body), 8192):
+                self.wfile.write(body[i:i + 8192])
+                time.sleep(0.001) # Slow link
+        def log_message(self, *a): pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    directory = tempfile.mkdtemp()
+
+    async def main():
+        store = FirmwareStore(directory, max_images=3)
+        # The event loop keeps ticking during a download
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+        t = asyncio.ensure_future(ticker())
+        a, b = await asyncio.gather(store.fetch(base + "/fw/0"), store.fetch(base + "/fw/0"))
+        t.cancel()
+        assert a.sha256 == b.sha256 == hashlib.sha256(blobs["/fw/0"]).hexdigest() and hits["n"] == 1
+        assert ticks > 5, "Download blocked the event loop"
+        c = await store.fetch(base + "/fw/copy")
+        assert c.path == a.path and store.dedup_hits == 1 and len(store.images()) == 1
+        store.pin(a.sha256)
+        for i in (1, 2, 3):
+            await store.fetch(base + f"/fw/{i}")
+            time.sleep(0.01) # Distinct mtimes
+        assert len(store.images()) == 3 and os.path.exists(a.path), "Pinned image was evicted"
+        print(f"✅ Firmware store OK: {store.stats()} (event loop ticked {ticks}x during the download)")
+
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
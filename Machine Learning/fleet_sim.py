@@ -0,0 +1,129 @@
+import random
+
+# --- SYNTHETIC DEVICE FLEET ---
+# Reproducible stream of hardware logs in the exact shape main.HardwareLog /
+# iot_core expect (digitalTwin, telemetry, battery, behaviour, anomaly, security).
+# Every device keeps its own state between logs (battery drains, temperature
+# drifts, lastContactTime advances by its send interval), so per-device features
+# in device_state.py see realistic histories rather than independent noise.
+
+PATTERNS_OK = ["stable", "consistent"]
+PATTERNS_BAD = ["intermittent", "dropped", "frequent reconnects", "unexpected disconnections"]
+START_TIME = 1_700_000_000
+
+# Share of the fleet in each profile. "faulty" devices jump / spike / drop links,
+# "draining" devices start low and burn battery fast, "hot" ones drift past 80 °C.
+MIXES = {
+    "normal":      {"faulty": 0.02, "draining": 0.05, "hot": 0.005, "tamper_rate": 0.001},
+    "anomalous":   {"faulty": 0.30, "draining": 0.05, "hot": 0.05,  "tamper_rate": 0.02},
+    "low_battery": {"faulty": 0.02, "draining": 0.60, "hot": 0.005, "tamper_rate": 0.001},
+    "mixed":       {"faulty": 0.15, "draining": 0.25, "hot": 0.02,  "tamper_rate": 0.01},
+}
+
+class SimDevice:
+    __slots__ = ("device_id", "profile", "battery", "temp", "uptime", "last_contact", "interval",
+                 "connects", "attempts", "sends", "fw_updates", "payload", "rssi")
+
+    def __init__(self, device_id, profile, rng):
+        self.device_id = device_id
+        self.profile = profile
+        self.battery = rng.uniform(5, 25) if profile == "draining" else rng.uniform(40, 100)
+        self.temp = rng.uniform(55, 70) if profile == "hot" else rng.uniform(22, 38)
+        self.uptime = rng.randint(0, 86_400)
+        self.last_contact = START_TIME + rng.randint(0, 3600)
+        self.interval = rng.choice([5, 10, 15, 30, 60])
+        self.connects = rng.randint(1, 5)
+        self.attempts = self.connects
+        self.sends = rng.randint(0, 5000)
+        self.fw_updates = rng.randint(0, 3)
+        self.payload = rng.randint(120, 480)
+        self.rssi = rng.randint(-85, -40)
+
+class FleetGenerator:
+    """
+    `FleetGenerator(devices=50, mix="anomalous", seed=1).take(1000)` -> 1000 logs.
+    Same seed, same stream.
+    """
+    def __init__(self, devices=50, mix="normal", seed=0):
+        if mix not in MIXES: raise ValueError(f"Unknown mix '{mix}' (choose from {', '.join(MIXES)})")
+        self.rng = random.Random(seed)
+        self.mix = MIXES[mix]
+        self.devices = []
+        for i in range(devices):
+            r = self.rng.random()
+            if r < self.mix["faulty"]: profile = "faulty"
+            elif r < self.mix["faulty"] + self.mix["draining"]: profile = "draining"
+            elif r < self.mix["faulty"] + self.mix["draining"] + self.mix["hot"]: profile = "hot"
+            else: profile = "healthy"
+            self.devices.append(SimDevice(f"ESP32-{i:04d}", profile, self.rng))
+
+    def next_log(self, device=None):
+        rng = self.rng
+        d = device or self.devices[rng.randrange(len(self.devices))]
+        faulty = d.profile == "faulty"
+
+        # Time & link
+        gap = d.interval * (rng.uniform(0.2, 4.0) if faulty and rng.random() < 0.4 else rng.uniform(0.95, 1.05))
+        d.last_contact += int(round(gap))
+        d.uptime += int(round(gap))
+        reconnect = rng.random() < (0.3 if faulty else 0.01)
+        if reconnect:
+            d.connects += 1
+            d.attempts += rng.randint(1, 4 if faulty else 1)
+        d.sends += 1
+        d.rssi = max(-100, min(-30, d.rssi + rng.randint(-3, 3)))
+
+        # Battery
+        spike = faulty and rng.random() < 0.2
+        drain = rng.uniform(0.01, 0.05) * (8 if d.profile == "draining" else 1) * (10 if spike else 1)
+        d.battery = max(0.0, d.battery - drain)
+        if d.battery <= 0.5 and rng.random() < 0.05: d.battery = rng.uniform(80, 100) # Someone swapped it
+
+        # Temperature
+        target = 88 if d.profile == "hot" else 30
+        d.temp += (target - d.temp) * 0.1 + rng.gauss(0, 0.5)
+        jump = faulty and rng.random() < 0.25
+        temp = d.temp + (rng.choice([-1, 1]) * rng.uniform(15, 35) if jump else 0)
+
+        tamper = rng.random() < self.mix["tamper_rate"]
+        pattern = rng.choice(PATTERNS_BAD) if (faulty and rng.random() < 0.6) or reconnect else rng.choice(PATTERNS_OK)
+        return {
+            "digitalTwin": {"deviceId": d.device_id},
+            "telemetry": {"temperature": round(temp, 2), "batteryPercentage": round(d.battery, 2),
+                          "uptimeSeconds": d.uptime, "lastContactTime": d.last_contact},
+            "battery": {"connectCount": d.connects, "connAttemptCount": d.attempts, "sendCount": d.sends,
+                        "sendIntervalSec": round(gap, 2), "firmwareUpdateCount": d.fw_updates,
+                        "payloadSizeBytes": d.payload + rng.randint(-16, 16),
+                        "batteryConsumedThisPayload": round(drain, 4),
+                        "retryCount": rng.randint(1, 5) if reconnect else 0, "wifiRSSI": d.rssi},
+            "behaviour": {"connectionPattern": pattern},
+            "anomaly": {"sensorJump": jump, "batterySpike": spike, "tampering": tamper},
+            "security": {"authFailures": rng.randint(1, 5) if tamper else 0},
+        }
+
+    def take(self, n):
+        return [self.next_log() for _ in range(n)]
+
+    def __iter__(self):
+        while True: yield self.next_log()
+
+    def profiles(self):
+        out = {}
+        for d in self.devices: out[d.profile] = out.get(d.profile, 0) + 1
+        return out
+
+# --- QUICK LOOK ---
+#   python fleet_sim.py
+if __name__ == "__main__":
+    import json
+    for mix in MIXES:
+        fleet = FleetGenerator(200, mix, seed=1)
+        logs = fleet.take(5000)
+        assert logs == FleetGenerator(200, mix, seed=1).take(5000), "Not reproducible"
+        low = sum(l["telemetry"]["batteryPercentage"] < 20 for l in logs) / len(logs)
+        hot = sum(l["telemetry"]["temperature"] > 80 for l in logs) / len(logs)
+        odd = sum(l["anomaly"]["sensorJump"] or l["anomaly"]["batterySpike"] for l in logs) / len(logs)
+        tamper = sum(l["anomaly"]["tampering"] for l in logs) / len(logs)
+        print(f"   {mix:<12} {fleet.profiles()}  low battery {low:5.1%} | >80°C {hot:5.1%} | "
+              f"jumps/spikes {odd:5.1%} | tampering {tamper:5.1%}")
+    print(json.dumps(logs[0], indent=2))
@@ -0,0 +1,171 @@
+import os
+import time
+import shutil
+import numpy as np
+
+# --- COMPILED ISOLATION FOREST ---
+# Flattens every tree of a fitted sklearn IsolationForest into a few packed arrays:
+#   feature / threshold  (one entry per node, all trees back to back)
+#   children             (left, right interleaved: children[2*node + went_right])
+#   leaf_depth           (depth + average path length correction, per leaf)
+# Leaves point back to themselves with threshold=+inf, so scoring a batch is just
+# `max_depth` rounds of gather + compare over an (n_rows, n_trees) node matrix.
+#
+# Thresholds are stored as the largest float32 <= the float64 sklearn threshold:
+# for float32 inputs `x <= t32` is then exactly `x <= t`, at half the memory traffic.
+
+EULER_GAMMA = np.euler_gamma
+CHUNK_ROWS = 4096 # Bounds the (rows x trees) scratch matrices
+ARRAYS = ("feature", "threshold", "children", "leaf_depth", "roots")
+
+def average_path_length(n):
+    """c(n) from the Isolation Forest paper (same as sklearn's _average_path_length)."""
+    n = np.asarray(n, dtype=np.float64)
+    out = np.zeros_like(n)
+    two = n == 2
+    big = n > 2
+    out[two] = 1.0
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + EULER_GAMMA) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+def float32_floor(t):
+    t = np.asarray(t, dtype=np.float64)
+    t32 = t.astype(np.float32)
+    over = t32.astype(np.float64) > t
+    t32[over] = np.nextafter(t32[over], np.float32(-np.inf))
+    return t32
+
+class CompiledForest:
+    def __init__(self, feature, threshold, children, leaf_depth, roots, max_depth, denominator, offset, n_features):
+        self.feature, self.threshold, self.children = feature, threshold, children
+        self.leaf_depth, self.roots = leaf_depth, roots
+        self.max_depth = int(max_depth)
+        self.denominator = float(denominator)
+        self.offset = float(offset)
+        self.n_features = int(n_features)
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        feats, thrs, lefts, rights, depths, roots = [], [], [], [], [], []
+        base, max_depth = 0, 0
+        for est, est_features in zip(forest.estimators_, forest.estimators_features_):
+            t = est.tree_
+            n = t.node_count
+            is_leaf = t.children_left == -1
+            idx = np.arange(n)
+
+            # Node depths (parents always come before children in sklearn's layout)
+            depth = np.zeros(n, dtype=np.float64)
+            for node in range(n):
+                if not is_leaf[node]:
+                    depth[t.children_left[node]] = depth[t.children_right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+            feat = np.where(is_leaf, 0, np.asarray(est_features)[np.maximum(t.feature, 0)])
+            feats.append(feat.astype(np.int32))
+            thrs.append(np.where(is_leaf, np.inf, t.threshold))
+            lefts.append((np.where(is_leaf, idx, t.children_left) + base).astype(np.int32))
+            rights.append((np.where(is_leaf, idx, t.children_right) + base).astype(np.int32))
+            # sklearn: (nodes on the path) + c(samples in leaf) - 1 == depth + c(samples in leaf)
+            corr = depth + average_path_length(t.n_node_samples)
+            depths.append(np.where(is_leaf, corr, 0.0))
+            roots.append(base)
+            base += n
+
+        children = np.empty(2 * base, dtype=np.int32)
+        children[0::2], children[1::2] = np.concatenate(lefts), np.concatenate(rights)
+        denominator = len(forest.estimators_) * average_path_length([forest.max_samples_])[0]
+        return cls(np.concatenate(feats), float32_floor(np.concatenate(thrs)), children,
+                   np.concatenate(depths), np.asarray(roots, dtype=np.int32), max_depth, denominator,
+                   forest.offset_, forest.n_features_in_)
+
+    # --- SCORING ---
+    def _path_lengths(self, X):
+        n = X.shape[0]
+        flat = X.ravel()
+        row_base = (np.arange(n, dtype=np.int32) * self.n_features)[:, None]
+        node = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            went_right = flat.take(self.feature.take(node) + row_base) > self.threshold.take(node)
+            node = self.children.take(node * 2 + went_right)
+        return self.leaf_depth.take(node).sum(axis=1)
+
+    def score_samples(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32) # sklearn compares float32 features too
+        out = np.empty(X.shape[0], dtype=np.float64)
+        for s in range(0, X.shape[0], CHUNK_ROWS):
+            out[s:s + CHUNK_ROWS] = -np.power(2.0, -self._path_lengths(X[s:s + CHUNK_ROWS]) / self.denominator)
+        return out
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset
+
+    # --- PERSISTENCE (plain .npy files, so workers can mmap one shared copy) ---
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        meta = np.array([self.max_depth, self.denominator, self.offset, self.n_features], dtype=np.float64)
+        np.save(os.path.join(directory, "meta.npy"), meta)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mode = "r" if mmap else None
+        arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode) for name in ARRAYS]
+        max_depth, denominator, offset, n_features = np.load(os.path.join(directory, "meta.npy"))
+        return cls(*arrays, max_depth, denominator, offset, n_features)
+
+def compile_forest(model):
+    """CompiledForest for an IsolationForest, or None for anything it can't handle."""
+    if not all(hasattr(model, a) for a in ("estimators_", "estimators_features_", "offset_", "max_samples_")):
+        return None
+    return CompiledForest.from_sklearn(model)
+
+def load_or_compile(model, directory=None):
+    """
+    Compiled forest backed by mmapped .npy files in `directory` (compiled & saved on
+    first use), so every gateway worker shares one copy of the trees.
+    """
+    if directory is None: return compile_forest(model)
+    if not os.path.exists(os.path.join(directory, "meta.npy")):
+        compiled = compile_forest(model)
+        if compiled is None: return None
+        tmp = f"{directory}.{os.getpid()}.tmp"
+        try:
+            compiled.save(tmp)
+            try: os.replace(tmp, directory)
+            except OSError: pass # Another worker won the race; use its copy
+        finally: shutil.rmtree(tmp, ignore_errors=True) # Still there if the rename lost (or save failed)
+    return CompiledForest.load(directory, mmap=True)
+
+# --- EQUIVALENCE CHECK & BENCHMARK ---
+#   python forest_compiler.py
+def _bench(fn, X, repeat):
+    fn(X)
+    t0 = time.perf_counter()
+    for _ in range(repeat): fn(X)
+    return (time.perf_counter() - t0) / repeat * 1000
+
+def check_equivalence(model, n=5000, seed=0, atol=1e-9):
+    rng = np.random.default_rng(seed)
+    # Binary one-hot style rows like the real encoder produces, plus some noise rows
+    X = (rng.random((n, model.n_features_in_)) < 0.3).astype(np.float32)
+    X[: n // 5] = rng.normal(0.5, 1.0, (n // 5, model.n_features_in_)).astype(np.float32)
+    compiled = compile_forest(model)
+    ref = model.decision_function(X)
+    got = compiled.decision_function(X)
+    worst = float(np.max(np.abs(ref - got)))
+    assert worst <= atol, f"Compiled forest deviates from sklearn by {worst}"
+    print(f"✅ Compiled forest matches sklearn on {n} rows (max |diff| = {worst:.2e})")
+    return compiled, X
+
+if __name__ == "__main__":
+    import warnings
+    from model_loader import ModelRegistry
+    warnings.filterwarnings("ignore")
+    forest = ModelRegistry().get("sentinel")
+    compiled, X = check_equivalence(forest)
+    for rows, repeat in ((1, 200), (1000, 20)):
+        sk = _bench(forest.decision_function, X[:rows], repeat)
+        cf = _bench(compiled.decision_function, X[:rows], repeat)
+        print(f"   {rows:>5} rows: sklearn {sk:8.3f} ms | compiled {cf:8.3f} ms | x{sk / cf:.1f}")
@@ -1,10 +1,30 @@
-import joblib
+import time
+import warnings
 import pandas as pd
 import numpy as np
 from groq import Groq
+from feature_encoder import SentinelEncoder, AnalystEncoder
+from reasoning import AsyncReasoner, StubLLMClient
+from device_state import DeviceStateStore
+from model_loader import ModelRegistry
+from scoring_pool import ModelScorer, model_versions
+from decision_memo import DecisionMemo
+from bulk_ingest import log_error, MalformedLogError
+import metrics
+from metrics import lap
+
+# Models were fitted on DataFrames; the encoders feed them plain float32 arrays
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
 
 # --- CONFIGURATION ---
 GROQ_API_KEY = "YOUR_KEY" # <--- PASTE KEY HERE
+USE_STUB_LLM = False      # True = offline demo/tests, answers come from reasoning.StubLLMClient
+USE_STREAM_FEATURES = True # Per-device history can raise jump / irregular / drain-spike flags
+USE_COMPILED_FOREST = True # Score the Sentinel with forest_compiler instead of sklearn's tree walk
+USE_DECISION_MEMO = True   # Steady devices get their last report again instead of a full re-score (decision_memo.py)
+ECO_BATTERY_PCT = 20       # Governor: below this battery % (and no anomaly) = ECO_SAVER
+HIGH_HOURS = 48            # Battery status: predicted hours above this = "High"
+MODERATE_HOURS = 12        # ...above this = "Moderate", else "Low"
 
 SENTINEL_FEATURES = [
     'Sudden jumps in sensor data', 'Battery drain spikes', 'Irregular sending patterns', 
@@ -22,23 +42,79 @@ SENTINEL_FEATURES = [
     'Gateway event logs_Warning'
 ]
 
+# --- INSTRUMENTATION ---
+_PHASE = metrics.histogram("cerberus_analyze_phase_seconds", "Time per analyze_batch phase.", ("phase",))
+PH_STATE, PH_RULES, PH_SENTINEL_ENCODE, PH_ANALYST_ENCODE, PH_MEMO, PH_SENTINEL_SCORE, PH_ANALYST, PH_GOVERN = (
+    _PHASE.labels(p) for p in ("device_state", "hard_rules", "sentinel_encode", "analyst_encode", "memo",
+                               "sentinel_score", "analyst", "govern"))
+ANALYZE_SECONDS = metrics.histogram("cerberus_analyze_batch_seconds", "Total time per analyze_batch call.").labels()
+ANALYZED_LOGS = metrics.counter("cerberus_analyzed_logs_total", "Logs scored by analyze_batch.")
+_LLM = metrics.histogram("cerberus_llm_seconds", "LLM explanation calls (run off the request path).", ("outcome",))
+LLM_OK, LLM_ERROR = _LLM.labels("ok"), _LLM.labels("error")
+
 ANALYST_FEATURES = [
     "connect_count", "freq_connect_attempts", "data_send_count", 
     "time_interval", "fw_update_count", "payload_size", 
     "batt_consumed_per_payload", "uptime_sec", "retry_count", "rssi"
 ]
 
+# Decision memo band per Analyst feature (+ battery %): (absolute, relative) around the last
+# scored input. (0, 0) = any change is a state change (a reconnect, a retry, a firmware update).
+MEMO_TOLERANCE = {
+    "connect_count": (0, 0), "freq_connect_attempts": (0, 0), "data_send_count": (0, 0.05),
+    "time_interval": (1, 0.1), "fw_update_count": (0, 0), "payload_size": (16, 0.05),
+    "batt_consumed_per_payload": (0.02, 0.2), "uptime_sec": (0, 0.05), "retry_count": (0, 0),
+    "rssi": (5, 0), "batteryPercentage": (2, 0),
+}
+
+class PreparedBatch:
+    """A batch between prepare_batch and finish_batch: encoded blocks in, model outputs back."""
+    __slots__ = ("logs", "flags", "sentinel_results", "ml_idx", "sentinel_X", "analyst_X", "scores", "hours",
+                 "todo", "reused", "memo_keys", "t0")
+
+    def __init__(self, logs):
+        self.logs = logs
+        self.flags = None        # (jump, irregular, drain spike) per log, from device history
+        self.sentinel_results = None
+        self.ml_idx = ()
+        self.sentinel_X = None   # float32 (len(ml_idx), 29), None = nothing for the Sentinel
+        self.analyst_X = None    # float32 (len(todo), 10), None = no Analyst model
+        self.scores = None
+        self.hours = None
+        self.todo = range(len(logs)) # Logs the governor runs for (the rest come from the memo)
+        self.reused = None       # {log index: (report, trigger)} answered by the decision memo
+        self.memo_keys = None    # (log indices, devices, fingerprints, band vectors) to store once computed
+        self.t0 = 0.0
+
 class IoTIntelligenceCore:
-    def __init__(self):
+    def __init__(self, llm_client=None, models=None):
         print("⚡ Initializing Intelligence Node...")
-        try: self.analyst = joblib.load("models/analyst.pkl")
-        except: self.analyst = None
-        try: self.sentinel = joblib.load("models/best_anomaly_model.pkl")
-        except: self.sentinel = None
-        try: self.llm_client = Groq(api_key=GROQ_API_KEY)
-        except: self.llm_client = None
+        # Loaded lazily on first use; see model_loader for mmap sharing & hot reload
+        self.models = models or ModelRegistry()
+        if llm_client is not None: self.llm_client = llm_client
+        elif USE_STUB_LLM: self.llm_client = StubLLMClient()
+        else:
+            try: self.llm_client = Groq(api_key=GROQ_API_KEY)
+            except: self.llm_client = None
+        # Explanations are served from a cache; misses are filled in the background
+        self.reasoner = AsyncReasoner(self.generate_reasoning)
+        self.device_states = DeviceStateStore() if USE_STREAM_FEATURES else None
+        self.sentinel_encoder = SentinelEncoder(SENTINEL_FEATURES)
+        self.analyst_encoder = AnalystEncoder(ANALYST_FEATURES)
+        self.scorer = ModelScorer(self.models, compiled=USE_COMPILED_FOREST)
+        tol = [MEMO_TOLERANCE[f] for f in ANALYST_FEATURES + ["batteryPercentage"]]
+        self.memo = DecisionMemo([a for a, _ in tol], [r for _, r in tol]) if USE_DECISION_MEMO else None
+        self._memo_versions = None
 
-    def _preprocess_sentinel(self, log: dict):
+    @property
+    def sentinel(self):
+        return self.models.get("sentinel")
+
+    @property
+    def analyst(self):
+        return self.models.get("analyst")
+
+    def _sentinel_row(self, log: dict):
         data = {f: 0 for f in SENTINEL_FEATURES}
         if log['anomaly']['sensorJump'] or log['telemetry']['temperature'] > 60:
             data['Sudden jumps in sensor data'] = 1
@@ -58,12 +134,12 @@ class IoTIntelligenceCore:
         if not found: data['Change in connection pattern_Stable'] = 1
             
         data['Gateway event logs_Normal operation'] = 1
-        return pd.DataFrame([data])[SENTINEL_FEATURES]
+        return data
 
-    def _preprocess_analyst(self, log: dict):
+    def _analyst_row(self, log: dict):
         bat = log['battery']
         tel = log['telemetry']
-        data = {
+        return {
             "connect_count": bat['connectCount'],
             "freq_connect_attempts": bat['connAttemptCount'],
             "data_send_count": bat['sendCount'],
@@ -75,74 +151,211 @@ class IoTIntelligenceCore:
             "retry_count": bat['retryCount'],
             "rssi": bat['wifiRSSI']
         }
-        return pd.DataFrame([data])[ANALYST_FEATURES]
+
+    # Reference pandas path. The hot path uses feature_encoder; these stay for parity checks.
+    def _preprocess_sentinel(self, log: dict):
+        return pd.DataFrame([self._sentinel_row(log)])[SENTINEL_FEATURES]
+
+    def _preprocess_analyst(self, log: dict):
+        return pd.DataFrame([self._analyst_row(log)])[ANALYST_FEATURES]
 
     def generate_reasoning(self, decision, trigger, log):
-        if not self.llm_client: return f"Logic Trigger: {trigger}"
+        """LLM sentence for a decision; None without a client. Errors propagate so nothing fake gets cached."""
+        if not self.llm_client: return None
         prompt = f"Act as Cerberus AI. Explain decision '{decision}'. Trigger: {trigger}. Context: Bat {log['telemetry']['batteryPercentage']}%, Pattern {log['behaviour']['connectionPattern']}. Output: 1 professional sentence."
+        t = time.perf_counter()
         try:
             res = self.llm_client.chat.completions.create(
                 messages=[{"role": "user", "content": prompt}],
                 model="llama3-8b-8192", max_tokens=60
             )
+            lap(LLM_OK, t)
             return res.choices[0].message.content.strip().replace('"', '')
-        except: return f"Trigger: {trigger}"
+        except Exception:
+            lap(LLM_ERROR, t)
+            raise
 
-    def analyze(self, log: dict):
-        # 1. SENTINEL LOGIC
+    def _hard_rules(self, log: dict):
+        """Rules that never need the model: tampering & overheat."""
         sentinel_res = {"is_anomaly": False, "score": 1.0, "trigger": "None"}
         if log['anomaly']['tampering']:
             sentinel_res["is_anomaly"] = True; sentinel_res["trigger"] = "Physical Tampering"
         elif log['telemetry']['temperature'] > 80:
             sentinel_res["is_anomaly"] = True; sentinel_res["trigger"] = "Critical Overheat"
-        elif self.sentinel:
-            feats = self._preprocess_sentinel(log)
-            score = self.sentinel.decision_function(feats)[0]
-            sentinel_res["score"] = score
-            if score < 0.0:
-                sentinel_res["is_anomaly"] = True
-                sentinel_res["trigger"] = "Abnormal Pattern (ML)"
-
-        # 2. ANALYST LOGIC
-        analyst_res = {"hours_remaining": 0.0}
-        if self.analyst:
-            feats = self._preprocess_analyst(log)
-            analyst_res["hours_remaining"] = self.analyst.predict(feats)[0]
-        else:
-            pct = log['telemetry']['batteryPercentage']
-            drain = log['battery']['batteryConsumedThisPayload'] * 100
-            if drain <= 0: drain = 0.1
-            analyst_res["hours_remaining"] = (pct / 100 * 2000) / drain
+        return sentinel_res
+
+    def _fallback_hours(self, log: dict):
+        pct = log['telemetry']['batteryPercentage']
+        drain = log['battery']['batteryConsumedThisPayload'] * 100
+        if drain <= 0: drain = 0.1
+        return (pct / 100 * 2000) / drain
 
+    def _decide(self, log: dict, sentinel_res):
+        """-> (decision, trigger)"""
+        # 3. GOVERNOR LOGIC
+        if sentinel_res["is_anomaly"]:
+            return "SECURITY_PRIORITY", sentinel_res["trigger"]
+        if log['telemetry']['batteryPercentage'] < ECO_BATTERY_PCT:
+            return "ECO_SAVER", "Critical Battery"
+        return "BALANCED", "System Nominal"
+
+    def _govern(self, log: dict, sentinel_res, hours):
         # --- NEW FEATURE: BATTERY STATUS TAG ---
-        hours = analyst_res["hours_remaining"]
-        if hours > 48:
+        if hours > HIGH_HOURS:
             battery_status = "High"
-        elif hours > 12:
+        elif hours > MODERATE_HOURS:
             battery_status = "Moderate"
         else:
             battery_status = "Low"
 
-        # 3. GOVERNOR LOGIC
-        decision = "BALANCED"
-        trigger = "System Nominal"
-        if sentinel_res["is_anomaly"]:
-            decision = "SECURITY_PRIORITY"
-            trigger = sentinel_res["trigger"]
-        elif log['telemetry']['batteryPercentage'] < 20:
-            decision = "ECO_SAVER"
-            trigger = "Critical Battery"
-
-        reason = self.generate_reasoning(decision, trigger, log)
+        decision, trigger = self._decide(log, sentinel_res)
+        reason = self.reasoner.explain(decision, trigger, log)
 
         return {
             "device_id": log['digitalTwin']['deviceId'],
             "status": decision,
             "explanation": reason,
             "metrics": {
-                "anomaly_score": round(sentinel_res["score"], 3),
-                "battery_prediction_hours": round(analyst_res["hours_remaining"], 1),
+                "anomaly_score": round(float(sentinel_res["score"]), 3),
+                "battery_prediction_hours": round(float(hours), 1),
                 "battery_status": battery_status # <--- ADDED HERE
             }
 
         }
+
+    def _sentinel_scores(self, feats):
+        return self.scorer.sentinel_scores(feats)
+
+    def _apply_stream_flags(self, feats, flags):
+        """OR the history-based flags into rows that the firmware flags alone would miss."""
+        enc = self.sentinel_encoder
+        for row, (jump, irregular, spike) in zip(feats, flags):
+            if jump: row[enc.i_jump] = 1.0
+            if irregular: row[enc.i_irregular] = 1.0
+            if spike: row[enc.i_spike] = 1.0
+
+    def analyze(self, log: dict):
+        return self.analyze_batch([log])[0]
+
+    def analyze_batch(self, logs):
+        """
+        Vectorized version of analyze().
+        Sentinel & Analyst are called ONCE for the whole batch instead of once per log,
+        results come back in the same order as `logs`.
+        """
+        if not logs: return []
+        batch = self.prepare_batch(logs)
+        self.score_batch(batch)
+        return self.finish_batch(batch)
+
+    # analyze_batch in three steps, so a scoring_pool.OrderedPipeline can run the
+    # middle one in worker processes. prepare & finish must see batches in arrival order.
+    def prepare_batch(self, logs):
+        """Device state, hard rules and feature encoding -> PreparedBatch."""
+        for log in logs: # Before any device state moves, so a rejected batch has changed nothing
+            why = log_error(log)
+            if why: raise MalformedLogError(f"Malformed log: {why}")
+        batch = PreparedBatch(logs)
+        batch.t0 = t = time.perf_counter()
+
+        # 0. STREAMING STATE (in arrival order, so per-device history stays correct).
+        #    Flags are read inside each update: two logs from one device (in this batch,
+        #    or in one scored concurrently) must each see the history up to themselves.
+        flags = None
+        if self.device_states is not None:
+            flags = [self.device_states.update(log) for log in logs]
+        batch.flags = flags
+        t = lap(PH_STATE, t)
+
+        # 1. SENTINEL LOGIC (hard rules first, ML only for what's left)
+        batch.sentinel_results = [self._hard_rules(log) for log in logs]
+        batch.ml_idx = ml_idx = [i for i, r in enumerate(batch.sentinel_results) if not r["is_anomaly"]]
+        t = lap(PH_RULES, t)
+        if self.sentinel and ml_idx:
+            feats = self.sentinel_encoder.encode_batch([logs[i] for i in ml_idx])
+            if flags: self._apply_stream_flags(feats, [flags[i] for i in ml_idx])
+            batch.sentinel_X = feats
+            t = lap(PH_SENTINEL_ENCODE, t)
+
+        # 2. ANALYST FEATURES
+        if self.analyst:
+            batch.analyst_X = self.analyst_encoder.encode_batch(logs)
+            t = lap(PH_ANALYST_ENCODE, t)
+
+        # 3. DECISION MEMO (only devices whose inputs moved go on to the models)
+        if self.memo is not None:
+            self._reuse_decisions(batch)
+            lap(PH_MEMO, t)
+        return batch
+
+    def _reuse_decisions(self, batch):
+        logs, memo = batch.logs, self.memo
+        versions = model_versions(self.models)
+        if versions != self._memo_versions: # Hot reload: earlier answers came from the old models
+            memo.clear()
+            self._memo_versions = versions
+        n = len(logs)
+        devices = [log['digitalTwin']['deviceId'] for log in logs]
+        pct = np.fromiter((log['telemetry']['batteryPercentage'] for log in logs), dtype=np.float64, count=n)
+        analyst = batch.analyst_X if batch.analyst_X is not None else self.analyst_encoder.encode_batch(logs)
+        vecs = np.column_stack([analyst, pct])
+        for i, res in enumerate(batch.sentinel_results):
+            if res["is_anomaly"]: memo.bypass(devices[i]) # Hard rule: always computed, the device starts over
+
+        # ml_idx = every row the hard rules let through, in order (= the rows of sentinel_X)
+        cand, X = batch.ml_idx, batch.sentinel_X
+        keys = [(X[j].tobytes() if X is not None else b"", bool(pct[i] < ECO_BATTERY_PCT)) for j, i in enumerate(cand)]
+        found = memo.lookup_batch([devices[i] for i in cand], keys, vecs[cand])
+        miss = [j for j, r in enumerate(found) if r is None]
+        batch.memo_keys = ([cand[j] for j in miss], [devices[cand[j]] for j in miss], [keys[j] for j in miss],
+                           vecs[[cand[j] for j in miss]])
+        reused = {i: r for i, r in zip(cand, found) if r is not None}
+        if not reused: return
+        batch.reused = reused
+        batch.todo = todo = [i for i in range(n) if i not in reused]
+        batch.ml_idx = batch.memo_keys[0]
+        if X is not None: batch.sentinel_X = X[miss] if miss else None
+        if batch.analyst_X is not None: batch.analyst_X = batch.analyst_X[todo] if todo else None
+
+    def score_batch(self, batch):
+        """Model inference, in-process (a ScoringPool fills batch.scores / batch.hours instead)."""
+        t = time.perf_counter()
+        if batch.sentinel_X is not None:
+            batch.scores = self.scorer.sentinel_scores(batch.sentinel_X)
+            t = lap(PH_SENTINEL_SCORE, t)
+        if batch.analyst_X is not None:
+            batch.hours = self.scorer.battery_hours(batch.analyst_X)
+            lap(PH_ANALYST, t)
+        return batch
+
+    def finish_batch(self, batch):
+        """Apply the model outputs and run the governor -> one report per log."""
+        t = time.perf_counter()
+        logs, sentinel_results, todo = batch.logs, batch.sentinel_results, batch.todo
+        if batch.scores is not None:
+            for i, score in zip(batch.ml_idx, batch.scores):
+                sentinel_results[i]["score"] = score
+                if score < 0.0:
+                    sentinel_results[i]["is_anomaly"] = True
+                    sentinel_results[i]["trigger"] = "Abnormal Pattern (ML)"
+        if batch.hours is not None: hours = list(batch.hours)
+        else: hours = [self._fallback_hours(logs[i]) for i in todo]
+
+        computed = [self._govern(logs[i], sentinel_results[i], h) for i, h in zip(todo, hours)]
+        if batch.memo_keys is not None and batch.memo_keys[0]:
+            idx, devices, keys, vecs = batch.memo_keys
+            by_log = dict(zip(todo, computed))
+            self.memo.store_batch(devices, keys, vecs, [by_log[i] for i in idx],
+                                  [self._decide(logs[i], sentinel_results[i])[1] for i in idx])
+        if batch.reused:
+            results = [None] * len(logs)
+            for i, report in zip(todo, computed): results[i] = report
+            for i, (report, trigger) in batch.reused.items():
+                # Current explanation, not the (often "Logic Trigger: ...") one stored with the entry
+                report["explanation"] = self.reasoner.explain(report["status"], trigger, logs[i])
+                results[i] = report
+        else: results = computed
+        lap(PH_GOVERN, t)
+        lap(ANALYZE_SECONDS, batch.t0)
+        ANALYZED_LOGS.inc(len(logs))
+        return results
@@ -1,22 +1,75 @@
+import sys
 import uvicorn
+import asyncio
 import requests
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request, WebSocket
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import json
+import time
+from contextlib import asynccontextmanager
 
 # IMPORT YOUR MODULES
 from iot_core import IoTIntelligenceCore  # Your AI Brain
 from crypto_layer import QuantumSecurityLayer # Your Encryption
+from batching import MicroBatcher
+from envelope import encode_for_upload, CONTENT_TYPE_JSON
+from uplink import Uplink
+from bulk_ingest import LogStreamParser, IngestError, MalformedLogError, check_log
+from scoring_pool import start_pool
+import telemetry_store
+from telemetry_store import TelemetryStore
+import metrics
+from metrics import lap
 
 # --- CONFIG ---
 NODE_SERVER_URL = "http://10.207.23.138:3000/api/receive-report"
+BATCH_MAX_WAIT_MS = 5    # Collect concurrent /ingest calls for up to 5 ms...
+BATCH_MAX_SIZE = 64      # ...or until 64 are waiting, then score them in one go
+MODEL_WATCH_SEC = 0      # >0 = poll the .pkl files and hot-reload when they change
+SCORING_WORKERS = 0      # 0 = models run in this process; N or "auto" = scoring_pool worker processes (one per core)
+CRYPTO_SESSIONS = True   # One Kyber encapsulation per key rotation window, not per report
+UPLINK_FORMAT = "json"   # "binary" = compact envelope.py framing (Node server must accept it)
+UPLINK_BATCH_MAX = 1     # >1 = several reports per POST (JSON array / concatenated envelopes; Node server must accept it)
+SEND_TO_NODE = False     # False = demo mode, just print the encrypted packet
+STORE_TELEMETRY = True   # Keep every log + analysis in .telemetry/ for replays & retraining (telemetry_store.py)
+BULK_CHUNK = 256         # /ingest/batch scores this many logs per analyze_batch call (one upload each)
+BULK_MAX_ITEMS = 10_000  # Logs per /ingest/batch request; the rest of the body is refused
+STREAM_MAX_IN_FLIGHT = 32 # /ingest/stream messages scored concurrently per connection (replies stay in order)
 
-app = FastAPI(title="Project Cerberus Gateway")
+@asynccontextmanager
+async def lifespan(app):
+    """Starts / stops the scoring worker pool (SCORING_WORKERS) around the server."""
+    global analyzer
+    if SCORING_WORKERS:
+        analyzer = await asyncio.get_running_loop().run_in_executor(None, start_pool, brain, SCORING_WORKERS)
+        # Keep every worker busy while the next batches are being encoded
+        batcher.submit_fn = analyzer.submit
+        batcher.max_in_flight = 2 * analyzer.pool.size
+    yield
+    if analyzer is not brain: analyzer.pool.stop()
+    if store: store.stop()
+
+app = FastAPI(title="Project Cerberus Gateway", lifespan=lifespan)
+app.include_router(metrics.fastapi_router()) # /metrics + /debug/profile
+
+_INGEST = metrics.histogram("cerberus_ingest_phase_seconds", "Time per /ingest phase.", ("phase",))
+INGEST_ANALYZE, INGEST_ENCRYPT = _INGEST.labels("analyze"), _INGEST.labels("encrypt") # analyze includes the batch wait
+INGEST_BULK = _INGEST.labels("bulk_chunk") # analyze + encrypt of one /ingest/batch chunk
+_LOGS = metrics.counter("cerberus_ingest_logs_total", "Logs received, by endpoint.", ("endpoint",))
+LOGS_SINGLE, LOGS_BATCH, LOGS_STREAM = _LOGS.labels("ingest"), _LOGS.labels("batch"), _LOGS.labels("stream")
 
 # Initialize Systems
 brain = IoTIntelligenceCore()
-crypto = QuantumSecurityLayer()
+crypto = QuantumSecurityLayer(session_mode=CRYPTO_SESSIONS)
+batcher = MicroBatcher(brain.analyze_batch, max_wait_ms=BATCH_MAX_WAIT_MS, max_batch_size=BATCH_MAX_SIZE,
+                       retry_on=(MalformedLogError,))
+if MODEL_WATCH_SEC > 0: brain.models.watch(MODEL_WATCH_SEC)
+uplink = Uplink(NODE_SERVER_URL, name="reports", batch_max=UPLINK_BATCH_MAX)
+analyzer = brain         # .analyze_batch; a scoring_pool.OrderedPipeline once the pool is up
+store = TelemetryStore() if STORE_TELEMETRY else None
+if store: app.include_router(telemetry_store.fastapi_router(store)) # /telemetry range scans
+
 
 # Hardware Input Model
 class HardwareLog(BaseModel):
@@ -27,19 +80,39 @@ class HardwareLog(BaseModel):
     anomaly: Dict[str, Any]
     security: Dict[str, Any]
 
-def send_to_cloud_node(encrypted_packet):
+def send_to_cloud_node(body, headers):
     """Background Task: Pushes encrypted data to Node.js Server"""
     try:
         print("🚀 Sending Quantum-Encrypted Report to Node Server...")
-        # Real Send
-        # response = requests.post(NODE_SERVER_URL, json=encrypted_packet)
-        # print(f"☁️ Node Server Responded: {response.status_code}")
+        # Real Send (queued, batched & retried by the uplink worker)
+        if SEND_TO_NODE:
+            uplink.send(body, headers)
+            return
         
         # FOR DEMO: Just print the encrypted blob so you can show judges
-        print(json.dumps(encrypted_packet, indent=2))
+        if headers["Content-Type"] == CONTENT_TYPE_JSON:
+            print(json.dumps(json.loads(body), indent=2))
+        else:
+            print(f"📦 {headers['Content-Type']} ({len(body)} bytes): {body[:48].hex()}...")
     except Exception as e:
         print(f"❌ Failed to push to cloud: {e}")
 
+def cloud_report(log_dict, ai_report):
+    """The clean JSON your teammate wants"""
+    return {
+        "device_id": ai_report['device_id'],
+        "timestamp": log_dict['telemetry'].get('lastContactTime'), # Optional: device_state falls back to gateway time
+        "status": ai_report['status'],       # "SECURITY_PRIORITY"
+        "reasoning": ai_report['explanation'], # "LLM Text..."
+        "metrics": ai_report['metrics']
+    }
+
+def command_for(status):
+    """Immediate reply to the hardware. Not encrypted, to save battery/latency on the edge."""
+    if status == "SECURITY_PRIORITY": return "LOCKDOWN_MODE"
+    if status == "ECO_SAVER": return "DEEP_SLEEP_60"
+    return "SLEEP_15"
+
 @app.post("/ingest")
 async def ingest_hardware_data(log: HardwareLog, background_tasks: BackgroundTasks):
     """
@@ -48,35 +121,236 @@ async def ingest_hardware_data(log: HardwareLog, background_tasks: BackgroundTas
     3. ENCRYPT result with Kyber-512.
     4. SEND to Node.js backend.
     """
-    # 1. AI Processing
+    # 1. AI Processing (micro-batched with other concurrent requests)
     log_dict = log.dict()
-    ai_report = brain.analyze(log_dict)
+    LOGS_SINGLE.inc()
+    t = time.perf_counter()
+    ai_report = await batcher.submit(log_dict)
+    t = lap(INGEST_ANALYZE, t)
     
     # 2. Create the "Payload" for the Cloud
-    # This is the clean JSON your teammate wants
-    clean_payload = {
-        "device_id": ai_report['device_id'],
-        "timestamp": log_dict['telemetry']['lastContactTime'],
-        "status": ai_report['status'],       # "SECURITY_PRIORITY"
-        "reasoning": ai_report['explanation'], # "LLM Text..."
-        "metrics": ai_report['metrics']
-    }
+    clean_payload = cloud_report(log_dict, ai_report)
     
     # 3. Quantum Encryption
-    secure_packet = crypto.encrypt_payload(clean_payload)
+    body, headers = encode_for_upload(crypto, clean_payload, UPLINK_FORMAT)
+    lap(INGEST_ENCRYPT, t)
+    if store: store.append(log_dict, ai_report)
     
     # 4. Send to Node (Background)
-    background_tasks.add_task(send_to_cloud_node, secure_packet)
+    background_tasks.add_task(send_to_cloud_node, body, headers)
     
     # 5. Reply to Hardware (Immediate Command)
-    # We don't encrypt the hardware reply to save battery/latency on the edge
-    command = "SLEEP_15"
-    if ai_report['status'] == "SECURITY_PRIORITY":
-        command = "LOCKDOWN_MODE"
-    elif ai_report['status'] == "ECO_SAVER":
-        command = "DEEP_SLEEP_60"
-        
-    return {"command": command, "sync": "success"}
+    return {"command": command_for(ai_report['status']), "sync": "success"}
+
+# --- BULK & STREAMING INGEST ---
+def score_chunk(logs):
+    """
+    Thread-pool side of /ingest/batch: one analyze_batch call, all its reports sealed in ONE envelope.
+    The envelope is built before anything is stored, so only analyze_batch itself can fail after
+    device state moved (and then the chunk is not scored again, see ingest_batch).
+    """
+    t = time.perf_counter()
+    ai_reports = analyzer.analyze_batch(logs)
+    payloads = [cloud_report(l, r) for l, r in zip(logs, ai_reports)]
+    body, headers = encode_for_upload(crypto, payloads, UPLINK_FORMAT, batch=True)
+    if store:
+        for log, r in zip(logs, ai_reports): store.append(log, r)
+    lap(INGEST_BULK, t)
+    return ai_reports, body, headers
+
+@app.post("/ingest/batch")
+async def ingest_batch(request: Request, background_tasks: BackgroundTasks):
+    """
+    Backlog upload from a device that was offline: a JSON array of logs, or NDJSON.
+    The body is parsed while it streams in and scored BULK_CHUNK logs at a time
+    (the next chunk parses while the previous one is being scored).
+    Replies {"results": [{"index", "device_id", "command"} or {"index", "error"}, ...]}.
+    If the body breaks off (bad JSON array, too many logs), everything before that
+    point is still processed and "error" says where it stopped.
+    """
+    loop = asyncio.get_running_loop()
+    parser = LogStreamParser()
+    results, chunk, job, error = [], [], None, None
+
+    def accept(items):
+        for item in items:
+            i = len(results)
+            if i >= BULK_MAX_ITEMS: raise IngestError(f"More than {BULK_MAX_ITEMS} logs in one request")
+            log, why = (None, str(item)) if isinstance(item, IngestError) else check_log(item)
+            results.append({"index": i, "error": why} if why else None)
+            if log is not None: chunk.append((i, log))
+
+    async def finish(job):
+        indexed, fut = job
+        try: scored = [(indexed, await fut)]
+        except MalformedLogError: # Refused before any state changed: score item by item, report the bad ones
+            scored = []
+            for pair in indexed:
+                try: scored.append(([pair], await loop.run_in_executor(None, score_chunk, [pair[1]])))
+                except Exception as e: results[pair[0]] = {"index": pair[0], "error": f"Analysis failed: {e}"}
+        except Exception as e: # Device state may have moved already, so the chunk is not re-run
+            scored = []
+            for i, _ in indexed: results[i] = {"index": i, "error": f"Analysis failed: {e}"}
+        for part, (ai_reports, body, headers) in scored:
+            background_tasks.add_task(send_to_cloud_node, body, headers)
+            for (i, _), r in zip(part, ai_reports):
+                results[i] = {"index": i, "device_id": r['device_id'], "command": command_for(r['status'])}
+
+    def submit(indexed):
+        return indexed, loop.run_in_executor(None, score_chunk, [log for _, log in indexed])
+
+    try:
+        async for data in request.stream():
+            accept(parser.feed(data))
+            while len(chunk) >= BULK_CHUNK:
+                if job: await finish(job)
+                job = submit(chunk[:BULK_CHUNK])
+                del chunk[:BULK_CHUNK]
+        accept(parser.close())
+    except IngestError as e:
+        error = str(e)
+    if job: await finish(job)
+    if chunk: await finish(submit(chunk))
+
+    LOGS_BATCH.inc(len(results))
+    rejected = sum(1 for r in results if "error" in r)
+    reply = {"sync": "success" if error is None else "partial", "received": len(results),
+             "scored": len(results) - rejected, "rejected": rejected, "results": results}
+    if error: reply["error"] = error
+    return reply
+
+async def stream_message(data):
+    """One /ingest/stream message -> its reply (errors are replies too, the socket stays up)."""
+    try:
+        obj = json.loads(data)
+    except ValueError as e:
+        return {"error": f"Invalid JSON: {e}"}
+    log_dict, why = check_log(obj)
+    if why: return {"error": "Send one log per message (backlogs go to /ingest/batch)" if isinstance(obj, list) else why}
+    LOGS_STREAM.inc()
+    try:
+        ai_report = await batcher.submit(log_dict)
+        body, headers = encode_for_upload(crypto, cloud_report(log_dict, ai_report), UPLINK_FORMAT)
+        if store: store.append(log_dict, ai_report)
+    except Exception as e:
+        return {"error": f"Analysis failed: {e}"}
+    asyncio.get_running_loop().run_in_executor(None, send_to_cloud_node, body, headers)
+    return {"command": command_for(ai_report['status']), "sync": "success"}
+
+@app.websocket("/ingest/stream")
+async def ingest_stream(ws: WebSocket):
+    """
+    Persistent device link: every message (text or binary) is one log as JSON, and
+    gets the same {"command", "sync"} reply as /ingest, in message order. Up to
+    STREAM_MAX_IN_FLIGHT messages are scored at once, so a burst shares micro-batches.
+    """
+    await ws.accept()
+    replies = asyncio.Queue(STREAM_MAX_IN_FLIGHT)
+
+    async def writer():
+        while True:
+            task = await replies.get()
+            await ws.send_json(await task)
+
+    sender = asyncio.ensure_future(writer())
+    try:
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect": break
+            data = msg.get("text") if msg.get("text") is not None else msg.get("bytes")
+            await replies.put(asyncio.ensure_future(stream_message(data)))
+            if sender.done(): break # Send side failed (client gone)
+    finally:
+        sender.cancel()
+
+class ModelReloadRequest(BaseModel):
+    name: Optional[str] = None   # "sentinel" / "analyst", None = both
+    path: Optional[str] = None   # New .pkl inside MODEL_DIR to switch to (needs name), None = re-read the current file
+
+@app.get("/uplink")
+async def uplink_status():
+    """Queue depth, in-flight requests, retries, spool & drops."""
+    return uplink.stats()
+
+@app.get("/scoring")
+async def scoring_status():
+    """Worker pool: size, idle workers, jobs, respawns, in-process fallbacks."""
+    return analyzer.stats() if analyzer is not brain else {"workers": 0}
+
+@app.get("/memo")
+async def memo_status():
+    """Decision memo: hit rate, stale entries, hard-rule bypasses, devices tracked."""
+    return brain.memo.stats() if brain.memo is not None else {"enabled": False}
+
+@app.get("/reasoning")
+async def reasoning_status():
+    """LLM explanation cache: size, hits, misses, evictions, expirations, pending / dropped / failed fills."""
+    return brain.reasoner.stats()
+
+@app.get("/models")
+async def model_status():
+    """Load report: version hash, load time, mmap on/off, last error."""
+    return brain.models.report()
+
+@app.post("/models/reload")
+async def reload_models(req: ModelReloadRequest):
+    """Hot-swap a new model version without restarting the gateway."""
+    if req.name and req.name not in brain.models.artifacts:
+        raise HTTPException(status_code=404, detail=f"Unknown model '{req.name}'")
+    try:
+        ok = await asyncio.get_running_loop().run_in_executor(None, brain.models.reload, req.name, req.path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"reloaded": ok, "models": brain.models.report()}
+
+# --- SELF-CHECK ---
+#   python main.py --self-check
+if __name__ == "__main__" and sys.argv[1:2] == ["--self-check"]:
+    import copy
+    import shutil
+    import tempfile
+    from fastapi.testclient import TestClient
+    from fleet_sim import FleetGenerator
+    from reasoning import StubLLMClient
+
+    directory = tempfile.mkdtemp()
+    store.stop()
+    store = TelemetryStore(directory)
+    brain.llm_client = StubLLMClient()
+    send_to_cloud_node = lambda body, headers: None # Nothing to show here
+    def samples(): return sum(st.samples for st in brain.device_states._states.values())
+    def stored():
+        store.flush()
+        return sum(1 for _ in store.scan())
+
+    logs = FleetGenerator(20, "normal", seed=11).take(600)
+    for log in logs[::3]: del log["telemetry"]["lastContactTime"] # Optional field
+    bad = copy.deepcopy(logs[7]); del bad["battery"]["retryCount"]
+    body = "\n".join(json.dumps(l) for l in logs[:300] + [bad] + logs[300:])
+    try:
+        with TestClient(app, raise_server_exceptions=False) as client:
+            # /ingest/batch: the bad line is rejected, every other log scored and stored exactly once
+            r = client.post("/ingest/batch", content=body).json()
+            assert (r["scored"], r["rejected"]) == (600, 1) and r["results"][300]["error"].startswith("Missing")
+            assert samples() == 600 and stored() == 600, (samples(), stored())
+
+            # A failure after device state moved: the whole chunk fails, nothing is scored twice
+            score_batch, brain.score_batch = brain.score_batch, lambda batch: 1 / 0
+            r = client.post("/ingest/batch", content=body).json()
+            brain.score_batch = score_batch
+            assert r["scored"] == 0 and all("error" in x for x in r["results"])
+            assert samples() == 1200 and stored() == 600, (samples(), stored())
 
-if __name__ == "__main__":
+            # /ingest: one malformed log among concurrent requests fails alone
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(8) as pool:
+                codes = list(pool.map(lambda l: client.post("/ingest", json=l).status_code, logs[:7] + [bad]))
+            assert codes == [200] * 7 + [500] and samples() == 1207 and stored() == 607, (codes, samples(), stored())
+        print(f"✅ Ingest OK: {stored()} stored, {samples()} device updates, batcher {batcher.batches_run} batches")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+elif __name__ == "__main__":
+    print("📦 Warming models...")
+    brain.models.warm()
+    brain.models.print_report()
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,384 @@
+import sys
+import time
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from collections import Counter as _StackCounter
+
+# --- METRICS ---
+# Tiny Prometheus-compatible registry: histograms / counters / callback gauges,
+# rendered in the text exposition format for the /metrics endpoints.
+# Hot paths time themselves with perf_counter and `lap()`:
+#
+#     t = time.perf_counter()
+#     ...encode...
+#     t = lap(ENCODE, t)      # observes now - t, returns now for the next phase
+#
+# Everything is a no-op while ENABLED is False (flip it at runtime with set_enabled).
+# Observations don't take a lock: each update is a few bytecodes under the GIL, and
+# a rare lost increment under heavy contention is fine for monitoring. `lap()` wants
+# a child: `.labels(...)`, or `.labels()` for a histogram without labels.
+
+ENABLED = True
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def set_enabled(on):
+    global ENABLED
+    ENABLED = bool(on)
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra: pairs.append(extra)
+    if not pairs: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+def _fmt_value(v):
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        if not ENABLED: return
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ("child", "t0")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(perf_counter() - self.t0)
+
+def lap(child, t0):
+    """Observe perf_counter() - t0 into histogram `child`; returns the new perf_counter() reading."""
+    now = perf_counter()
+    if ENABLED:
+        v = now - t0
+        child.counts[bisect_left(child.bounds, v)] += 1
+        child.sum += v
+        child.count += 1
+    return now
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        if not self.labelnames: self._default = self.labels()
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def render(self):
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            counts, total, n = list(child.counts), child.sum, child.count
+            running = 0
+            for bound, c in zip(self.bounds + (float("inf"),), counts):
+                running += c
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', _fmt_value(bound)))} {running}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return lines
+
+    def snapshot(self, *values):
+        """{'count', 'sum', 'p50', 'p99'} estimated from the buckets (for reports and tests)."""
+        child = self._children.get(tuple(str(v) for v in values))
+        if child is None or not child.count: return {"count": 0, "sum": 0.0}
+        out = {"count": child.count, "sum": child.sum}
+        for q in (0.5, 0.99):
+            target, running = q * child.count, 0
+            for bound, c in zip(self.bounds + (float("inf"),), child.counts):
+                running += c
+                if running >= target:
+                    out[f"p{int(q * 100)}"] = bound
+                    break
+        return out
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        if ENABLED: self.value += amount
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        if not self.labelnames: self._default = self.labels()
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def render(self):
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(child.value)}")
+        return lines
+
+class Gauge(_Metric):
+    """Read at scrape time from callbacks (queue depths, spool size...), so the hot path pays nothing."""
+    kind = "gauge"
+
+    def _new_child(self):
+        return None
+
+    def set_function(self, labelvalues, fn):
+        with self._lock: self._children[tuple(str(v) for v in labelvalues)] = fn
+
+    def render(self):
+        lines = self._header()
+        for key, fn in sorted(self._children.items()):
+            try: value = fn()
+            except Exception: continue
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kw):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = cls(name, help, labelnames, **kw)
+            elif not isinstance(m, cls) or m.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return m
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def render(self):
+        with self._lock: metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics: lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+histogram, counter, gauge, render = REGISTRY.histogram, REGISTRY.counter, REGISTRY.gauge, REGISTRY.render
+
+# --- SAMPLING PROFILER ---
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack each `interval_sec` from a background
+    thread (sys._current_frames), so it can be switched on in a live gateway
+    and costs nothing while off. Output is folded stacks (flamegraph.pl /
+    speedscope format) plus the hottest frames.
+    """
+    def __init__(self):
+        self.interval = 0.005
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stacks = _StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_sec=0.005):
+        with self._lock:
+            if self.running: return False
+            self.interval = max(0.0005, float(interval_sec))
+            self._stacks.clear()
+            self.samples = 0
+            self.started_at, self.stopped_at = time.time(), None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="sampling-profiler")
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            if not self.running: return False
+            self._stop.set()
+            self._thread.join()
+            self.stopped_at = time.time()
+            return True
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for t in threading.enumerate(): names[t.ident] = t.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me: continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{code.co_filename.rsplit('/', 1)[-1].rsplit(chr(92), 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(parts))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return "\n".join(f"{stack} {n}" for stack, n in self._stacks.most_common())
+
+    def report(self, top=20):
+        leaf = _StackCounter()
+        for stack, n in self._stacks.items(): leaf[stack.rsplit(";", 1)[-1]] += n
+        total = sum(self._stacks.values()) or 1
+        return {"running": self.running, "interval_sec": self.interval, "samples": self.samples,
+                "started_at": self.started_at, "stopped_at": self.stopped_at,
+                "top_frames": [{"frame": f, "share": round(n / total, 4)} for f, n in leaf.most_common(top)],
+                "top_stacks": [{"stack": s, "count": n} for s, n in self._stacks.most_common(top)]}
+
+PROFILER = SamplingProfiler()
+
+# --- HTTP ENDPOINTS (shared by main.py and data.py) ---
+def fastapi_router():
+    """GET /metrics (Prometheus text) + /debug/profile start/stop/report."""
+    from fastapi import APIRouter, Response
+    router = APIRouter()
+
+    @router.get("/metrics")
+    async def prometheus_metrics():
+        return Response(render(), media_type=CONTENT_TYPE)
+
+    @router.post("/debug/profile/start")
+    async def profile_start(interval_sec: float = 0.005):
+        started = PROFILER.start(interval_sec)
+        return {"started": started, **PROFILER.report(top=0)}
+
+    @router.post("/debug/profile/stop")
+    async def profile_stop(top: int = 20):
+        PROFILER.stop()
+        return PROFILER.report(top)
+
+    @router.get("/debug/profile")
+    async def profile_report(top: int = 20, folded: bool = False):
+        if folded: return Response(PROFILER.folded(), media_type="text/plain")
+        return PROFILER.report(top)
+
+    @router.post("/debug/metrics")
+    async def metrics_toggle(enabled: bool = True):
+        set_enabled(enabled)
+        return {"enabled": ENABLED}
+
+    return router
+
+# --- SELF-CHECK & OVERHEAD BENCHMARK ---
+#   python metrics.py
+if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings("ignore")
+
+    h = Histogram("test_seconds", "Test.", ("phase",))
+    for v in (0.0001, 0.002, 0.002, 3.0): h.labels("a").observe(v)
+    text = "\n".join(h.render())
+    assert 'test_seconds_bucket{phase="a",le="0.0025"} 3' in text and 'test_seconds_count{phase="a"} 4' in text
+    assert 'le="+Inf"} 4' in text and h.snapshot("a")["p50"] == 0.0025
+
+    # Cost of one observation
+    child, n = h.labels("b"), 200_000
+    t0 = time.perf_counter()
+    for _ in range(n): lap(child, time.perf_counter())
+    per_obs_ns = (time.perf_counter() - t0) / n * 1e9
+
+    # A/B on the instrumented hot paths
+    from fleet_sim import FleetGenerator
+    from iot_core import IoTIntelligenceCore
+    from crypto_layer import QuantumSecurityLayer
+    from reasoning import StubLLMClient
+    brain = IoTIntelligenceCore(llm_client=StubLLMClient())
+    crypto = QuantumSecurityLayer(session_mode=True)
+    logs = FleetGenerator(50, "mixed", seed=0).take(3000)
+    for log in logs[:300]: brain.analyze(log)
+
+    def once(fn, items):
+        t0 = time.perf_counter()
+        for item in items: fn(item)
+        return (time.perf_counter() - t0) / len(items)
+
+    def ab(fn, items, rounds=7):
+        """Best of `rounds`, alternating off/on so drift (turbo, GC, caches) hits both equally."""
+        off = on = float("inf")
+        for _ in range(rounds):
+            set_enabled(False); off = min(off, once(fn, items))
+            set_enabled(True); on = min(on, once(fn, items))
+        return off, on
+
+    print(f"✅ Metrics registry OK; one lap() observation costs {per_obs_ns:.0f} ns")
+    report = {"device_id": "ESP32-0001", "timestamp": 1700000000, "status": "BALANCED", "reasoning": "x",
+              "metrics": {"anomaly_score": 0.1, "battery_prediction_hours": 40.0, "battery_status": "High"}}
+    for label, fn, items in (("analyze", brain.analyze, logs),
+                             ("analyze_batch(64)", brain.analyze_batch, [logs[i:i + 64] for i in range(0, len(logs), 64)]),
+                             ("encrypt_payload", crypto.encrypt_payload, [report] * 5000)):
+        off, on = ab(fn, items)
+        print(f"   {label:<18} off {off * 1e6:8.1f} µs | on {on * 1e6:8.1f} µs | overhead {100 * (on - off) / off:+.1f}%")
+
+    PROFILER.start(0.001)
+    for log in logs: brain.analyze(log)
+    PROFILER.stop()
+    top = PROFILER.report(5)["top_frames"]
+    assert PROFILER.samples > 0 and top
+    print(f"✅ Sampling profiler: {PROFILER.samples} samples, hottest frame {top[0]['frame']}")
@@ -0,0 +1,207 @@
+import os
+import time
+import hashlib
+import threading
+import joblib
+
+# --- CONFIGURATION ---
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(MODEL_DIR, ".model_cache")
+ARTIFACTS = {
+    "sentinel": "sentinal.pkl",       # Isolation Forest (the shipped file name has the typo)
+    "analyst": "analyst_model.pkl",   # Battery regressor
+}
+USE_MMAP = True # Re-dump to an uncompressed cache once, then every worker mmaps the same file
+
+def model_path(path):
+    """Resolve a model file for a reload request; only files inside MODEL_DIR are accepted (ValueError otherwise)."""
+    root = os.path.realpath(MODEL_DIR)
+    full = os.path.realpath(path if os.path.isabs(path) else os.path.join(MODEL_DIR, path))
+    if os.path.commonpath([root, full]) != root: raise ValueError("Model path must be inside the model directory")
+    return full
+
+def file_version(path):
+    """Short content hash, so two workers agree on what 'the same model' is."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+class ModelArtifact:
+    """
+    One lazily-loaded model file.
+    `.model` loads on first use; reload() swaps in a new version atomically so
+    requests already holding the old object finish with it.
+    """
+    def __init__(self, name, path, mmap=USE_MMAP, cache_dir=CACHE_DIR):
+        self.name = name
+        self.path = path if os.path.isabs(path) else os.path.join(MODEL_DIR, path)
+        self.mmap = mmap
+        self.cache_dir = cache_dir
+        self._model = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.version = None
+        self.error = None
+        self.load_ms = None
+        self.source = None
+        self.loaded_at = None
+        self._stat = None
+
+    @property
+    def model(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded: self._swap(*self._load(self.path))
+        return self._model
+
+    def _mmap_source(self, path, version):
+        # joblib can only mmap arrays from an uncompressed dump, so write one per version.
+        # Written to a temp name + rename, so concurrent workers never read a half file.
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cached = os.path.join(self.cache_dir, f"{self.name}-{version}.joblib")
+        if not os.path.exists(cached):
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            try:
+                joblib.dump(joblib.load(path), tmp)
+                os.replace(tmp, cached)
+            finally:
+                if os.path.exists(tmp): os.remove(tmp)
+        return cached
+
+    def _load(self, path):
+        t0 = time.perf_counter()
+        stat = version = None
+        try:
+            stat = os.stat(path)
+            version = file_version(path)
+            model = None
+            if self.mmap:
+                try:
+                    source = self._mmap_source(path, version)
+                    model = joblib.load(source, mmap_mode="r")
+                except Exception as e: # e.g. read-only model dir: still serve, just not shared
+                    print(f"⚠️ No mmap cache for {self.name} ({type(e).__name__}: {e}), loading {path} directly")
+            if model is None:
+                source = path
+                model = joblib.load(path)
+            error = None
+        except Exception as e:
+            model, source, version, error = None, path, None, f"{type(e).__name__}: {e}"
+            print(f"❌ Failed to load {self.name} model from {path}: {error}")
+        return model, path, version, source, error, stat, (time.perf_counter() - t0) * 1000
+
+    def _swap(self, model, path, version, source, error, stat, load_ms):
+        self._model, self.path, self.version = model, path, version
+        self.source, self.error, self._stat, self.load_ms = source, error, stat, load_ms
+        self.loaded_at = time.time()
+        self._loaded = True
+
+    def reload(self, path=None):
+        """Load `path` (or the current file again) and swap it in. Keeps the old model on failure."""
+        loaded = self._load(path or self.path)
+        with self._lock:
+            if loaded[0] is None and self._model is not None:
+                self.error = loaded[4]
+                return False
+            self._swap(*loaded)
+        print(f"🔄 {self.name} model now at version {self.version} ({self.load_ms:.0f} ms)")
+        return True
+
+    def changed_on_disk(self):
+        try: st = os.stat(self.path)
+        except OSError: return False
+        return self._stat is None or (st.st_mtime_ns, st.st_size) != (self._stat.st_mtime_ns, self._stat.st_size)
+
+    def report(self):
+        return {"path": self.path, "loaded": self._loaded, "version": self.version,
+                "mmap": self.mmap and self.source != self.path, "load_ms": self.load_ms and round(self.load_ms, 1),
+                "error": self.error}
+
+class ModelRegistry:
+    def __init__(self, artifacts=None, mmap=USE_MMAP, lazy=True):
+        artifacts = artifacts or ARTIFACTS
+        self.artifacts = {name: ModelArtifact(name, path, mmap=mmap) for name, path in artifacts.items()}
+        self._watcher = None
+        if not lazy: self.warm()
+
+    def get(self, name):
+        return self.artifacts[name].model
+
+    def warm(self):
+        for a in self.artifacts.values(): a.model
+        return self.report()
+
+    def reload(self, name=None, path=None):
+        """Reload `name` (None = all) from disk; a new `path` needs a `name` and must be inside MODEL_DIR."""
+        if path is not None:
+            if not name: raise ValueError("A model name is required when switching to a new path")
+            path = model_path(path)
+        names = [name] if name else list(self.artifacts)
+        return {n: self.artifacts[n].reload(path) for n in names}
+
+    def reload_if_changed(self):
+        return {n: a.reload() for n, a in self.artifacts.items() if a._loaded and a.changed_on_disk()}
+
+    def watch(self, interval_sec=10.0):
+        """Background poller: drop a new .pkl over the old one and it is picked up without a restart."""
+        if self._watcher: return
+        def loop():
+            while True:
+                time.sleep(interval_sec)
+                self.reload_if_changed()
+        self._watcher = threading.Thread(target=loop, daemon=True, name="model-watch")
+        self._watcher.start()
+
+    def report(self):
+        return {n: a.report() for n, a in self.artifacts.items()}
+
+    def print_report(self):
+        for n, r in self.report().items():
+            if not r["loaded"]: print(f"   ⏳ {n}: not loaded yet (lazy)")
+            elif r["version"] is None: print(f"   ❌ {n}: {r['error']}")
+            else:
+                print(f"   📦 {n}: version {r['version']} in {r['load_ms']} ms{' (mmap)' if r['mmap'] else ''}")
+                if r["error"]: print(f"      ⚠️ last reload failed: {r['error']}")
+
+# --- SELF-CHECK ---
+#   python model_loader.py
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    import numpy as np
+
+    directory = tempfile.mkdtemp()
+    try:
+        v1, v2, bad = (os.path.join(directory, n) for n in ("v1.pkl", "v2.pkl", "bad.pkl"))
+        joblib.dump({"w": np.arange(4096.0)}, v1, compress=3)
+        joblib.dump({"w": np.ones(4096)}, v2, compress=3)
+        with open(bad, "wb") as f: f.write(b"not a pickle")
+
+        # Lazy, then mmap'd from an uncompressed cache keyed by version
+        a = ModelArtifact("m", v1, cache_dir=os.path.join(directory, "cache"))
+        assert not a.report()["loaded"]
+        assert isinstance(a.model["w"], np.memmap) and a.report()["mmap"] and a.version == file_version(v1)
+
+        # Reload: a broken file keeps the old model, a good one swaps, an edit on disk is noticed
+        assert a.reload(bad) is False and a.model["w"][1] == 1.0 and a.error and a.version == file_version(v1)
+        assert a.reload(v2) is True and a.model["w"][1] == 1.0 and a.path == v2 and a.error is None
+        assert not a.changed_on_disk()
+        shutil.copy(v1, v2)
+        assert a.changed_on_disk() and a.reload() and a.model["w"][3] == 3.0
+
+        # No writable cache: still served, straight from the file
+        with open(os.path.join(directory, "file"), "w"): pass
+        b = ModelArtifact("m", v1, cache_dir=os.path.join(directory, "file"))
+        assert b.model["w"][3] == 3.0 and not b.report()["mmap"]
+
+        # /models/reload paths stay inside MODEL_DIR and need a model name
+        assert model_path(ARTIFACTS["analyst"]) == os.path.realpath(os.path.join(MODEL_DIR, ARTIFACTS["analyst"]))
+        registry = ModelRegistry({"m": v1}, mmap=False)
+        for name, path in (("m", v2), ("m", os.path.join("..", "x.pkl")), (None, ARTIFACTS["analyst"])):
+            try: registry.reload(name, path); raise AssertionError(f"reload({name!r}, {path!r}) was accepted")
+            except ValueError: pass
+        print(f"✅ Model loader OK: {a.report()}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
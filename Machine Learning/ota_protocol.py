@@ -0,0 +1,348 @@
+import os
+import mmap
+import time
+import queue
+import struct
+import zlib
+import hashlib
+import threading
+from collections import deque
+
+# --- OTA TRANSFER PROTOCOL ---
+# Host -> device (text lines + binary frames on the same link):
+#   OTA_BEGIN <size> <sha256> <chunk>\n      device erases, then answers OTA_READY <resume offset>
+#   [ "OTAD" | offset u32 | length u16 | crc32 u32 ] + payload
+#   OTA_END <sha256>\n                        device hashes the image, answers OTA_OK / OTA_FAIL <why>
+# Device -> host (lines):
+#   OTA_ACK <next expected offset>            cumulative, after every in-order frame with a good CRC
+#   OTA_NAK <expected offset>                 CRC error or a gap: host goes back to that offset
+#
+# The host keeps up to `window` frames in flight (AIMD: +1 per clean window, /2 on loss)
+# and adapts the chunk size the same way, so throughput follows what the link can carry.
+
+FRAME = struct.Struct(">4sIHI")
+FRAME_MAGIC = b"OTAD"
+
+# --- CONFIGURATION ---
+CHUNK_SIZE = 1024         # Starting chunk size (the old fixed value)
+MIN_CHUNK, MAX_CHUNK = 256, 4096
+WINDOW = 4                # Starting number of unacknowledged frames
+MAX_WINDOW = 32
+READY_TIMEOUT_SEC = 15.0  # Flash erase can take a while; we wait for OTA_READY instead of sleeping
+VERIFY_TIMEOUT_SEC = 15.0
+MIN_RTO_SEC, MAX_RTO_SEC = 0.2, 3.0
+MAX_TIMEOUTS = 8          # Consecutive timeouts before we call it a dropout
+LEGACY_CHUNK = 1024       # Blind stream for firmware without OTA_BEGIN support
+LEGACY_PACE_SEC = 0.05
+
+class OtaError(Exception):
+    """Transfer aborted; calling run() again resumes from the device's last good offset."""
+
+class OtaNotSupported(OtaError):
+    """The device never answered OTA_BEGIN (old firmware without the windowed protocol)."""
+
+def image_sha256(buf):
+    return hashlib.sha256(buf).hexdigest()
+
+def pack_frame(offset, payload):
+    return FRAME.pack(FRAME_MAGIC, offset, len(payload), zlib.crc32(payload)) + payload
+
+class OtaTransfer:
+    """
+    Host side. `write(bytes)` sends on the link; `responses` is a queue of the
+    device's OTA_* lines (the serial reader routes them there).
+    """
+    def __init__(self, write, responses, path, chunk_size=CHUNK_SIZE, window=WINDOW, log=print):
+        self.write = write
+        self.responses = responses
+        self.path = path
+        self.chunk = chunk_size
+        self.window = window
+        self.log = log
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = 1.0
+        self.size = 0
+        self.acked = 0            # Progress: bytes the device has confirmed
+        self.stats = {"frames": 0, "retransmits": 0, "naks": 0, "timeouts": 0, "resumed_from": 0,
+                      "bytes": 0, "seconds": 0.0}
+
+    # --- RESPONSES ---
+    def _expect(self, prefixes, timeout):
+        """Next device line starting with one of `prefixes` -> (keyword, args), or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return None
+            try: line = self.responses.get(timeout=remaining)
+            except queue.Empty: return None
+            parts = line.strip().split()
+            if parts and parts[0] in prefixes: return parts[0], parts[1:]
+
+    def _sample_rtt(self, rtt):
+        # RFC 6298 style smoothing
+        if self.srtt is None: self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO_SEC, max(MIN_RTO_SEC, self.srtt + 4 * self.rttvar))
+
+    def _on_loss(self):
+        self.window = max(1, self.window // 2)
+        self.chunk = max(MIN_CHUNK, self.chunk // 2)
+
+    # --- TRANSFER ---
+    def run(self):
+        t0 = time.perf_counter()
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            size = len(image)
+            digest = image_sha256(image)
+            while not self.responses.empty(): self.responses.get_nowait() # Stale lines from a previous try
+
+            self.write(f"OTA_BEGIN {size} {digest} {self.chunk}\n".encode())
+            ready = self._expect(("OTA_READY",), READY_TIMEOUT_SEC)
+            if ready is None: raise OtaNotSupported("Device did not answer OTA_BEGIN")
+            base = int(ready[1][0]) if ready[1] else 0
+            if base: self.log(f"   ↪️ Resuming at byte {base}/{size}")
+            self.stats["resumed_from"] = self.acked = base
+            self.size = size
+
+            view = memoryview(image)
+            try:
+                self._stream(view, size, base)
+            finally:
+                view.release()
+
+            self.write(f"OTA_END {digest}\n".encode())
+            done = self._expect(("OTA_OK", "OTA_FAIL"), VERIFY_TIMEOUT_SEC)
+            if done is None: raise OtaError("No verification answer from the device")
+            if done[0] == "OTA_FAIL": raise OtaError(f"Device rejected image: {' '.join(done[1])}")
+
+        self.stats["seconds"] = time.perf_counter() - t0
+        self.stats["bytes"] = size - self.stats["resumed_from"]
+        return self.stats
+
+    def _stream(self, view, size, base):
+        inflight = deque()          # (offset, end, sent_at, retransmitted)
+        next_off = base
+        timeouts = 0
+        clean = 0                   # Frames acked since the last loss
+        rewound_to = None           # Ignore repeated NAKs for a gap we've already rewound to
+        sent_before = set()
+
+        while base < size:
+            # Fill the window
+            while len(inflight) < self.window and next_off < size:
+                end = min(size, next_off + self.chunk)
+                self.write(pack_frame(next_off, view[next_off:end]))
+                retx = next_off in sent_before
+                if retx: self.stats["retransmits"] += 1
+                sent_before.add(next_off)
+                inflight.append((next_off, end, time.monotonic(), retx))
+                self.stats["frames"] += 1
+                next_off = end
+
+            wait = max(0.0, inflight[0][2] + self.rto - time.monotonic())
+            resp = self._expect(("OTA_ACK", "OTA_NAK"), wait)
+
+            if resp is None:
+                # Timeout: go back to the oldest unacknowledged byte
+                timeouts += 1
+                self.stats["timeouts"] += 1
+                if timeouts > MAX_TIMEOUTS: raise OtaError(f"Link dropped at byte {base}")
+                self.rto = min(MAX_RTO_SEC, self.rto * 2)
+                self._on_loss(); clean = 0
+                inflight.clear(); next_off = base; rewound_to = base
+                continue
+
+            kind, offset = resp[0], int(resp[1][0])
+            if kind == "OTA_ACK":
+                if offset <= base: continue # Duplicate
+                while inflight and inflight[0][1] <= offset:
+                    start, end, sent_at, retx = inflight.popleft()
+                    if not retx and end == offset: self._sample_rtt(time.monotonic() - sent_at) # Karn's rule
+                base, timeouts = offset, 0
+                self.acked = base
+                if next_off < base: next_off = base
+                clean += 1
+                if clean >= self.window:
+                    clean = 0
+                    self.window = min(MAX_WINDOW, self.window + 1)
+                    self.chunk = min(MAX_CHUNK, self.chunk * 2)
+            else:
+                self.stats["naks"] += 1
+                if offset == rewound_to: continue
+                base = max(base, offset)
+                self.acked = base
+                self._on_loss(); clean = 0
+                inflight.clear(); next_off = offset; rewound_to = offset
+
+def legacy_stream(write, path, chunk_size=LEGACY_CHUNK, pace_sec=LEGACY_PACE_SEC, log=print):
+    """Original blind stream (OTA_START, paced chunks, OTA_END): no ACKs, no resume."""
+    size = os.path.getsize(path)
+    log(f"   ⚠️ Device has no windowed OTA support, falling back to blind streaming ({size} bytes)...")
+    write(f"OTA_START {size}\n".encode())
+    time.sleep(2) # Wait for ESP32 to erase flash memory (takes 1-2s)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+        for off in range(0, size, chunk_size):
+            write(image[off:off + chunk_size])
+            time.sleep(pace_sec) # Bluetooth buffers are small; without ACKs all we can do is pace
+    time.sleep(1) # Ensure buffer is clear
+    write(b"OTA_END\n")
+    return {"bytes": size}
+
+# --- DEVICE SIMULATOR ---
+class OtaDeviceSimulator:
+    """
+    Pretends to be the ESP32 end of the link, for tests without hardware.
+    Talks over a raw file descriptor (e.g. the master side of a pty).
+    `loss` drops/corrupts that fraction of frames; `dropout_at` goes silent once
+    that many bytes are written (the partial image is kept, so a retry resumes).
+    """
+    def __init__(self, fd, erase_sec=0.05, loss=0.0, dropout_at=None, seed=0, telemetry_every=None):
+        import random
+        self.fd = fd
+        self.erase_sec = erase_sec
+        self.loss = loss
+        self.dropout_at = dropout_at
+        self.rng = random.Random(seed)
+        self.telemetry_every = telemetry_every
+        self.image = bytearray()
+        self.expected_size = 0
+        self.digest = None
+        self.partial = {}           # sha256 -> bytes already written (for resume)
+        self.flashed = None         # Final verified image
+        self.silent = False
+        self.frames = 0
+        self.commands = []          # Non-OTA lines received (LOCKDOWN, DEEP_SLEEP, ...)
+        self._buf = bytearray()
+        self._stop = threading.Event()
+        self._nak_for = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ota-device-sim")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def reconnect(self):
+        self.silent = False
+        self.dropout_at = None
+
+    def send_line(self, line):
+        os.write(self.fd, (line + "\n").encode())
+
+    def _run(self):
+        import select
+        while not self._stop.is_set():
+            r, _, _ = select.select([self.fd], [], [], 0.05)
+            if not r: continue
+            try: data = os.read(self.fd, 65536)
+            except OSError: return
+            self._buf += data
+            self._parse()
+
+    def _parse(self):
+        while self._buf:
+            if self._buf.startswith(FRAME_MAGIC):
+                if len(self._buf) < FRAME.size: return
+                _, offset, length, crc = FRAME.unpack_from(self._buf)
+                if len(self._buf) < FRAME.size + length: return
+                payload = bytes(self._buf[FRAME.size:FRAME.size + length])
+                del self._buf[:FRAME.size + length]
+                self._on_frame(offset, payload, crc)
+            else:
+                nl = self._buf.find(b"\n")
+                if nl < 0: return # Partial line (or the first bytes of a frame header)
+                line = self._buf[:nl].decode(errors="replace").strip()
+                del self._buf[:nl + 1]
+                self._on_line(line)
+
+    def _on_line(self, line):
+        parts = line.split()
+        if not parts: return
+        if parts[0] == "OTA_BEGIN":
+            size, digest = int(parts[1]), parts[2]
+            if digest != self.digest:
+                self.image = bytearray(self.partial.get(digest, b""))
+            self.expected_size, self.digest = size, digest
+            self._nak_for = None
+            time.sleep(self.erase_sec) # "Erasing flash"
+            if not self.silent: self.send_line(f"OTA_READY {len(self.image)}")
+        elif parts[0] == "OTA_END":
+            if self.silent: return
+            if len(self.image) == self.expected_size and image_sha256(self.image) == parts[1]:
+                self.flashed = bytes(self.image)
+                self.partial.pop(self.digest, None)
+                self.send_line("OTA_OK")
+            else:
+                self.send_line("OTA_FAIL hash_mismatch")
+        else:
+            self.commands.append(line)
+
+    def _on_frame(self, offset, payload, crc):
+        self.frames += 1
+        if self.silent: return
+        if self.loss and self.rng.random() < self.loss:
+            if self.rng.random() < 0.5: return # Lost on the air
+            crc ^= 1                           # Corrupted on the air
+        expected = len(self.image)
+        if offset < expected:
+            self.send_line(f"OTA_ACK {expected}") # Duplicate of something we already have
+            return
+        if offset > expected or zlib.crc32(payload) != crc:
+            if self._nak_for != expected:
+                self._nak_for = expected
+                self.send_line(f"OTA_NAK {expected}")
+            return
+        self._nak_for = None
+        self.image += payload
+        self.partial[self.digest] = bytes(self.image)
+        if self.dropout_at is not None and len(self.image) >= self.dropout_at:
+            self.silent = True
+            return
+        self.send_line(f"OTA_ACK {len(self.image)}")
+
+# --- SELF-CHECK OVER A PSEUDO-TERMINAL ---
+#   python ota_protocol.py   (POSIX only)
+if __name__ == "__main__":
+    import pty
+    import tty
+    import tempfile
+    import serial
+    from device_gateway import DeviceGateway
+
+    master, slave = pty.openpty()
+    tty.setraw(master); tty.setraw(slave)
+    gw = DeviceGateway(lambda items: None).start()
+    sess = gw.add_link("pty", serial.Serial(os.ttyname(slave), 115200), device_id="ESP32-000")
+    write = lambda data: gw.write(sess, data)
+
+    firmware = os.urandom(300 * 1024)
+    path = os.path.join(tempfile.mkdtemp(), "latest_firmware.bin")
+    with open(path, "wb") as f: f.write(firmware)
+
+    # 1. Lossy link
+    dev = OtaDeviceSimulator(master, loss=0.02).start()
+    stats = OtaTransfer(write, sess.control, path, log=lambda *_: None).run()
+    assert dev.flashed == firmware
+    print(f"✅ Lossy link: {len(firmware) // 1024} KB in {stats['seconds']:.2f} s "
+          f"({len(firmware) / 1024 / stats['seconds']:,.0f} KB/s), {stats['retransmits']} retransmits")
+
+    # 2. Dropout halfway, then resume
+    dev.flashed = None
+    dev.image, dev.digest = bytearray(), None
+    with open(path, "wb") as f: f.write(firmware[::-1])
+    dev.dropout_at = len(firmware) // 2
+    try:
+        OtaTransfer(write, sess.control, path, log=lambda *_: None).run()
+        raise AssertionError("Dropout was not detected")
+    except OtaError:
+        pass
+    dev.reconnect()
+    stats = OtaTransfer(write, sess.control, path, log=lambda *_: None).run()
+    assert dev.flashed == firmware[::-1] and stats["resumed_from"] >= len(firmware) // 2
+    print(f"✅ Dropout + resume: restarted at byte {stats['resumed_from']}, image verified")
+    dev.stop(); gw.stop()
@@ -0,0 +1,187 @@
+import math
+import time
+import uuid
+import threading
+from device_gateway import OTA_DONE, OTA_FAILED
+
+# --- CONFIGURATION ---
+ROLLOUT_WAVES = (0.1, 0.5, 1.0)  # Cumulative share of the fleet flashed by the end of each wave (canary first)
+ROLLOUT_MAX_CONCURRENT = 4       # Devices of one rollout flashing at the same time
+ROLLOUT_MAX_FAILURE_RATE = 0.2   # A wave failing more than this halts the rollout
+ROLLOUT_WAVE_PAUSE_SEC = 0.0     # Soak time between waves
+
+PENDING, RUNNING, DONE, HALTED, CANCELLED = "PENDING", "RUNNING", "DONE", "HALTED", "CANCELLED"
+
+def plan_waves(devices, waves=ROLLOUT_WAVES):
+    """Split `devices` into staged waves from cumulative fractions, e.g. (0.1, 0.5, 1.0)."""
+    out, start = [], 0
+    for frac in list(waves) + [1.0]:
+        end = max(start, min(len(devices), math.ceil(frac * len(devices))))
+        if end > start: out.append(devices[start:end])
+        start = end
+    return out
+
+class Rollout:
+    def __init__(self, image, devices, waves, max_concurrent, max_failure_rate, wave_pause_sec):
+        self.id = uuid.uuid4().hex[:12]
+        self.image = image
+        self.waves = plan_waves(devices, waves)
+        self.max_concurrent = max_concurrent
+        self.max_failure_rate = max_failure_rate
+        self.wave_pause_sec = wave_pause_sec
+        self.state = PENDING
+        self.wave = 0
+        self.jobs = {}           # device -> OtaJob
+        self.skipped = {}        # device -> reason
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    def report(self):
+        states = {}
+        for job in self.jobs.values(): states[job.state] = states.get(job.state, 0) + 1
+        total = sum(len(w) for w in self.waves)
+        return {"id": self.id, "state": self.state, "firmware": self.image.report(),
+                "wave": self.wave, "waves": [len(w) for w in self.waves], "devices": total,
+                "done": states.get(OTA_DONE, 0), "failed": states.get(OTA_FAILED, 0) + len(self.skipped),
+                "in_progress": sum(1 for j in self.jobs.values() if j.active),
+                "device_states": {d: j.report() for d, j in self.jobs.items()}, "skipped": self.skipped,
+                "error": self.error, "created_at": self.created_at, "finished_at": self.finished_at}
+
+class RolloutScheduler:
+    """
+    Pushes one firmware image to many devices: staged waves (canary first), at
+    most `max_concurrent` devices flashing at once, and a halt when a wave's
+    failure rate is too high. The image stays pinned in the store while it runs.
+    """
+    def __init__(self, gateway, store):
+        self.gateway = gateway
+        self.store = store
+        self.rollouts = {}
+
+    def start(self, image, devices, waves=ROLLOUT_WAVES, max_concurrent=ROLLOUT_MAX_CONCURRENT,
+              max_failure_rate=ROLLOUT_MAX_FAILURE_RATE, wave_pause_sec=ROLLOUT_WAVE_PAUSE_SEC):
+        ro = Rollout(image, list(devices), waves, max_concurrent, max_failure_rate, wave_pause_sec)
+        self.rollouts[ro.id] = ro
+        self.store.pin(image.sha256)
+        threading.Thread(target=self._run, args=(ro,), daemon=True, name=f"rollout-{ro.id}").start()
+        return ro
+
+    def get(self, rollout_id):
+        return self.rollouts[rollout_id]
+
+    def cancel(self, rollout_id):
+        """Stops scheduling more devices; transfers already running finish."""
+        ro = self.rollouts[rollout_id]
+        ro._cancel.set()
+        return ro
+
+    def _run(self, ro):
+        ro.state = RUNNING
+        print(f"\n🚀 ROLLOUT {ro.id}: {ro.image.sha256[:12]} to {sum(len(w) for w in ro.waves)} devices in {len(ro.waves)} wave(s)")
+        state = HALTED
+        try:
+            state = self._run_waves(ro)
+        except Exception as e:
+            ro.error = str(e)
+        finally:
+            # Unpin first: whoever sees the terminal state must also see the image released
+            ro.finished_at = time.time()
+            self.store.unpin(ro.image.sha256)
+            ro.state = state
+
+    def _run_waves(self, ro):
+        """-> terminal state (DONE / HALTED / CANCELLED)."""
+        for i, wave in enumerate(ro.waves, 1):
+            ro.wave = i
+            failed = self._run_wave(ro, wave)
+            if ro._cancel.is_set(): return CANCELLED
+            rate = failed / len(wave)
+            print(f"   🌊 Wave {i}/{len(ro.waves)}: {len(wave) - failed}/{len(wave)} flashed")
+            if rate > ro.max_failure_rate:
+                ro.error = f"Wave {i} failure rate {rate:.0%} > {ro.max_failure_rate:.0%}"
+                print(f"   🛑 ROLLOUT {ro.id} HALTED: {ro.error}")
+                return HALTED
+            if i < len(ro.waves) and ro._cancel.wait(ro.wave_pause_sec): return CANCELLED
+        print(f"✅ ROLLOUT {ro.id} COMPLETE")
+        return DONE
+
+    def _run_wave(self, ro, wave):
+        pending, running, failed = list(wave), [], 0
+        while pending or running:
+            while pending and len(running) < ro.max_concurrent and not ro._cancel.is_set():
+                device = pending.pop(0)
+                try:
+                    job = self.gateway.start_ota(device, ro.image.path)
+                except KeyError:
+                    ro.skipped[device] = "unknown device"
+                    failed += 1
+                    continue
+                if job.path != ro.image.path:
+                    ro.skipped[device] = "another OTA is already running"
+                    failed += 1
+                    continue
+                ro.jobs[device] = job
+                running.append(job)
+            if ro._cancel.is_set(): pending.clear()
+            if not running: continue
+            running[0].done.wait(0.2)
+            still = []
+            for job in running:
+                if not job.done.is_set(): still.append(job)
+                elif job.state != OTA_DONE: failed += 1
+            running = still
+        return failed
+
+    def stats(self):
+        return [ro.report() for ro in self.rollouts.values()]
+
+# --- SELF-CHECK OVER PSEUDO-TERMINALS ---
+#   python ota_rollout.py   (POSIX only)
+if __name__ == "__main__":
+    import os
+    import pty
+    import tty
+    import shutil
+    import tempfile
+    from device_gateway import DeviceGateway
+    from firmware_store import FirmwareStore
+    from ota_protocol import OtaDeviceSimulator
+
+    assert [len(w) for w in plan_waves(list(range(20)))] == [2, 8, 10]
+    assert [len(w) for w in plan_waves(list(range(3)), (0.1, 1.0))] == [1, 2]
+
+    directory = tempfile.mkdtemp()
+    gw = DeviceGateway(lambda batch: None).start()
+    store = FirmwareStore(directory, in_use=gw.active_ota_paths)
+    sims, peak = [], {"n": 0}
+    for i in range(10):
+        master, slave = pty.openpty()
+        tty.setraw(master); tty.setraw(slave)
+        gw.open_link(os.ttyname(slave), 115200, device_id=f"ESP32-{i:03d}")
+        sims.append(OtaDeviceSimulator(master, erase_sec=0.05).start())
+
+    image = store.add_bytes(os.urandom(64 * 1024), source="test")
+    scheduler = RolloutScheduler(gw, store)
+    devices = [f"ESP32-{i:03d}" for i in range(10)]
+    ro = scheduler.start(image, devices, max_concurrent=3)
+    while ro.state in (PENDING, RUNNING):
+        peak["n"] = max(peak["n"], sum(1 for j in ro.jobs.values() if j.active))
+        time.sleep(0.005)
+    assert ro.state == DONE and all(s.flashed is not None for s in sims), ro.report()
+    assert peak["n"] <= 3 and store.stats()["pinned"] == []
+    print(f"✅ Rollout OK: {ro.report()['waves']} waves, peak {peak['n']} concurrent, "
+          f"{ro.finished_at - ro.created_at:.2f} s for 10 devices")
+
+    # A canary that fails halts the rollout before the rest of the fleet is touched
+    for s in sims: s.flashed, s.image, s.digest = None, bytearray(), None
+    import ota_protocol
+    ota_protocol.READY_TIMEOUT_SEC, ota_protocol.MAX_TIMEOUTS = 0.5, 2
+    sims[0].dropout_at = 4096 # Canary dies mid-transfer
+    bad = scheduler.start(store.add_bytes(os.urandom(32 * 1024)), devices, waves=(0.1, 1.0))
+    while bad.state in (PENDING, RUNNING): time.sleep(0.05)
+    assert bad.state == HALTED and all(s.flashed is None for s in sims[1:]), bad.report()
+    print(f"✅ Failing canary halted the rollout: {bad.error}")
+    gw.stop()
+    shutil.rmtree(directory, ignore_errors=True)
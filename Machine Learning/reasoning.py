@@ -0,0 +1,172 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# --- CONFIGURATION ---
+CACHE_SIZE = 512          # Distinct (decision, trigger, battery bucket, pattern) explanations kept
+CACHE_TTL_SEC = 600       # Re-ask the LLM after 10 min so wording doesn't go stale
+BATTERY_BUCKET_PCT = 10   # 0-9% -> 0, 10-19% -> 10, ...
+LLM_WORKERS = 2           # Max concurrent Groq calls
+MAX_PENDING = 64          # Misses beyond this are not queued (the fallback text is used)
+
+# --- INSTRUMENTATION ---
+_CACHE = metrics.gauge("cerberus_reasoning_cache", "LLM explanation cache: size, hits, misses, evictions...", ("stat",))
+
+def reasoning_key(decision, trigger, log: dict):
+    bat = log['telemetry']['batteryPercentage']
+    bucket = int(bat // BATTERY_BUCKET_PCT) * BATTERY_BUCKET_PCT
+    return (decision, trigger, bucket, str(log['behaviour']['connectionPattern']).lower())
+
+class ReasoningCache:
+    """Thread-safe LRU + TTL cache with hit/miss/eviction counters."""
+    def __init__(self, max_size=CACHE_SIZE, ttl_sec=CACHE_TTL_SEC, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl_sec
+        self.clock = clock
+        self._data = OrderedDict() # key -> (expires_at, text)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, text)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+class AsyncReasoner:
+    """
+    Keeps the LLM off the hot path.
+    explain() answers from the cache straight away; on a miss it returns the plain
+    logic text and lets a small worker pool ask the LLM, so the NEXT decision with
+    the same key gets the real sentence.
+    """
+    def __init__(self, generate_fn, cache=None, workers=LLM_WORKERS, max_pending=MAX_PENDING):
+        self.generate_fn = generate_fn # (decision, trigger, log) -> str or None (no LLM), may block or raise
+        self.cache = cache if cache is not None else ReasoningCache() # (an empty cache is falsy)
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.failures = 0
+        for stat in self.stats(): _CACHE.set_function((stat,), lambda stat=stat: self.stats()[stat])
+
+    def explain(self, decision, trigger, log: dict):
+        key = reasoning_key(decision, trigger, log)
+        text = self.cache.get(key)
+        if text is not None: return text
+        self._schedule(key, decision, trigger, log)
+        return f"Logic Trigger: {trigger}"
+
+    def _schedule(self, key, decision, trigger, log):
+        with self._lock:
+            if key in self._pending: return # Someone is already asking for this one
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.add(key)
+        ctx = {'telemetry': {'batteryPercentage': log['telemetry']['batteryPercentage']},
+               'behaviour': {'connectionPattern': log['behaviour']['connectionPattern']}}
+        self._pool.submit(self._fill, key, decision, trigger, ctx)
+
+    def _fill(self, key, decision, trigger, ctx):
+        try:
+            text = self.generate_fn(decision, trigger, ctx)
+            if text: self.cache.put(key, text) # Never cache a fallback: the next miss asks again
+        except Exception:
+            self.failures += 1
+        finally:
+            with self._lock: self._pending.discard(key)
+
+    def stats(self):
+        c = self.cache
+        return {"size": len(c), "hits": c.hits, "misses": c.misses, "evictions": c.evictions,
+                "expirations": c.expirations, "pending": len(self._pending),
+                "dropped": self.dropped, "failures": self.failures}
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+# --- OFFLINE STUB ---
+# Same shape as groq.Groq().chat.completions.create(...) so it can be dropped in
+# for tests & demos without network or an API key.
+class _Obj:
+    def __init__(self, **kw): self.__dict__.update(kw)
+
+class StubLLMClient:
+    def __init__(self, latency_sec=0.0):
+        self.latency = latency_sec
+        self.calls = 0
+        self.chat = _Obj(completions=_Obj(create=self._create))
+
+    def _create(self, messages, model=None, max_tokens=None, **kw):
+        self.calls += 1
+        if self.latency: time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        text = "Stub reasoning: " + prompt.split("Explain decision ", 1)[-1].split(" Output:", 1)[0]
+        return _Obj(choices=[_Obj(message=_Obj(content=text))])
+
+# --- SELF-CHECK ---
+#   python reasoning.py
+if __name__ == "__main__":
+    now = [0.0]
+    cache = ReasoningCache(max_size=2, ttl_sec=10, clock=lambda: now[0])
+    cache.put("a", "A"); cache.put("b", "B")
+    assert cache.get("a") == "A"                        # "a" is now the most recent...
+    cache.put("c", "C")                                 # ...so "b" is evicted
+    assert cache.get("b") is None and cache.evictions == 1 and len(cache) == 2
+    now[0] = 10.0
+    assert cache.get("a") is None and cache.expirations == 1 # TTL over: dropped on read
+    assert (cache.hits, cache.misses) == (1, 2)
+    print(f"✅ Cache LRU / TTL OK: hits {cache.hits}, misses {cache.misses}, evictions {cache.evictions}")
+
+    log = {"telemetry": {"batteryPercentage": 47}, "behaviour": {"connectionPattern": "Stable"}}
+    calls, gate = [], threading.Event()
+    def generate(decision, trigger, ctx):
+        calls.append(trigger)
+        gate.wait(5)
+        if trigger == "down": raise RuntimeError("LLM unavailable")
+        return None if trigger == "no llm" else f"{decision} because {trigger}"
+
+    r = AsyncReasoner(generate, cache=ReasoningCache(clock=lambda: now[0]), max_pending=3)
+    assert r.explain("ECO_SAVER", "low", log) == "Logic Trigger: low"
+    assert r.explain("ECO_SAVER", "low", log) == "Logic Trigger: low" # Same key: asked once
+    for trigger in ("down", "no llm", "one too many"): r.explain("BALANCED", trigger, log)
+    gate.set()
+    while r.stats()["pending"]: time.sleep(0.01)
+    assert sorted(calls) == ["down", "low", "no llm"] and r.dropped == 1 and r.failures == 1
+    assert r.explain("ECO_SAVER", "low", {"telemetry": {"batteryPercentage": 41},
+                                          "behaviour": {"connectionPattern": "stable"}}) == "ECO_SAVER because low"
+    assert r.explain("BALANCED", "down", log) == "Logic Trigger: down"     # Failures are not cached...
+    assert r.explain("BALANCED", "no llm", log) == "Logic Trigger: no llm" # ...and neither is "no LLM"
+    while r.stats()["pending"]: time.sleep(0.01)
+    assert calls.count("down") == 2 and calls.count("no llm") == 2
+    now[0] += CACHE_TTL_SEC
+    assert r.explain("ECO_SAVER", "low", log) == "Logic Trigger: low"     # Expired: asked again
+    while r.stats()["pending"]: time.sleep(0.01)
+    assert calls.count("low") == 2 and r.explain("ECO_SAVER", "low", log) == "ECO_SAVER because low"
+    r.shutdown()
+    print(f"✅ AsyncReasoner OK: {r.stats()}")
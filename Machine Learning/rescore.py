@@ -0,0 +1,491 @@
+import os
+import sys
+import json
+import gzip
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from bulk_ingest import LogStreamParser, IngestError, check_log
+from model_loader import ARTIFACTS
+import telemetry_store
+from iot_core import ECO_BATTERY_PCT, HIGH_HOURS, MODERATE_HOURS
+
+# --- OFFLINE RE-SCORING ---
+# Replays recorded logs through the gateway's own vectorized path (device state ->
+# hard rules -> encoders -> models -> governor rule) without the API, and reports
+# what a model version decides on them. Given a candidate model, every chunk is
+# encoded once and scored by both versions, so they are compared row by row.
+#
+#   python rescore.py logs.jsonl                                   # current models
+#   python rescore.py logs.jsonl --candidate-sentinel new.pkl      # current vs candidate
+#   python rescore.py .telemetry --workers 8 --json eval.json      # the gateway's telemetry store
+#
+# Inputs are cut into shards (byte ranges of a JSONL file, segments and compacted
+# chunks of a telemetry store) that worker processes score CHUNK_ROWS at a time,
+# so memory stays flat whatever the input size; only fixed-size histograms come
+# back to the parent. A JSONL shard first replays the WARMUP_BYTES before its
+# range through device state only, so history-based flags (jump / irregular /
+# drain spike) are close to a sequential run; --shard-mb above the file size makes
+# it exact at the cost of parallelism.
+
+# --- CONFIGURATION ---
+CHUNK_ROWS = 4096                  # Logs per prepare/score step in a worker
+SHARD_BYTES = 32 * 1024 * 1024     # JSONL byte range per shard
+WARMUP_BYTES = 4 * 1024 * 1024     # Preceding bytes replayed through device state only
+READ_BLOCK = 1024 * 1024           # .json / .gz inputs can't be split; they are parsed in 1 MB blocks
+SCORE_BINS = np.linspace(-0.5, 0.5, 21)  # Sentinel decision_function; values outside land in the end bins
+ERROR_BINS = np.concatenate([[0.0], np.geomspace(0.01, 1e4, 121), [np.inf]]) # |battery hours error|
+
+# Governor outcomes, as in IoTIntelligenceCore._govern (thresholds are imported; the self-check keeps them in step)
+DECISIONS = ("SECURITY_PRIORITY", "ECO_SAVER", "BALANCED")
+BATTERY_STATUSES = ("High", "Moderate", "Low")
+
+# --- SUMMARIES (mergeable, fixed size) ---
+class ErrorStats:
+    """Signed error between two battery-hours predictions: bias, MAE, RMSE, p50/p95 |error|."""
+    def __init__(self):
+        self.n = 0
+        self.sum = 0.0
+        self.sum_abs = 0.0
+        self.sum_sq = 0.0
+        self.hist = np.zeros(len(ERROR_BINS) - 1, dtype=np.int64)
+
+    def add(self, err):
+        err = err[np.isfinite(err)]
+        if not len(err): return
+        self.n += len(err)
+        self.sum += float(err.sum())
+        self.sum_abs += float(np.abs(err).sum())
+        self.sum_sq += float(np.square(err).sum())
+        self.hist += np.histogram(np.abs(err), ERROR_BINS)[0]
+
+    def merge(self, other):
+        self.n += other.n
+        self.sum += other.sum
+        self.sum_abs += other.sum_abs
+        self.sum_sq += other.sum_sq
+        self.hist += other.hist
+
+    def quantile(self, q):
+        """Upper edge of the bin holding the q-quantile (within one bin, ~12% wide)."""
+        if not self.n: return None
+        i = int(np.searchsorted(np.cumsum(self.hist), q * self.n))
+        return float(ERROR_BINS[min(i + 1, len(ERROR_BINS) - 2)])
+
+    def report(self):
+        if not self.n: return {"n": 0}
+        return {"n": self.n, "bias": self.sum / self.n, "mae": self.sum_abs / self.n,
+                "rmse": (self.sum_sq / self.n) ** 0.5, "p50_abs": self.quantile(0.5), "p95_abs": self.quantile(0.95)}
+
+class VersionStats:
+    """What one model version decided over a set of rows."""
+    def __init__(self, name, models):
+        self.name = name
+        self.models = models
+        self.decisions = np.zeros(len(DECISIONS), dtype=np.int64)
+        self.battery = np.zeros(len(BATTERY_STATUSES), dtype=np.int64)
+        self.rule_anomalies = 0       # Tampering / overheat (no model involved)
+        self.ml_anomalies = 0
+        self.scores = np.zeros(len(SCORE_BINS) - 1, dtype=np.int64)
+        self.score_sum = 0.0
+        self.hours_sum = 0.0
+        self.truth = ErrorStats()     # vs --truth, when the logs carry it
+
+    def merge(self, other):
+        for k in ("decisions", "battery", "scores"): getattr(self, k)[:] += getattr(other, k)
+        self.rule_anomalies += other.rule_anomalies
+        self.ml_anomalies += other.ml_anomalies
+        self.score_sum += other.score_sum
+        self.hours_sum += other.hours_sum
+        self.truth.merge(other.truth)
+
+    def report(self):
+        rows, scored = int(self.decisions.sum()), int(self.scores.sum())
+        return {"name": self.name, "models": self.models,
+                "decisions": dict(zip(DECISIONS, self.decisions.tolist())),
+                "battery_status": dict(zip(BATTERY_STATUSES, self.battery.tolist())),
+                "rule_anomalies": self.rule_anomalies, "ml_anomalies": self.ml_anomalies,
+                "ml_scored": scored, "score_mean": self.score_sum / scored if scored else None,
+                "score_bins": SCORE_BINS.tolist(), "score_hist": self.scores.tolist(),
+                "battery_hours_mean": self.hours_sum / rows if rows else None, "truth_error": self.truth.report()}
+
+class Evaluation:
+    """Everything a shard (or the whole run) produced; versions[0] is the baseline."""
+    def __init__(self, model_sets):
+        names = ["baseline", "candidate"]
+        self.versions = [VersionStats(names[i], m) for i, m in enumerate(model_sets)]
+        self.rows = 0
+        self.bad = 0                  # Lines that weren't JSON / a HardwareLog
+        self.shards = 0
+        self.transitions = np.zeros((len(DECISIONS), len(DECISIONS)), dtype=np.int64) # baseline -> candidate
+        self.hours_diff = ErrorStats()  # candidate - baseline
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.bad += other.bad
+        self.shards += other.shards
+        self.transitions += other.transitions
+        self.hours_diff.merge(other.hours_diff)
+        for mine, theirs in zip(self.versions, other.versions): mine.merge(theirs)
+        return self
+
+    def report(self):
+        out = {"rows": self.rows, "bad": self.bad, "shards": self.shards,
+               "versions": [v.report() for v in self.versions]}
+        if len(self.versions) > 1:
+            changed = int(self.transitions.sum() - np.trace(self.transitions))
+            out["compare"] = {"changed": changed, "changed_share": changed / self.rows if self.rows else 0.0,
+                              "transitions": {a: dict(zip(DECISIONS, row)) for a, row in
+                                              zip(DECISIONS, self.transitions.tolist())},
+                              "battery_hours_diff": self.hours_diff.report()}
+        return out
+
+# --- READING ---
+def plan_shards(paths, shard_bytes=SHARD_BYTES):
+    """Inputs -> independent units of work: ("jsonl", path, start, end), ("stream", path), ("chunk", dir)."""
+    shards = []
+    for path in paths:
+        if os.path.isdir(path): # A telemetry store (compacted chunks + live segments)
+            chunks, segments = telemetry_store.store_files(path)
+            shards += [("chunk", p) for p in chunks]
+            paths_jsonl = segments
+        elif path.endswith((".gz", ".json")):
+            shards.append(("stream", path))
+            continue
+        else: paths_jsonl = [path]
+        for p in paths_jsonl:
+            size = os.path.getsize(p)
+            for start in range(0, max(size, 1), shard_bytes):
+                shards.append(("jsonl", p, start, min(size, start + shard_bytes)))
+    return shards
+
+def _lines(f, start, end):
+    """Lines that *start* inside [start, end); a line cut by `start` belongs to the shard before."""
+    if start:
+        f.seek(start - 1)
+        start += len(f.readline()) - 1
+    else: f.seek(0)
+    pos = start
+    while pos < end:
+        line = f.readline()
+        if not line: break
+        pos += len(line)
+        yield line
+
+def _parse(line):
+    try: return json.loads(line)
+    except ValueError as e: return IngestError(f"Invalid JSON: {e}")
+
+def read_shard(shard, chunk_rows=CHUNK_ROWS, warmup_bytes=WARMUP_BYTES):
+    """-> (warmup, [parsed items]) blocks of at most chunk_rows; warmup blocks only feed device state."""
+    kind = shard[0]
+    if kind == "jsonl":
+        _, path, start, end = shard
+        with open(path, "rb") as f:
+            spans = ([(True, max(0, start - warmup_bytes), start)] if start and warmup_bytes else []) + [(False, start, end)]
+            for warmup, lo, hi in spans:
+                block = []
+                for line in _lines(f, lo, hi):
+                    if not line.strip(): continue
+                    block.append(_parse(line))
+                    if len(block) == chunk_rows:
+                        yield warmup, block
+                        block = []
+                if block: yield warmup, block
+    elif kind == "stream":
+        path = shard[1]
+        parser, block = LogStreamParser(), []
+        with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+            for data in iter(lambda: f.read(READ_BLOCK), b""):
+                block += parser.feed(data)
+                while len(block) >= chunk_rows:
+                    yield False, block[:chunk_rows]
+                    block = block[chunk_rows:]
+            block += parser.close()
+        for i in range(0, len(block), chunk_rows): yield False, block[i:i + chunk_rows]
+    elif kind == "chunk":
+        chunk = telemetry_store.Chunk(shard[1])
+        n = chunk.meta["rows"]
+        for lo in range(0, n, chunk_rows): yield False, list(chunk.records(lo, min(n, lo + chunk_rows)))
+    else: raise ValueError(f"Unknown shard kind '{kind}'")
+
+def _as_log(item):
+    """A raw HardwareLog, or a telemetry store record {"ts", "device", "log", "report"} -> log dict / None."""
+    if isinstance(item, dict) and "log" in item and "digitalTwin" not in item: item = item["log"]
+    return check_log(item)[0]
+
+def _field(obj, path):
+    for key in path:
+        if not isinstance(obj, dict) or key not in obj: return np.nan
+        obj = obj[key]
+    try: return float(obj)
+    except (TypeError, ValueError): return np.nan
+
+# --- SCORING (runs in each worker process) ---
+class Rescorer:
+    """Models + device state of one process; turns blocks of logs into an Evaluation."""
+    def __init__(self, model_sets, truth=None):
+        from iot_core import IoTIntelligenceCore, USE_COMPILED_FOREST
+        from model_loader import ModelRegistry
+        from reasoning import StubLLMClient
+        from scoring_pool import ModelScorer
+        self.model_sets = model_sets
+        self.truth = truth.split(".") if truth else None
+        registries = [ModelRegistry(paths) for paths in model_sets]
+        self.brain = IoTIntelligenceCore(llm_client=StubLLMClient(), models=registries[0])
+        self.brain.memo = None # Every row is scored: an evaluation must not repeat earlier answers
+        self.scorers = [self.brain.scorer] + [ModelScorer(r, compiled=USE_COMPILED_FOREST) for r in registries[1:]]
+
+    def reset(self):
+        """Fresh per-device history (every shard starts from nothing, then its warmup)."""
+        if self.brain.device_states is not None: self.brain.device_states = type(self.brain.device_states)()
+
+    def warm(self, logs):
+        if self.brain.device_states is None: return
+        for log in logs: self.brain.device_states.update(log)
+
+    def score(self, logs, ev):
+        brain = self.brain
+        batch = brain.prepare_batch(logs)
+        n = len(logs)
+        hard = np.fromiter((r["is_anomaly"] for r in batch.sentinel_results), dtype=bool, count=n)
+        pct = np.fromiter((log["telemetry"]["batteryPercentage"] for log in logs), dtype=np.float64, count=n)
+        ml_idx = np.asarray(batch.ml_idx, dtype=np.intp)
+        truth = np.array([_field(log, self.truth) for log in logs]) if self.truth else None
+        fallback, decided, hours_by_version, cache = None, [], [], {}
+        for paths, scorer, stats in zip(self.model_sets, self.scorers, ev.versions):
+            # Same model file as the baseline -> same output, don't score it twice
+            key = ("sentinel", paths.get("sentinel"))
+            if batch.sentinel_X is not None and scorer.models.get("sentinel") is not None:
+                scores = cache[key] if key in cache else scorer.sentinel_scores(batch.sentinel_X)
+                cache[key] = scores
+            else: scores = None
+            key = ("analyst", paths.get("analyst"))
+            if batch.analyst_X is not None and scorer.models.get("analyst") is not None:
+                hours = cache[key] if key in cache else np.asarray(scorer.battery_hours(batch.analyst_X), dtype=np.float64)
+                cache[key] = hours
+            else:
+                if fallback is None: fallback = np.array([brain._fallback_hours(log) for log in logs])
+                hours = fallback
+
+            anomaly = hard.copy()
+            if scores is not None and len(ml_idx):
+                anomaly[ml_idx] |= scores < 0.0
+                stats.scores += np.histogram(np.clip(scores, SCORE_BINS[0], SCORE_BINS[-1]), SCORE_BINS)[0]
+                stats.score_sum += float(np.sum(scores))
+                stats.ml_anomalies += int(np.count_nonzero(scores < 0.0))
+            stats.rule_anomalies += int(hard.sum())
+            decision = np.where(anomaly, 0, np.where(pct < ECO_BATTERY_PCT, 1, 2))
+            stats.decisions += np.bincount(decision, minlength=len(DECISIONS))
+            stats.battery += np.bincount(np.where(hours > HIGH_HOURS, 0, np.where(hours > MODERATE_HOURS, 1, 2)),
+                                         minlength=len(BATTERY_STATUSES))
+            stats.hours_sum += float(hours.sum())
+            if truth is not None: stats.truth.add(hours - truth)
+            decided.append(decision)
+            hours_by_version.append(hours)
+        if len(decided) > 1:
+            np.add.at(ev.transitions, (decided[0], decided[1]), 1)
+            ev.hours_diff.add(hours_by_version[1] - hours_by_version[0])
+        ev.rows += n
+        return decided, hours_by_version
+
+    def run(self, shard, chunk_rows=CHUNK_ROWS, warmup_bytes=WARMUP_BYTES):
+        ev = Evaluation(self.model_sets)
+        ev.shards = 1
+        self.reset()
+        for warmup, items in read_shard(shard, chunk_rows, warmup_bytes):
+            logs = [log for log in map(_as_log, items) if log is not None]
+            if warmup:
+                self.warm(logs)
+                continue
+            ev.bad += len(items) - len(logs)
+            if logs: self.score(logs, ev)
+        return ev
+
+_rescorer = None
+
+def _init_worker(model_sets, truth):
+    global _rescorer
+    _rescorer = Rescorer(model_sets, truth)
+
+def _run_shard(shard, chunk_rows, warmup_bytes):
+    return _rescorer.run(shard, chunk_rows, warmup_bytes)
+
+def evaluate(paths, model_sets, workers=None, chunk_rows=CHUNK_ROWS, shard_bytes=SHARD_BYTES,
+             warmup_bytes=WARMUP_BYTES, truth=None, progress=True):
+    """Score every log in `paths` with each model set -> merged Evaluation."""
+    shards = plan_shards(paths, shard_bytes)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(shards) or 1))
+    total, done = Evaluation(model_sets), 0
+    def tick(ev):
+        nonlocal done
+        total.merge(ev)
+        done += 1
+        if progress: print(f"   ⏳ {done}/{len(shards)} shards, {total.rows:,} logs", end="\r", flush=True)
+    if workers == 1:
+        rescorer = Rescorer(model_sets, truth)
+        for shard in shards: tick(rescorer.run(shard, chunk_rows, warmup_bytes))
+    else:
+        # spawn: workers import only this module's dependencies, never the caller's app
+        with ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=_init_worker,
+                                 initargs=(model_sets, truth)) as pool:
+            for f in as_completed([pool.submit(_run_shard, s, chunk_rows, warmup_bytes) for s in shards]):
+                tick(f.result())
+    if progress: print()
+    return total, workers
+
+# --- OUTPUT ---
+def _bar(share, width=20):
+    return "█" * int(round(share * width))
+
+def print_report(report, elapsed, workers):
+    rows, versions = report["rows"], report["versions"]
+    rate = rows / elapsed if elapsed else 0.0
+    print(f"\n📊 {rows:,} logs ({report['bad']:,} unreadable) from {report['shards']} shard(s) in {elapsed:.1f} s "
+          f"-> {rate * 60:,.0f} logs/min on {workers} worker(s)")
+    for v in versions: print(f"   {v['name']:<10} {v['models']}")
+    if not rows: return
+    head = "".join(f"{v['name']:>22}" for v in versions)
+    print(f"\n   {'':<20}{head}")
+    def line(label, values):
+        print(f"   {label:<20}" + "".join(f"{n:>12,} {n / rows:>8.2%}" for n in values))
+    for d in DECISIONS: line(d, [v["decisions"][d] for v in versions])
+    for s in BATTERY_STATUSES: line(f"battery {s}", [v["battery_status"][s] for v in versions])
+    line("rule anomalies", [v["rule_anomalies"] for v in versions])
+    line("ML anomalies", [v["ml_anomalies"] for v in versions])
+    print(f"   {'mean score':<20}" + "".join(f"{v['score_mean'] if v['score_mean'] is not None else float('nan'):>22.4f}"
+                                          for v in versions))
+    print(f"   {'mean battery h':<20}" + "".join(f"{v['battery_hours_mean']:>22.1f}" for v in versions))
+
+    print(f"\n   anomaly score (ML-scored rows; < 0 = anomaly)")
+    edges = versions[0]["score_bins"]
+    for i in range(len(edges) - 1):
+        cells = []
+        for v in versions:
+            scored = v["ml_scored"] or 1
+            share = v["score_hist"][i] / scored
+            cells.append(f"{_bar(share):<20} {share:>6.1%}")
+        print(f"   [{edges[i]:+.2f}, {edges[i + 1]:+.2f})  " + "   ".join(cells))
+
+    if any(v["truth_error"]["n"] for v in versions): print()
+    for v in versions:
+        t = v["truth_error"]
+        if t["n"]:
+            print(f"   battery hours vs truth ({v['name']}): n={t['n']:,} bias {t['bias']:+.2f} MAE {t['mae']:.2f} "
+                  f"RMSE {t['rmse']:.2f} p50 |err| {t['p50_abs']:.2f} p95 |err| {t['p95_abs']:.2f}")
+    cmp = report.get("compare")
+    if cmp:
+        print(f"\n   decision changed on {cmp['changed']:,} logs ({cmp['changed_share']:.2%})")
+        for a, row in cmp["transitions"].items():
+            for b, n in row.items():
+                if a != b and n: print(f"      {a:>17} -> {b:<17} {n:>10,}")
+        d = cmp["battery_hours_diff"]
+        if d["n"]:
+            print(f"   battery hours candidate - baseline: bias {d['bias']:+.2f} MAE {d['mae']:.2f} RMSE {d['rmse']:.2f} "
+                  f"p50 |diff| {d['p50_abs']:.2f} p95 |diff| {d['p95_abs']:.2f}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Re-score recorded logs offline and compare model versions")
+    ap.add_argument("inputs", nargs="+", help="JSONL / JSON / .gz log files, or a telemetry store directory")
+    ap.add_argument("--sentinel", default=ARTIFACTS["sentinel"], help="baseline Sentinel .pkl")
+    ap.add_argument("--analyst", default=ARTIFACTS["analyst"], help="baseline Analyst .pkl")
+    ap.add_argument("--candidate-sentinel", metavar="PKL", help="Sentinel to compare against the baseline")
+    ap.add_argument("--candidate-analyst", metavar="PKL", help="Analyst to compare against the baseline")
+    ap.add_argument("--workers", type=int, default=0, help="processes (0 = one per core)")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    ap.add_argument("--shard-mb", type=float, default=SHARD_BYTES / 2**20)
+    ap.add_argument("--warmup-mb", type=float, default=WARMUP_BYTES / 2**20, help="device history replayed per shard")
+    ap.add_argument("--truth", metavar="FIELD", help="dotted log field with the observed battery hours, "
+                                                     "e.g. battery.hoursRemaining")
+    ap.add_argument("--json", metavar="PATH", help="write the full report (histograms included) here")
+    args = ap.parse_args(argv)
+
+    missing = [p for p in args.inputs if not os.path.exists(p)]
+    if missing: ap.error(f"not found: {', '.join(missing)}")
+    baseline = {"sentinel": args.sentinel, "analyst": args.analyst}
+    model_sets = [baseline]
+    if args.candidate_sentinel or args.candidate_analyst:
+        model_sets.append({"sentinel": args.candidate_sentinel or args.sentinel,
+                           "analyst": args.candidate_analyst or args.analyst})
+
+    t0 = time.perf_counter()
+    ev, workers = evaluate(args.inputs, model_sets, args.workers, args.chunk_rows, int(args.shard_mb * 2**20),
+                           int(args.warmup_mb * 2**20), args.truth)
+    elapsed = time.perf_counter() - t0
+    report = ev.report()
+    print_report(report, elapsed, workers)
+    if args.json:
+        report.update(seconds=elapsed, workers=workers, inputs=args.inputs)
+        with open(args.json, "w") as f: json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+    return 0
+
+# --- SELF-CHECK ---
+#   python rescore.py --self-check
+if __name__ == "__main__" and sys.argv[1:2] == ["--self-check"]:
+    import shutil
+    import tempfile
+    from fleet_sim import FleetGenerator
+    from iot_core import IoTIntelligenceCore
+    from reasoning import StubLLMClient
+
+    directory = tempfile.mkdtemp()
+    logs = FleetGenerator(300, "mixed", seed=7).take(30_000)
+    path = os.path.join(directory, "logs.jsonl")
+    with open(path, "w") as f:
+        for i, log in enumerate(logs):
+            f.write(json.dumps(log) + "\n")
+            if i == 100: f.write("not json\n")
+            if i == 200: f.write(json.dumps(dict(log, anomaly={"sensorJump": False})) + "\n") # Valid JSON, not a full log
+
+    # 1. Same decisions / battery hours as the live analyze_batch, row by row
+    ref = IoTIntelligenceCore(llm_client=StubLLMClient())
+    ref.memo = None
+    expected = [r for i in range(0, len(logs), 1000) for r in ref.analyze_batch(logs[i:i + 1000])]
+    baseline = dict(ARTIFACTS)
+    rescorer, ev = Rescorer([baseline]), Evaluation([baseline])
+    got_d, got_h = [], []
+    for i in range(0, len(logs), 1000):
+        d, h = rescorer.score(logs[i:i + 1000], ev)
+        got_d += [DECISIONS[k] for k in d[0]]
+        got_h += list(h[0])
+    assert got_d == [r["status"] for r in expected], "decision mismatch vs analyze_batch"
+    assert all(round(float(h), 1) == r["metrics"]["battery_prediction_hours"] for h, r in zip(got_h, expected))
+    print(f"✅ Parity with analyze_batch on {len(logs):,} logs: {ev.report()['versions'][0]['decisions']}")
+
+    # 2. Sharding: a full warmup reproduces one sequential pass exactly, a bounded one closely
+    one, _ = evaluate([path], [baseline], workers=1, shard_bytes=1 << 40, progress=False)
+    full, _ = evaluate([path], [baseline], workers=1, shard_bytes=512 * 1024, warmup_bytes=1 << 40, progress=False)
+    assert full.shards > 5 and one.rows == full.rows == len(logs) and one.bad == full.bad == 2
+    a, b = one.versions[0], full.versions[0]
+    assert all((getattr(a, k) == getattr(b, k)).all() for k in ("decisions", "battery", "scores")), \
+        "sharded run differs from the sequential one"
+    assert np.isclose(a.hours_sum, b.hours_sum) and np.isclose(a.score_sum, b.score_sum) # Summation order only
+    part, _ = evaluate([path], [baseline], workers=1, shard_bytes=512 * 1024, warmup_bytes=1 << 20, progress=False)
+    drift = np.abs(part.versions[0].decisions - one.versions[0].decisions).sum() / one.rows
+    assert drift < 0.005, f"{drift:.2%} of decisions moved with a 1 MB warmup"
+    print(f"✅ {full.shards} shards: full warmup == one sequential pass, 1 MB warmup moves {drift:.3%} of decisions")
+
+    # 3. Candidate == baseline -> no changes; telemetry store input reads the same rows
+    store = telemetry_store.TelemetryStore(os.path.join(directory, "store"), segment_bytes=256 * 1024,
+                                           compact_after=10**9)
+    for log in logs[:6000]: store.append(log)
+    store.flush()
+    store.compact() # Sealed segments -> one chunk, the active one stays NDJSON
+    ev, _ = evaluate([store.directory], [baseline, dict(baseline)], workers=1, progress=False)
+    store.stop()
+    rep = ev.report()
+    assert ev.rows == 6000 and rep["compare"]["changed"] == 0 and rep["compare"]["battery_hours_diff"]["mae"] == 0
+    print(f"✅ Telemetry store input ({ev.shards} shards) and candidate == baseline: 0 changed decisions")
+
+    # 4. Throughput, multi-process
+    for workers in sorted({1, os.cpu_count() or 1}):
+        t0 = time.perf_counter()
+        ev, used = evaluate([path], [baseline, dict(baseline)], workers=workers, shard_bytes=2 << 20, progress=False)
+        dt = time.perf_counter() - t0
+        print(f"   {used} worker(s): {ev.rows / dt * 60:>12,.0f} logs/min (baseline + candidate, incl. process start)")
+    shutil.rmtree(directory, ignore_errors=True)
+elif __name__ == "__main__":
+    sys.exit(main())
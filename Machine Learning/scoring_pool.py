@@ -0,0 +1,522 @@
+import os
+import sys
+import math
+import time
+import queue
+import secrets
+import threading
+import subprocess
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from multiprocessing.connection import Listener, Client
+from model_loader import ModelRegistry
+from forest_compiler import load_or_compile
+import metrics
+from metrics import lap
+
+# --- SCORING POOL ---
+# Model inference in worker processes, so one gateway uses every core.
+#
+#   parent: device state -> rules -> encode --\                      /-- governor -> reply
+#                                             shared memory slot (float32 in, float64 out)
+#   worker 1..N:                  Sentinel + Analyst on mmapped models
+#
+# Each worker owns one shared-memory slot. The parent copies the encoded blocks
+# into it and sends a tiny ("score", rows...) message over a pipe; no log dict is
+# ever pickled. Workers load the models through model_loader / forest_compiler,
+# whose caches are mmapped files, so N workers share one copy of the trees.
+# Workers are plain `python scoring_pool.py --worker ...` processes (not
+# multiprocessing children), so they never re-import main.py / data.py.
+
+# --- CONFIGURATION ---
+SLOT_ROWS = 1024            # Rows per worker slot; bigger jobs are split / done in rounds
+SPLIT_MIN_ROWS = 256        # Only jobs at least this big are spread over several idle workers
+START_TIMEOUT_SEC = 30.0    # Worker must connect back within this (imports + first model map)
+AUTOTUNE_SECONDS = 0.5      # Per worker count tried
+AUTOTUNE_TOLERANCE = 0.05   # Smallest worker count within 5% of the best throughput wins
+WORKER_ENV = {"OMP_NUM_THREADS": "1", "OPENBLAS_NUM_THREADS": "1", "MKL_NUM_THREADS": "1"} # 1 core each
+
+_JOB = metrics.histogram("cerberus_pool_job_seconds", "Round trip of one scoring job to the worker pool.").labels()
+_IDLE = metrics.gauge("cerberus_pool_idle_workers", "Scoring workers waiting for work.")
+
+class ScoringError(RuntimeError):
+    pass
+
+def default_workers():
+    """One worker per core, minus one for the event loop / encoding / governor."""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+class ModelScorer:
+    """Sentinel scores and Analyst battery hours for encoded float32 blocks (in-process or in a worker)."""
+    def __init__(self, models, compiled=True):
+        self.models = models
+        self.compiled = compiled
+        self._compiled = (None, None) # (sklearn model it was built from, CompiledForest)
+
+    def sentinel_scores(self, X):
+        model = self.models.get("sentinel")
+        if self.compiled:
+            source, compiled = self._compiled
+            if source is not model: # First call, or the model was hot-reloaded
+                art = self.models.artifacts["sentinel"]
+                cache = os.path.join(art.cache_dir, f"sentinel-{art.version}.forest") if art.mmap and art.version else None
+                try: compiled = load_or_compile(model, cache)
+                except Exception as e:
+                    print(f"⚠️ Sentinel compile failed, using sklearn: {e}")
+                    compiled = None
+                self._compiled = (model, compiled)
+            if compiled is not None: return compiled.decision_function(X)
+        return model.decision_function(X)
+
+    def battery_hours(self, X):
+        return self.models.get("analyst").predict(X)
+
+    def sync(self, versions):
+        """Follow the parent's hot reloads: versions = ((name, path, version), ...)."""
+        for name, path, version in versions:
+            art = self.models.artifacts[name]
+            if not art._loaded: art.path = path
+            if art.model is None or art.version != version: art.reload(path)
+
+def model_versions(models):
+    return tuple((n, a.path, a.version) for n, a in models.artifacts.items() if a._loaded)
+
+# --- SHARED-MEMORY SLOT ---
+def _slot_layout(rows, n_sentinel, n_analyst):
+    """-> (total bytes, [(offset, shape, dtype), ...]) for sentinel_X, analyst_X, scores, hours."""
+    parts, off = [], 0
+    for shape, dtype in (((rows, n_sentinel), np.float32), ((rows, n_analyst), np.float32),
+                         ((rows,), np.float64), ((rows,), np.float64)):
+        parts.append((off, shape, dtype))
+        off += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 64) * 64 # Cache-line aligned
+    return off, parts
+
+def _slot_views(buf, rows, n_sentinel, n_analyst):
+    _, parts = _slot_layout(rows, n_sentinel, n_analyst)
+    return [np.ndarray(shape, dtype=dtype, buffer=buf, offset=off) for off, shape, dtype in parts]
+
+def _attach(name):
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name != "nt":
+        # Only the parent owns (and unlinks) the segment; stop this process's tracker from "cleaning it up"
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+# --- WORKER PROCESS ---
+def _worker_main(address, authkey, shm_name, rows, n_sentinel, n_analyst, compiled):
+    conn = Client(address, authkey=authkey)
+    shm = _attach(shm_name)
+    sentinel_X, analyst_X, scores, hours = _slot_views(shm.buf, rows, n_sentinel, n_analyst)
+    scorer = ModelScorer(ModelRegistry(), compiled)
+    conn.send(("ready", os.getpid(), shm_name)) # The slot name says which _Worker this is
+    try:
+        while True:
+            try: msg = conn.recv()
+            except (EOFError, OSError): break # Parent went away
+            if msg[0] == "stop": break
+            _, ns, na, versions = msg
+            try:
+                scorer.sync(versions)
+                if ns: scores[:ns] = scorer.sentinel_scores(sentinel_X[:ns])
+                if na: hours[:na] = scorer.battery_hours(analyst_X[:na])
+                conn.send(("ok",))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        del sentinel_X, analyst_X, scores, hours
+        shm.close()
+
+class _Worker:
+    __slots__ = ("index", "proc", "conn", "shm", "sentinel_X", "analyst_X", "scores", "hours", "pid", "jobs")
+
+    def close(self):
+        self.sentinel_X = self.analyst_X = self.scores = self.hours = None
+        try: self.conn.close()
+        except Exception: pass
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except Exception: pass
+
+class ScoringPool:
+    """
+    `pool = ScoringPool(29, 10, workers=4).start()`
+    `scores, hours = pool.score(sentinel_X, analyst_X)` blocks until a worker is
+    free and done; safe to call from many threads at once (one job per worker).
+    A worker that dies is replaced in the background and the job raises ScoringError.
+    """
+    def __init__(self, n_sentinel, n_analyst, workers=None, slot_rows=SLOT_ROWS, compiled=True, models=None):
+        self.n_sentinel = n_sentinel
+        self.n_analyst = n_analyst
+        self.size = workers or default_workers()
+        self.slot_rows = slot_rows
+        self.compiled = compiled
+        self.models = models     # Parent's ModelRegistry: workers follow its versions (hot reload)
+        self._idle = queue.Queue()
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._hellos = {}        # shm name -> (conn, pid): workers that connected back, not yet claimed
+        self._hello_cv = threading.Condition()
+        self._stopped = False
+        self.jobs = 0
+        self.rows = 0
+        self.errors = 0
+        self.respawns = 0
+        _IDLE.set_function((), self._idle.qsize)
+
+    # --- LIFECYCLE ---
+    def start(self):
+        self._authkey = secrets.token_bytes(16)
+        self._listener = Listener(authkey=self._authkey)
+        t0 = time.perf_counter()
+        procs = [self._spawn(i) for i in range(self.size)]
+        for w in self._accept(procs): self._idle.put(w)
+        print(f"🧮 Scoring pool: {self.size} worker(s) up in {time.perf_counter() - t0:.1f} s")
+        return self
+
+    def _spawn(self, index):
+        nbytes, _ = _slot_layout(self.slot_rows, self.n_sentinel, self.n_analyst)
+        w = _Worker()
+        w.index, w.jobs = index, 0
+        w.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        w.sentinel_X, w.analyst_X, w.scores, w.hours = _slot_views(w.shm.buf, self.slot_rows, self.n_sentinel, self.n_analyst)
+        args = [sys.executable, os.path.abspath(__file__), "--worker", repr(self._listener.address), self._authkey.hex(),
+                w.shm.name, str(self.slot_rows), str(self.n_sentinel), str(self.n_analyst), str(int(self.compiled))]
+        w.proc = subprocess.Popen(args, env=dict(os.environ, **WORKER_ENV), cwd=os.path.dirname(os.path.abspath(__file__)))
+        return w
+
+    def _accept(self, pending):
+        """
+        Wait for every spawned worker to connect back and say hello (or fail loudly).
+        Respawns can run at the same time on the one listener, so a connection may be
+        picked up by another call's thread: hellos are matched on the slot name only.
+        """
+        def accept():
+            for _ in pending:
+                try: conn = self._listener.accept()
+                except OSError: return # Listener closed
+                try: _, pid, name = conn.recv()
+                except (EOFError, OSError, ValueError):
+                    conn.close() # Died before its hello: the wait below sees the exit
+                    continue
+                with self._hello_cv:
+                    self._hellos[name] = (conn, pid)
+                    self._hello_cv.notify_all()
+        threading.Thread(target=accept, daemon=True, name="pool-accept").start()
+        by_name, deadline = {w.shm.name: w for w in pending}, time.monotonic() + START_TIMEOUT_SEC
+        ready = []
+        with self._hello_cv:
+            while by_name:
+                for name in [n for n in by_name if n in self._hellos]:
+                    w = by_name.pop(name)
+                    w.conn, w.pid = self._hellos.pop(name)
+                    with self._lock: self._workers[w.index] = w
+                    ready.append(w)
+                if not by_name: break
+                dead = [w for w in pending if w.proc.poll() is not None]
+                if dead or time.monotonic() > deadline:
+                    for w in pending:
+                        w.proc.kill()
+                        w.close()
+                        self._hellos.pop(w.shm.name, None)
+                    why = f"exited with {dead[0].proc.returncode}" if dead else "timed out"
+                    raise ScoringError(f"Scoring worker failed to start ({why})")
+                self._hello_cv.wait(0.1)
+        return ready
+
+    def _respawn(self, dead):
+        with self._lock: self._workers.pop(dead.index, None)
+        try: dead.proc.kill()
+        except Exception: pass
+        dead.close()
+        if self._stopped: return
+        def run():
+            try:
+                ready = self._accept([self._spawn(dead.index)])
+                self.respawns += 1
+                for w in ready: self._idle.put(w)
+            except ScoringError as e:
+                print(f"❌ {e}")
+        threading.Thread(target=run, daemon=True, name="pool-respawn").start()
+
+    def resize(self, workers):
+        """Shrink to `workers` (used by autotune); idle workers are stopped first."""
+        while len(self._workers) > max(1, workers):
+            w = self._idle.get()
+            with self._lock: self._workers.pop(w.index, None)
+            self._stop_worker(w)
+        self.size = len(self._workers)
+
+    def _stop_worker(self, w):
+        try: w.conn.send(("stop",))
+        except Exception: pass
+        try: w.proc.wait(2.0)
+        except subprocess.TimeoutExpired: w.proc.kill()
+        w.close()
+
+    def stop(self):
+        self._stopped = True
+        for w in list(self._workers.values()): self._stop_worker(w)
+        self._workers.clear()
+        if self._listener is not None: self._listener.close()
+
+    # --- SCORING ---
+    def _take(self, block=True):
+        while True:
+            w = self._idle.get(block)
+            if w.proc.poll() is None: return w
+            self._respawn(w) # Died while idle: replace it, don't send it work
+    def score(self, sentinel_X, analyst_X):
+        """-> (sentinel scores, battery hours) as float64 arrays; a None input gives a None output."""
+        ns = 0 if sentinel_X is None else len(sentinel_X)
+        na = 0 if analyst_X is None else len(analyst_X)
+        scores = np.empty(ns) if ns else None
+        hours = np.empty(na) if na else None
+        rows = max(ns, na)
+        if not rows: return scores, hours
+        t = time.perf_counter()
+        versions = model_versions(self.models) if self.models is not None else ()
+
+        # Grab one worker (blocking), plus idle ones if the job is big enough to split
+        workers = [self._take()]
+        want = min(self.size, rows // SPLIT_MIN_ROWS)
+        while len(workers) < want:
+            try: workers.append(self._take(block=False))
+            except queue.Empty: break
+        parts = max(len(workers), math.ceil(rows / self.slot_rows))
+        s_cuts = np.linspace(0, ns, parts + 1).astype(int)
+        a_cuts = np.linspace(0, na, parts + 1).astype(int)
+
+        dead, error = [], None
+        try:
+            for first in range(0, parts, len(workers)):
+                batch = list(zip(workers, range(first, min(parts, first + len(workers)))))
+                for w, p in batch:
+                    s0, s1, a0, a1 = s_cuts[p], s_cuts[p + 1], a_cuts[p], a_cuts[p + 1]
+                    if s1 > s0: w.sentinel_X[:s1 - s0] = sentinel_X[s0:s1]
+                    if a1 > a0: w.analyst_X[:a1 - a0] = analyst_X[a0:a1]
+                    w.conn.send(("score", s1 - s0, a1 - a0, versions))
+                for w, p in batch:
+                    try: reply = w.conn.recv()
+                    except (EOFError, OSError):
+                        dead.append(w)
+                        error = error or f"Scoring worker {w.pid} died"
+                        continue
+                    if reply[0] != "ok":
+                        error = error or reply[1]
+                        continue
+                    w.jobs += 1
+                    s0, s1, a0, a1 = s_cuts[p], s_cuts[p + 1], a_cuts[p], a_cuts[p + 1]
+                    if s1 > s0: scores[s0:s1] = w.scores[:s1 - s0]
+                    if a1 > a0: hours[a0:a1] = w.hours[:a1 - a0]
+                if dead: break
+        finally:
+            for w in workers:
+                if w in dead: self._respawn(w)
+                else: self._idle.put(w)
+        if error:
+            self.errors += 1
+            raise ScoringError(error)
+        self.jobs += 1
+        self.rows += rows
+        lap(_JOB, t)
+        return scores, hours
+
+    def stats(self):
+        return {"workers": self.size, "idle": self._idle.qsize(), "jobs": self.jobs, "rows": self.rows,
+                "errors": self.errors, "respawns": self.respawns,
+                "per_worker": {w.pid: w.jobs for w in list(self._workers.values())}}
+
+    # --- AUTOTUNING ---
+    def autotune(self, batch_rows=64, seconds=AUTOTUNE_SECONDS, tolerance=AUTOTUNE_TOLERANCE):
+        """
+        Measure scoring throughput with 1..size callers in parallel, keep the smallest
+        worker count within `tolerance` of the best and stop the rest.
+        -> (chosen count, {count: rows/s}).
+        """
+        rng = np.random.default_rng(0)
+        S = rng.integers(0, 2, (batch_rows, self.n_sentinel)).astype(np.float32)
+        A = rng.uniform(0, 1000, (batch_rows, self.n_analyst)).astype(np.float32)
+        self.score(S, A) # Every model mapped / compiled before timing
+        table = {}
+        for n in range(1, self.size + 1):
+            done, stop_at = [0] * n, time.perf_counter() + seconds
+            def caller(k):
+                while time.perf_counter() < stop_at:
+                    self.score(S, A)
+                    done[k] += batch_rows
+            threads = [threading.Thread(target=caller, args=(k,)) for k in range(n)]
+            t0 = time.perf_counter()
+            for th in threads: th.start()
+            for th in threads: th.join()
+            table[n] = sum(done) / (time.perf_counter() - t0)
+        best = max(table.values())
+        chosen = min(n for n, rate in table.items() if rate >= best * (1 - tolerance))
+        self.resize(chosen)
+        return chosen, table
+
+class OrderedPipeline:
+    """
+    IoTIntelligenceCore.analyze_batch spread over threads and the pool, without
+    reordering anything: prepare_batch (device state, rules, encoding) runs on one
+    thread in submit order, scoring runs on any free worker, finish_batch
+    (governor) runs on another thread in submit order. Two batches holding the
+    same device are therefore applied and answered in arrival order, however the
+    workers finish. If the pool fails a job it is scored in-process instead.
+    """
+    def __init__(self, brain, pool):
+        self.brain = brain
+        self.pool = pool
+        self.fallbacks = 0
+        self._prepare_q = queue.Queue()
+        self._finish_q = queue.Queue()
+        self._scorers = ThreadPoolExecutor(pool.size, thread_name_prefix="pool-score")
+        threading.Thread(target=self._prepare_loop, daemon=True, name="pool-prepare").start()
+        threading.Thread(target=self._finish_loop, daemon=True, name="pool-finish").start()
+
+    def submit(self, logs):
+        """-> concurrent.futures.Future of the reports. Call order = processing order."""
+        fut = Future()
+        self._prepare_q.put((logs, fut))
+        return fut
+
+    def analyze_batch(self, logs):
+        if not logs: return []
+        return self.submit(logs).result()
+
+    def _prepare_loop(self):
+        while True:
+            logs, fut = self._prepare_q.get()
+            try:
+                batch = self.brain.prepare_batch(logs)
+                scored = self._scorers.submit(self.pool.score, batch.sentinel_X, batch.analyst_X)
+            except Exception as e:
+                fut.set_exception(e)
+                continue
+            self._finish_q.put((batch, scored, fut))
+
+    def _finish_loop(self):
+        while True:
+            batch, scored, fut = self._finish_q.get()
+            try:
+                try: batch.scores, batch.hours = scored.result()
+                except ScoringError as e:
+                    self.fallbacks += 1
+                    print(f"⚠️ Scoring pool failed ({e}), scoring in-process")
+                    self.brain.score_batch(batch)
+                fut.set_result(self.brain.finish_batch(batch))
+            except Exception as e:
+                fut.set_exception(e)
+
+    def stats(self):
+        return dict(self.pool.stats(), fallbacks=self.fallbacks, queued=self._prepare_q.qsize())
+
+def start_pool(brain, workers="auto"):
+    """Pool + pipeline for `brain`. workers: N processes, or "auto" to autotune up to default_workers()."""
+    brain.models.warm() # Parent maps the models first, so the workers find the caches ready
+    pool = ScoringPool(brain.sentinel_encoder.n_features, brain.analyst_encoder.n_features,
+                       workers=default_workers() if workers == "auto" else int(workers),
+                       compiled=brain.scorer.compiled, models=brain.models).start()
+    if workers == "auto":
+        chosen, table = pool.autotune()
+        print(f"   autotune: {', '.join(f'{n}w {r:,.0f} rows/s' for n, r in table.items())} -> {chosen} worker(s)")
+    return OrderedPipeline(brain, pool)
+
+# --- WORKER ENTRY POINT / SCALING BENCHMARK ---
+#   python scoring_pool.py          parity + ordering checks, then logs/s for 1..N workers
+if __name__ == "__main__" and sys.argv[1:2] == ["--worker"]:
+    import ast
+    address, authkey, shm_name, rows, n_sentinel, n_analyst, compiled = sys.argv[2:9]
+    _worker_main(ast.literal_eval(address), bytes.fromhex(authkey), shm_name, int(rows),
+                 int(n_sentinel), int(n_analyst), compiled == "1")
+
+elif __name__ == "__main__":
+    from iot_core import IoTIntelligenceCore
+    from reasoning import StubLLMClient
+    from fleet_sim import FleetGenerator
+
+    brain = IoTIntelligenceCore(llm_client=StubLLMClient())
+    ref = IoTIntelligenceCore(llm_client=StubLLMClient(), models=brain.models)
+    brain.memo = ref.memo = None # Model parity first; the memo (shipped default) is checked below
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else default_workers()
+    logs = FleetGenerator(200, "mixed", seed=7).take(6000)
+    batches = [logs[i:i + 64] for i in range(0, len(logs), 64)]
+
+    # Same answers as in-process scoring, in the same order, even with many batches in flight
+    pipeline = start_pool(brain, workers=max(2, max_workers))
+    futures = [pipeline.submit(b) for b in batches[:40]]
+    got = [r for f in futures for r in f.result()]
+    want = [r for b in batches[:40] for r in ref.analyze_batch(b)]
+    assert [(r["device_id"], r["status"], r["metrics"]) for r in got] == \
+           [(r["device_id"], r["status"], r["metrics"]) for r in want], "Pool changed a decision"
+    big = pipeline.analyze_batch(logs[:3000]) # Split over workers, in slot-sized rounds
+    assert [r["metrics"] for r in big] == [r["metrics"] for r in ref.analyze_batch(logs[:3000])]
+
+    # Killed workers are replaced (all at once, racing on the listener); every value still matches
+    def kill_all():
+        for w in list(pipeline.pool._workers.values()):
+            w.proc.kill(); w.proc.wait()
+    kill_all()
+    got = [r for b in batches[40:44] for r in pipeline.analyze_batch(b)]
+    want = [r for b in batches[40:44] for r in ref.analyze_batch(b)]
+    assert [r["metrics"] for r in got] == [r["metrics"] for r in want], "Respawned worker changed a decision"
+    rng = np.random.default_rng(1)
+    S = rng.integers(0, 2, (4096, pipeline.pool.n_sentinel)).astype(np.float32)
+    A = rng.uniform(0, 1000, (4096, pipeline.pool.n_analyst)).astype(np.float32)
+    kill_all()
+    scores, hours = pipeline.pool.score(S, A)
+    assert np.array_equal(scores, brain.scorer.sentinel_scores(S)) and np.array_equal(hours, brain.scorer.battery_hours(A))
+    n = pipeline.pool.size
+    assert pipeline.pool.respawns == 2 * n and len(pipeline.pool._workers) == n, pipeline.stats()
+    print(f"✅ Pool matches in-process scoring (ordered, split, worker respawn): {pipeline.stats()}")
+
+    # Shipped default: decision memo on, prepare and finish on different threads
+    def memo_brain():
+        b = IoTIntelligenceCore(llm_client=StubLLMClient(), models=brain.models)
+        assert b.memo is not None
+        return b
+    memo_pipe, memo_ref = OrderedPipeline(memo_brain(), pipeline.pool), memo_brain()
+    key = lambda r: (r["device_id"], r["status"], r["metrics"])
+    got = [key(r) for b in batches[:30] for r in memo_pipe.analyze_batch(b)]  # One batch at a time: exact
+    assert got == [key(r) for b in batches[:30] for r in memo_ref.analyze_batch(b)], "Memo + pool changed a decision"
+    # In flight, batch k+1 looks up before batch k has stored: fewer hits, same decisions
+    futures = [memo_pipe.submit(b) for b in batches[30:90]]
+    got = [r for f in futures for r in f.result()]
+    want = [r for b in batches[30:90] for r in memo_ref.analyze_batch(b)]
+    assert [r["device_id"] for r in got] == [r["device_id"] for r in want]
+    hard = [i for i, log in enumerate(l for b in batches[30:90] for l in b)
+            if log["anomaly"]["tampering"] or log["telemetry"]["temperature"] > 80]
+    assert hard and all(got[i]["status"] == want[i]["status"] == "SECURITY_PRIORITY" for i in hard)
+    same = sum(a["status"] == b["status"] for a, b in zip(got, want)) / len(want)
+    memo_stats = memo_pipe.brain.memo.stats()
+    assert same > 0.99 and memo_stats["hit"] > 0, (same, memo_stats)
+    print(f"✅ With the decision memo: exact one batch at a time, {same:.2%} same decision in flight, "
+          f"hit rate {memo_stats['hit_rate']:.1%}")
+    pipeline.pool.stop()
+
+    # Scaling: end-to-end analyze throughput with 1..N workers, 8 batches of 64 in flight
+    def run(fn_submit, seconds=2.0):
+        n, t0, inflight, k = 0, time.perf_counter(), [], 0
+        while time.perf_counter() - t0 < seconds:
+            inflight.append(fn_submit(batches[k % len(batches)]))
+            k += 1
+            if len(inflight) >= 8:
+                n += len(inflight.pop(0).result())
+        for f in inflight: n += len(f.result())
+        return n / (time.perf_counter() - t0)
+
+    single = ThreadPoolExecutor(1)
+    base = run(lambda b: single.submit(ref.analyze_batch, b))
+    print(f"\n   {'workers':<9}{'logs/s':>10}{'speed-up':>10}   (cores: {os.cpu_count()})")
+    print(f"   {'in-proc':<9}{base:>10,.0f}{1.0:>9.2f}x")
+    for n in range(1, max_workers + 1):
+        pool = ScoringPool(brain.sentinel_encoder.n_features, brain.analyst_encoder.n_features, workers=n,
+                           models=brain.models).start()
+        pipe = OrderedPipeline(ref, pool)
+        for b in batches[:20]: pipe.analyze_batch(b)
+        rate = run(pipe.submit)
+        print(f"   {n:<9}{rate:>10,.0f}{rate / base:>9.2f}x")
+        pool.stop()
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+
+# --- SELF-CHECK RUNNER ---
+# Runs every module's `__main__` self-check in its own process (they start
+# threads, worker pools, ptys and servers, so they don't share one interpreter)
+# and fails if any of them does.
+#
+#   python self_check.py                   # everything
+#   python self_check.py batching main     # just these
+#
+# benchmark.py (a load test) and data.py (the serial gateway server) have no
+# self-check and are not run.
+
+# --- CONFIGURATION ---
+HERE = os.path.dirname(os.path.abspath(__file__))
+TIMEOUT_SEC = 600 # Per module; scoring_pool and rescore start worker processes
+CHECKS = {        # module -> extra argv
+    "batching": [], "bulk_ingest": [], "command_queue": [], "crypto_layer": [], "envelope": [],
+    "reasoning": [], "device_state": [], "model_loader": [], "feature_encoder": [], "forest_compiler": [],
+    "fleet_sim": [], "metrics": [], "serial_pipeline": [], "ota_protocol": [], "device_gateway": [],
+    "firmware_store": [], "ota_rollout": [], "uplink": [], "telemetry_store": [], "decision_memo": [],
+    "scoring_pool": [], "rescore": ["--self-check"], "main": ["--self-check"],
+}
+
+def run(module, args, timeout=TIMEOUT_SEC):
+    """-> (ok, seconds, output) for `python <module>.py <args>`."""
+    t0 = time.perf_counter()
+    # Own session, so a timeout also takes down the check's worker processes
+    p = subprocess.Popen([sys.executable, f"{module}.py", *args], cwd=HERE, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT, text=True, encoding="utf-8", errors="replace",
+                         start_new_session=True)
+    try:
+        output, _ = p.communicate(timeout=timeout)
+        ok = p.returncode == 0
+    except subprocess.TimeoutExpired:
+        if os.name == "posix": os.killpg(p.pid, signal.SIGKILL)
+        else: p.kill()
+        output, _ = p.communicate()
+        ok, output = False, f"{output}\nTimed out after {timeout} s"
+    return ok, time.perf_counter() - t0, output
+
+def main(names):
+    unknown = [n for n in names if n not in CHECKS]
+    if unknown:
+        print(f"❌ No self-check for: {', '.join(unknown)} (choose from {', '.join(CHECKS)})")
+        return 2
+    failed = []
+    for module in names or CHECKS:
+        ok, seconds, output = run(module, CHECKS[module])
+        print(f"{'✅' if ok else '❌'} {module:<16} {seconds:6.1f} s")
+        if not ok:
+            failed.append(module)
+            for line in output.strip().splitlines()[-15:]: print(f"      {line}")
+    print(f"\n{'✅ All self-checks passed' if not failed else '❌ Failed: ' + ', '.join(failed)}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,44 @@
+# --- SERIAL LINE FRAMING ---
+# Shared by device_gateway.DeviceGateway, which reads every link: the framer
+# that cuts raw chunks into lines, and the queue / routing limits it uses.
+
+# --- CONFIGURATION ---
+MAX_LINE_BYTES = 16384    # Longer "lines" are line noise; drop them instead of growing forever
+LOG_QUEUE_SIZE = 512      # Parsed logs waiting for analysis
+BATCH_MAX = 32            # Logs handed to the analysis stage in one call
+CONTROL_PREFIX = "OTA_"   # Device replies routed to the control queue instead of the log parser
+CONTROL_QUEUE_SIZE = 256
+
+class LineFramer:
+    """Incremental '\\n' framer: feed it raw chunks, get back complete lines."""
+    def __init__(self, max_line=MAX_LINE_BYTES):
+        self.max_line = max_line
+        self._buf = bytearray()
+        self._discarding = False
+        self.overflows = 0
+
+    def feed(self, data):
+        lines = []
+        self._buf += data
+        while True:
+            nl = self._buf.find(b"\n")
+            if nl < 0: break
+            line = bytes(self._buf[:nl])
+            del self._buf[:nl + 1]
+            if self._discarding:
+                self._discarding = False # Tail of an oversized line
+                continue
+            lines.append(line.rstrip(b"\r").decode("utf-8", errors="replace"))
+        if len(self._buf) > self.max_line:
+            self._buf.clear()
+            self._discarding = True
+            self.overflows += 1
+        return lines
+
+# --- SELF-CHECK ---
+#   python serial_pipeline.py
+if __name__ == "__main__":
+    framer = LineFramer(max_line=64)
+    assert framer.feed(b'{"a"') == [] and framer.feed(b':1}\r\n{"b":2}\n') == ['{"a":1}', '{"b":2}']
+    assert framer.feed(b"x" * 100) == [] and framer.feed(b"yy\nok\n") == ["ok"] and framer.overflows == 1
+    print("✅ Line framer OK (split lines, CRLF, oversized line dropped)")
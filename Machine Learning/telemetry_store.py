@@ -0,0 +1,603 @@
+import os
+import json
+import glob
+import time
+import queue
+import shutil
+import bisect
+import threading
+import numpy as np
+import metrics
+
+# --- LOCAL TELEMETRY STORE ---
+# Every raw log + its analysis, kept on the gateway for replays and retraining.
+#
+#   seg-000042.ndjson      append-only, one {"ts", "device", "log", "report"} per line
+#   seg-000042.meta.json   written when the segment is sealed (time range, devices, rows)
+#   chunk-000001-000042/   compacted segments: one .npy per flattened field, rows
+#                          sorted by (device, ts), so a device/time range is two
+#                          binary searches and the columns can be mmapped
+#
+# append() only puts the record on a bounded queue. A writer thread serializes,
+# writes in batches and fsyncs at most every FSYNC_INTERVAL_SEC (group commit),
+# so the request path never waits for the disk. A crash loses at most that
+# window; a torn last line is cut off when the store is reopened.
+
+# --- CONFIGURATION ---
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".telemetry")
+QUEUE_SIZE = 10000            # Records waiting for the writer; beyond this they are dropped (and counted)
+WRITE_BATCH = 512             # Records per write() call
+FSYNC_INTERVAL_SEC = 1.0      # Group commit window
+SEGMENT_BYTES = 16 * 1024 * 1024
+SEGMENT_MAX_AGE_SEC = 3600    # Seal a segment after an hour even if it is small
+COMPACT_AFTER_SEGMENTS = 4    # Sealed segments waiting before they are compacted into one chunk
+SCAN_LIMIT = 1000             # Default page size for the HTTP range scan
+
+# Column kinds in a compacted chunk
+I8, F8, B1, STR, JSON = "i8", "f8", "b1", "str", "json"
+
+_APPENDED = metrics.counter("cerberus_store_records_total", "Records appended to the telemetry store.", ("outcome",))
+APPEND_OK, APPEND_DROPPED = _APPENDED.labels("ok"), _APPENDED.labels("dropped")
+FSYNC_SECONDS = metrics.histogram("cerberus_store_fsync_seconds", "Group-commit fsync of the active segment.").labels()
+_BACKLOG = metrics.gauge("cerberus_store_queue_depth", "Records waiting for the telemetry writer.")
+
+def flatten(record, prefix="", out=None):
+    """{"a": {"b": 1}} -> {"a.b": 1} (lists / None stay as leaves)."""
+    out = {} if out is None else out
+    for k, v in record.items():
+        if isinstance(v, dict) and v: flatten(v, f"{prefix}{k}.", out)
+        else: out[f"{prefix}{k}"] = v
+    return out
+
+def unflatten(flat):
+    out = {}
+    for key, v in flat.items():
+        node, parts = out, key.split(".")
+        for p in parts[:-1]: node = node.setdefault(p, {})
+        node[parts[-1]] = v
+    return out
+
+def _kind(values):
+    kinds = {type(v) for v in values if v is not None}
+    if kinds == {bool}: return B1
+    if kinds == {int}: return I8
+    if kinds and kinds <= {int, float}: return F8
+    if kinds == {str}: return STR
+    return JSON
+
+def _segment_meta(path):
+    """Scan a segment file -> meta (and cut a torn last line left by a crash)."""
+    rows, lo, hi, devices, good = 0, None, None, set(), 0
+    with open(path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"): break
+            try: rec = json.loads(line)
+            except ValueError: break
+            rows += 1
+            lo = rec["ts"] if lo is None else min(lo, rec["ts"])
+            hi = rec["ts"] if hi is None else max(hi, rec["ts"])
+            devices.add(rec["device"])
+            good += len(line)
+        f.truncate(good)
+    return {"rows": rows, "min_ts": lo, "max_ts": hi, "devices": sorted(d for d in devices if d is not None)}
+
+def _fsync_path(path):
+    """fsync a file or directory by name (directories can't be opened on Windows; skipped there)."""
+    if os.name == "nt" and os.path.isdir(path): return
+    fd = os.open(path, os.O_RDONLY)
+    try: os.fsync(fd)
+    finally: os.close(fd)
+
+def _overlaps(meta, device, start, end):
+    if not meta["rows"]: return False
+    if device is not None and device not in meta["devices"]: return False
+    if start is not None and meta["max_ts"] < start: return False
+    if end is not None and meta["min_ts"] >= end: return False
+    return True
+
+class Chunk:
+    """One compacted, read-only block of columns (.npy, mmapped)."""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f: self.meta = json.load(f)
+        self.devices = self.meta["devices"]
+        self.ts = np.load(os.path.join(path, "ts.npy"), mmap_mode="r")
+        self.device_codes = np.load(os.path.join(path, "device.npy"), mmap_mode="r")
+        self._cols = {}
+
+    def column(self, name):
+        """-> (values, mask or None); str / json columns come back as object arrays."""
+        col = self._cols.get(name)
+        if col is None:
+            spec = self.meta["columns"][name]
+            values = np.load(os.path.join(self.path, f"{spec['file']}.npy"), mmap_mode="r")
+            if spec["kind"] in (STR, JSON):
+                table = spec["values"] if spec["kind"] == STR else [json.loads(v) for v in spec["values"]]
+                values = np.array(table + [None], dtype=object)[values] # Code -1 = missing
+            mask = np.load(os.path.join(self.path, f"{spec['file']}.mask.npy"), mmap_mode="r") if spec["mask"] else None
+            col = self._cols[name] = (values, mask)
+        return col
+
+    def rows(self, device=None, start=None, end=None):
+        """Row slice(s) matching the filter: (lo, hi) pairs, ts-ordered within each device."""
+        if device is not None:
+            code = bisect.bisect_left(self.devices, device)
+            if code == len(self.devices) or self.devices[code] != device: return []
+            spans = [(int(np.searchsorted(self.device_codes, code, "left")),
+                      int(np.searchsorted(self.device_codes, code, "right")))]
+        else:
+            bounds = np.flatnonzero(np.diff(self.device_codes)) + 1
+            edges = [0] + bounds.tolist() + [len(self.ts)]
+            spans = list(zip(edges[:-1], edges[1:]))
+        out = []
+        for lo, hi in spans:
+            ts = self.ts[lo:hi]
+            a = lo + (int(np.searchsorted(ts, start, "left")) if start is not None else 0)
+            b = lo + (int(np.searchsorted(ts, end, "left")) if end is not None else hi - lo)
+            if b > a: out.append((a, b))
+        return out
+
+    def records(self, lo, hi):
+        names = list(self.meta["columns"])
+        cols = [(n,) + self.column(n) for n in names]
+        for i in range(lo, hi):
+            flat = {}
+            for name, values, mask in cols:
+                if mask is not None and not mask[i]: continue
+                v = values[i]
+                flat[name] = v.item() if hasattr(v, "item") else v
+            rec = unflatten(flat)
+            yield {"ts": float(self.ts[i]), "device": self.devices[self.device_codes[i]],
+                   "log": rec.get("log", {}), "report": rec.get("report")}
+
+class TelemetryStore:
+    """
+    `store.append(log, report)`  never blocks; the writer thread does the rest.
+    `store.scan(device, start, end)` -> records in time order per device
+    `store.columns(["log.telemetry.temperature", ...], device, start, end)` -> NumPy arrays
+    `store.flush()` waits until everything appended so far is fsynced.
+    """
+    def __init__(self, directory=STORE_DIR, segment_bytes=SEGMENT_BYTES, segment_max_age_sec=SEGMENT_MAX_AGE_SEC,
+                 fsync_interval_sec=FSYNC_INTERVAL_SEC, compact_after=COMPACT_AFTER_SEGMENTS, queue_size=QUEUE_SIZE):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_max_age = segment_max_age_sec
+        self.fsync_interval = fsync_interval_sec
+        self.compact_after = compact_after
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()       # Segment / chunk lists, reader count
+        self._compact_lock = threading.Lock()
+        self._readers = 0
+        self._retired = []                  # Segment files compacted away, deleted once no scan is reading
+        self._writer = None
+        self._file = None
+        self._active = None                 # (seq, path, meta being built)
+        self.appended = 0
+        self.dropped = 0
+        self.fsyncs = 0
+        self.compactions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        _BACKLOG.set_function((), self._queue.qsize)
+
+    # --- OPENING ---
+    def _recover(self):
+        for tmp in glob.glob(os.path.join(self.directory, "*.tmp")): shutil.rmtree(tmp, ignore_errors=True)
+        self.sealed = {}   # seq -> (path, meta)
+        for path in sorted(glob.glob(os.path.join(self.directory, "seg-*.ndjson"))):
+            seq = int(os.path.basename(path)[4:10])
+            meta_path = path[:-len(".ndjson")] + ".meta.json"
+            if os.path.exists(meta_path):
+                with open(meta_path) as f: meta = json.load(f)
+            else: # Active segment of a previous run: repair its tail and seal it
+                meta = _segment_meta(path)
+                self._write_meta(meta_path, meta)
+            self.sealed[seq] = (path, meta)
+        self.chunks = [Chunk(p) for p in sorted(glob.glob(os.path.join(self.directory, "chunk-*"))) if os.path.isdir(p)]
+        # Segments already inside a chunk (crash between compaction and cleanup)
+        for chunk in self.chunks:
+            for seq in chunk.meta["segments"]:
+                if seq in self.sealed: self._retire(seq)
+        seqs = list(self.sealed) + [s for c in self.chunks for s in c.meta["segments"]]
+        self._next_seq = max(seqs, default=0) + 1
+
+    @staticmethod
+    def _write_meta(path, meta):
+        with open(path + ".part", "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".part", path)
+        _fsync_path(os.path.dirname(path) or ".")
+
+    # --- WRITING ---
+    def start(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._run, daemon=True, name="telemetry-writer")
+            self._writer.start()
+        return self
+
+    def append(self, log, report=None, ts=None):
+        """Queue one log (+ its analysis). Returns False if the writer is too far behind and it was dropped."""
+        self.start()
+        try:
+            self._queue.put_nowait((time.time() if ts is None else ts, log, report))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            APPEND_DROPPED.inc()
+            return False
+
+    def flush(self, timeout=None):
+        """Block until everything appended before this call is on disk (fsynced)."""
+        self.start()
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _open_segment(self):
+        seq = self._next_seq
+        self._next_seq += 1
+        path = os.path.join(self.directory, f"seg-{seq:06d}.ndjson")
+        self._file = open(path, "ab")
+        _fsync_path(self.directory) # The new name must survive a crash as well as its fsynced contents
+        with self._lock:
+            self._active = (seq, path, {"rows": 0, "min_ts": None, "max_ts": None, "devices": set()},
+                            time.monotonic(), 0)
+
+    def _seal_segment(self):
+        if self._file is None: return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        seq, path, meta, _, _ = self._active
+        meta = dict(meta, devices=sorted(d for d in meta["devices"] if d is not None))
+        self._write_meta(path[:-len(".ndjson")] + ".meta.json", meta)
+        with self._lock:
+            self.sealed[seq] = (path, meta)
+            self._active = None
+        self._file = None
+        if len(self.sealed) >= self.compact_after and not self._compact_lock.locked():
+            threading.Thread(target=self.compact, daemon=True, name="telemetry-compact").start()
+
+    def _write(self, records):
+        lines = []
+        for ts, log, report in records:
+            device = log.get("digitalTwin", {}).get("deviceId") if isinstance(log, dict) else None
+            lines.append((json.dumps({"ts": ts, "device": device, "log": log, "report": report},
+                                     separators=(",", ":"), default=str) + "\n").encode("utf-8"))
+        data = b"".join(lines)
+        if self._active is not None:
+            _, _, _, opened, size = self._active
+            if size + len(data) > self.segment_bytes or time.monotonic() - opened > self.segment_max_age:
+                self._seal_segment()
+        if self._file is None: self._open_segment()
+        self._file.write(data)
+        self._file.flush() # Visible to scans right away; durable at the next fsync
+        stamps = [r[0] for r in records]
+        devices = {log.get("digitalTwin", {}).get("deviceId") if isinstance(log, dict) else None for _, log, _ in records}
+        with self._lock: # _snapshot copies this meta for readers
+            seq, path, meta, opened, size = self._active
+            meta["rows"] += len(records)
+            meta["min_ts"] = min(stamps) if meta["min_ts"] is None else min(meta["min_ts"], *stamps)
+            meta["max_ts"] = max(stamps) if meta["max_ts"] is None else max(meta["max_ts"], *stamps)
+            meta["devices"] |= devices
+            self._active = (seq, path, meta, opened, size + len(data))
+        self.appended += len(records)
+        APPEND_OK.inc(len(records))
+
+    def _fsync(self):
+        if self._file is None: return
+        t = time.perf_counter()
+        os.fsync(self._file.fileno())
+        metrics.lap(FSYNC_SECONDS, t)
+        self.fsyncs += 1
+
+    def _run(self):
+        last_sync, dirty = time.monotonic(), False
+        while True:
+            timeout = max(0.0, last_sync + self.fsync_interval - time.monotonic()) if dirty else None
+            try: first = self._queue.get(timeout=timeout)
+            except queue.Empty: first = None
+            batch, waiters, stop = [], [], False
+            item = first
+            while item is not None:
+                if isinstance(item, threading.Event): waiters.append(item)
+                elif item == "stop": stop = True
+                else: batch.append(item)
+                if len(batch) >= WRITE_BATCH: break
+                try: item = self._queue.get_nowait()
+                except queue.Empty: item = None
+            try:
+                if batch:
+                    self._write(batch)
+                    dirty = True
+                if dirty and (waiters or stop or time.monotonic() - last_sync >= self.fsync_interval):
+                    self._fsync()
+                    last_sync, dirty = time.monotonic(), False
+            except OSError as e:
+                print(f"❌ Telemetry store write failed: {e}")
+            for w in waiters: w.set()
+            if stop:
+                self._seal_segment()
+                return
+
+    def stop(self):
+        """Write out everything queued, seal the active segment."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put("stop")
+            self._writer.join()
+
+    # --- COMPACTION ---
+    def compact(self):
+        """Fold all sealed segments into one columnar chunk. Safe to call any time (idempotent)."""
+        with self._compact_lock:
+            with self._lock: todo = sorted(self.sealed.items())
+            if not todo: return None
+            t0 = time.perf_counter()
+            rows = []
+            for _, (path, _) in todo:
+                with open(path, "rb") as f:
+                    rows.extend(json.loads(line) for line in f if line.endswith(b"\n"))
+            seqs = [seq for seq, _ in todo]
+            name = f"chunk-{seqs[0]:06d}-{seqs[-1]:06d}"
+            final = os.path.join(self.directory, name)
+            tmp = final + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            self._write_chunk(tmp, rows, seqs)
+            # The segments are deleted right after this: the chunk must be durable before it gets its name
+            for entry in os.listdir(tmp): _fsync_path(os.path.join(tmp, entry))
+            _fsync_path(tmp)
+            os.replace(tmp, final)
+            _fsync_path(self.directory)
+            chunk = Chunk(final)
+            with self._lock:
+                self.chunks.append(chunk)
+                for seq in seqs: self._retire(seq)
+            self.compactions += 1
+            print(f"🗜️  Compacted {len(seqs)} segment(s), {len(rows)} records -> {name} "
+                  f"in {time.perf_counter() - t0:.2f} s")
+            return chunk
+
+    def _write_chunk(self, directory, rows, seqs):
+        devices = sorted({str(r["device"]) for r in rows})
+        code_of = {d: i for i, d in enumerate(devices)}
+        rows.sort(key=lambda r: (code_of[str(r["device"])], r["ts"]))
+        n = len(rows)
+        np.save(os.path.join(directory, "ts.npy"), np.array([r["ts"] for r in rows], dtype=np.float64))
+        np.save(os.path.join(directory, "device.npy"), np.array([code_of[str(r["device"])] for r in rows], dtype=np.int32))
+
+        flat = [flatten({"log": r["log"], "report": r["report"]}) for r in rows]
+        names = sorted({k for f in flat for k in f})
+        columns = {}
+        for i, name in enumerate(names):
+            values = [f.get(name) for f in flat]
+            present = np.array([name in f for f in flat], dtype=bool)
+            kind = _kind(values)
+            if kind != JSON and any(v is None for v, p in zip(values, present) if p): kind = JSON # Keep explicit nulls
+            if kind in (STR, JSON):
+                enc = [(v if kind == STR else json.dumps(v, default=str)) if p else None for v, p in zip(values, present)]
+                table = sorted({v for v in enc if v is not None})
+                index = {v: j for j, v in enumerate(table)}
+                arr = np.array([-1 if v is None else index[v] for v in enc], dtype=np.int32)
+            else:
+                dtype, fill = {I8: (np.int64, 0), F8: (np.float64, np.nan), B1: (np.bool_, False)}[kind]
+                arr = np.array([v if p else fill for v, p in zip(values, present)], dtype=dtype)
+                table = None
+            file = f"c{i:04d}"
+            np.save(os.path.join(directory, f"{file}.npy"), arr)
+            if not present.all(): np.save(os.path.join(directory, f"{file}.mask.npy"), present)
+            columns[name] = {"file": file, "kind": kind, "mask": not present.all(), "values": table}
+        ts = [r["ts"] for r in rows]
+        meta = {"rows": n, "min_ts": min(ts, default=None), "max_ts": max(ts, default=None),
+                "devices": devices, "segments": seqs, "columns": columns}
+        with open(os.path.join(directory, "meta.json"), "w") as f: json.dump(meta, f)
+
+    def _retire(self, seq):
+        # Caller holds _lock (or is still single-threaded in _recover)
+        path, _ = self.sealed.pop(seq)
+        self._retired.append(path)
+        self._delete_retired()
+
+    def _delete_retired(self):
+        if self._readers: return
+        for path in self._retired:
+            for p in (path, path[:-len(".ndjson")] + ".meta.json"):
+                try: os.remove(p)
+                except FileNotFoundError: pass
+        self._retired = []
+
+    # --- READING ---
+    def _snapshot(self):
+        with self._lock:
+            self._readers += 1
+            segments = [(seq, path, meta) for seq, (path, meta) in sorted(self.sealed.items())]
+            if self._active is not None:
+                seq, path, meta, _, _ = self._active
+                segments.append((seq, path, dict(meta, devices=set(meta["devices"]))))
+            return list(self.chunks), segments
+
+    def _release(self):
+        with self._lock:
+            self._readers -= 1
+            self._delete_retired()
+
+    def scan(self, device=None, start=None, end=None):
+        """
+        Records with start <= ts < end (gateway receive time, epoch s), optionally for
+        one device. Compacted data first, then newer segments; ts-ordered per device.
+        """
+        chunks, segments = self._snapshot()
+        try:
+            for chunk in chunks:
+                if not _overlaps(chunk.meta, device, start, end): continue
+                for lo, hi in chunk.rows(device, start, end): yield from chunk.records(lo, hi)
+            for _, path, meta in segments:
+                if not _overlaps(meta, device, start, end): continue
+                found = self._segment_records(path, device, start, end)
+                found.sort(key=lambda r: (str(r["device"]), r["ts"]))
+                yield from found
+        finally:
+            self._release()
+
+    def columns(self, names, device=None, start=None, end=None):
+        """
+        Retraining export: {name: array} for flattened fields such as
+        "log.telemetry.temperature" or "report.metrics.anomaly_score", plus "ts" and
+        "device". Missing numeric values are NaN, missing strings None.
+        """
+        parts = {n: [] for n in ["ts", "device"] + list(names)}
+        chunks, segments = self._snapshot()
+        try:
+            for chunk in chunks:
+                if not _overlaps(chunk.meta, device, start, end): continue
+                for lo, hi in chunk.rows(device, start, end):
+                    parts["ts"].append(np.asarray(chunk.ts[lo:hi]))
+                    parts["device"].append(np.array(chunk.devices, dtype=object)[chunk.device_codes[lo:hi]])
+                    for name in names:
+                        if name not in chunk.meta["columns"]:
+                            parts[name].append(np.full(hi - lo, None, dtype=object))
+                            continue
+                        values, mask = chunk.column(name)
+                        v = np.asarray(values[lo:hi])
+                        if mask is not None:
+                            v = v.astype(np.float64 if v.dtype.kind in "iufb" else object)
+                            v[~np.asarray(mask[lo:hi])] = np.nan if v.dtype.kind == "f" else None
+                        parts[name].append(v)
+        finally:
+            self._release()
+        recs = [r for _, path, meta in segments if _overlaps(meta, device, start, end)
+                for r in self._segment_records(path, device, start, end)]
+        if recs:
+            flat = [flatten({"log": r["log"], "report": r["report"]}) for r in recs]
+            parts["ts"].append(np.array([r["ts"] for r in recs], dtype=np.float64))
+            parts["device"].append(np.array([r["device"] for r in recs], dtype=object))
+            for name in names:
+                vals = [f.get(name) for f in flat]
+                kind = _kind(vals)
+                if kind in (I8, F8, B1): parts[name].append(np.array([np.nan if v is None else v for v in vals], dtype=np.float64))
+                else: parts[name].append(np.array(vals, dtype=object))
+        out = {}
+        for name, arrays in parts.items():
+            if not arrays: out[name] = np.empty(0)
+            elif len({a.dtype for a in arrays}) == 1: out[name] = np.concatenate(arrays)
+            elif all(a.dtype.kind in "iufb" for a in arrays): out[name] = np.concatenate([a.astype(np.float64) for a in arrays])
+            else: out[name] = np.concatenate([a.astype(object) for a in arrays])
+        return out
+
+    def _segment_records(self, path, device, start, end):
+        try: f = open(path, "rb")
+        except FileNotFoundError: return []
+        with f:
+            out = []
+            for line in f:
+                if not line.endswith(b"\n"): break # Being written right now
+                rec = json.loads(line)
+                if device is not None and rec["device"] != device: continue
+                if start is not None and rec["ts"] < start: continue
+                if end is not None and rec["ts"] >= end: continue
+                out.append(rec)
+            return out
+
+    def stats(self):
+        with self._lock:
+            seg_bytes = sum(os.path.getsize(p) for p, _ in self.sealed.values() if os.path.exists(p))
+            active = self._active[4] if self._active is not None else 0
+            return {"appended": self.appended, "dropped": self.dropped, "queue_depth": self._queue.qsize(),
+                    "fsyncs": self.fsyncs, "segments": len(self.sealed) + (self._active is not None),
+                    "segment_bytes": seg_bytes + active, "chunks": len(self.chunks),
+                    "chunk_rows": sum(c.meta["rows"] for c in self.chunks), "compactions": self.compactions}
+
+def store_files(directory=STORE_DIR):
+    """Read-only listing for offline tools -> (chunk dirs, segment files not compacted yet), oldest first."""
+    chunks = [p for p in sorted(glob.glob(os.path.join(directory, "chunk-*")))
+              if os.path.isdir(p) and not p.endswith(".tmp")]
+    compacted = set()
+    for path in chunks:
+        with open(os.path.join(path, "meta.json")) as f: compacted.update(json.load(f)["segments"])
+    segments = [p for p in sorted(glob.glob(os.path.join(directory, "seg-*.ndjson")))
+                if int(os.path.basename(p)[4:10]) not in compacted]
+    return chunks, segments
+
+def fastapi_router(store):
+    """GET /telemetry (range scan), GET /telemetry/stats, POST /telemetry/compact."""
+    import asyncio
+    from typing import Optional
+    from fastapi import APIRouter
+    router = APIRouter()
+
+    @router.get("/telemetry")
+    async def telemetry_scan(device_id: Optional[str] = None, start: Optional[float] = None,
+                             end: Optional[float] = None, limit: int = SCAN_LIMIT):
+        """Stored logs + analyses for one device / time range (epoch seconds, end exclusive)."""
+        def run():
+            out = []
+            for rec in store.scan(device_id, start, end):
+                out.append(rec)
+                if len(out) >= limit: break
+            return out
+        records = await asyncio.get_running_loop().run_in_executor(None, run)
+        return {"count": len(records), "truncated": len(records) >= limit, "records": records}
+
+    @router.get("/telemetry/stats")
+    async def telemetry_stats():
+        return store.stats()
+
+    @router.post("/telemetry/compact")
+    async def telemetry_compact():
+        chunk = await asyncio.get_running_loop().run_in_executor(None, store.compact)
+        return {"chunk": os.path.basename(chunk.path) if chunk else None, **store.stats()}
+
+    return router
+
+# --- SELF-CHECK & BENCHMARK ---
+#   python telemetry_store.py
+if __name__ == "__main__":
+    import tempfile
+    from fleet_sim import FleetGenerator
+
+    directory = tempfile.mkdtemp()
+    fleet = FleetGenerator(20, "mixed", seed=4)
+    logs = fleet.take(6000)
+    reports = [{"device_id": l["digitalTwin"]["deviceId"], "status": "BALANCED", "explanation": None,
+                "metrics": {"anomaly_score": 0.1 * (i % 7), "battery_prediction_hours": float(i),
+                            "battery_status": "High"}} for i, l in enumerate(logs)]
+    t0 = 1_700_000_000.0
+    stamps = [t0 + i * 0.5 for i in range(len(logs))]
+
+    store = TelemetryStore(directory, segment_bytes=256 * 1024, compact_after=10 ** 6).start()
+    t = time.perf_counter()
+    for log, rep, ts in zip(logs, reports, stamps): assert store.append(log, rep, ts=ts)
+    per_append = (time.perf_counter() - t) / len(logs) * 1e6
+    t = time.perf_counter()
+    store.flush()
+    drain = time.perf_counter() - t
+    dev = logs[0]["digitalTwin"]["deviceId"]
+    want = [(ts, l, r) for ts, l, r in zip(stamps, logs, reports)
+            if l["digitalTwin"]["deviceId"] == dev and t0 + 100 <= ts < t0 + 2000]
+    def got(): return [(r["ts"], r["log"], r["report"]) for r in store.scan(dev, t0 + 100, t0 + 2000)]
+    assert got() == want and store.stats()["segments"] > 2
+    assert sum(1 for _ in store.scan()) == len(logs)
+
+    # Compaction keeps every record, byte for byte, and range scans stay correct
+    chunk = store.compact()
+    assert got() == want and sum(1 for _ in store.scan()) == len(logs) and store.stats()["segments"] == 1 # Just the active one
+    cols = store.columns(["log.telemetry.temperature", "report.metrics.anomaly_score", "log.behaviour.connectionPattern"], dev)
+    assert list(cols["log.telemetry.temperature"]) == [l["telemetry"]["temperature"] for l in logs
+                                                      if l["digitalTwin"]["deviceId"] == dev]
+    t = time.perf_counter()
+    for _ in range(100): list(chunk.rows(dev, t0 + 100, t0 + 2000))
+    lookup_us = (time.perf_counter() - t) / 100 * 1e6
+
+    # Crash: torn last line in an unsealed segment is cut off on reopen
+    for log, rep, ts in zip(logs[:10], reports[:10], stamps[:10]): store.append(log, rep, ts=ts + 10_000)
+    store.flush()
+    active = store._active[1]
+    with open(active, "ab") as f: f.write(b'{"ts": 1, "dev')
+    reopened = TelemetryStore(directory)
+    assert sum(1 for _ in reopened.scan(start=t0 + 10_000)) == 10 and reopened.chunks
+    print(f"✅ Telemetry store OK: {store.stats()}")
+    print(f"   append() {per_append:.1f} µs on the caller | writer drained {len(logs)} records in {drain * 1000:.0f} ms "
+          f"| chunk device/time lookup {lookup_us:.0f} µs")
+    shutil.rmtree(directory, ignore_errors=True)
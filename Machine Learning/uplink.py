@@ -0,0 +1,282 @@
+import os
+import time
+import glob
+import queue
+import random
+import struct
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+from metrics import lap
+
+# --- CONFIGURATION ---
+QUEUE_SIZE = 1000         # Reports waiting in memory; beyond this they go to the disk spool
+BATCH_MAX = 1             # Reports per POST; >1 = JSON array / concatenated envelopes (Node server must accept it)
+BATCH_WAIT_SEC = 0.05     # How long to wait for a batch to fill up
+TIMEOUT_SEC = 5.0         # Per request (connect + read)
+MAX_RETRIES = 5
+BACKOFF_BASE_SEC = 0.5    # 0.5, 1, 2, 4, 8 s (+ jitter), capped below
+BACKOFF_MAX_SEC = 30.0
+POOL_SIZE = 4             # Keep-alive connections per host
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".uplink_spool")
+SPOOL_MAX_BYTES = 50 * 1024 * 1024
+SPOOL_RETRY_SEC = 10.0    # After a failure, leave the spool alone this long before trying again
+
+# --- INSTRUMENTATION ---
+POST_SECONDS = metrics.histogram("cerberus_uplink_post_seconds", "One POST attempt to the Node server.", ("uplink", "outcome"))
+QUEUE_DEPTH = metrics.gauge("cerberus_uplink_queue_depth", "Reports waiting in memory.", ("uplink",))
+SPOOL_BYTES = metrics.gauge("cerberus_uplink_spool_bytes", "Reports waiting on disk.", ("uplink",))
+
+JSON_TYPE = "application/json"
+_RECORD = struct.Struct(">BI") # content-type length | body length, then content-type, then body
+
+class Uplink:
+    """
+    Bounded, pooled, batching sender for encrypted reports.
+
+    send() never blocks the caller (serial thread / event loop): reports go into a
+    bounded queue and a worker thread POSTs them over one keep-alive Session.
+    With batch_max > 1, JSON packets are batched into one JSON array and binary
+    envelopes (self-delimiting) are simply concatenated, with the count in an
+    X-Cerberus-Batch header. The default of 1 POSTs one report per request.
+    Failed batches are retried with exponential backoff, then spooled to disk
+    and re-sent once the server answers again.
+    """
+    def __init__(self, url, name="uplink", queue_size=QUEUE_SIZE, batch_max=BATCH_MAX,
+                 batch_wait_sec=BATCH_WAIT_SEC, timeout_sec=TIMEOUT_SEC, max_retries=MAX_RETRIES,
+                 backoff_base_sec=BACKOFF_BASE_SEC, spool_dir=SPOOL_DIR, spool_max_bytes=SPOOL_MAX_BYTES):
+        self.url = url
+        self.name = name
+        self.batch_max = batch_max
+        self.batch_wait = batch_wait_sec
+        self.timeout = timeout_sec
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base_sec
+        self.spool_dir = os.path.join(spool_dir, name)
+        self.spool_max_bytes = spool_max_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._spool_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.sent = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+        self.spooled = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self._last_failure = 0.0
+        self._spool_bytes = self._spool_size()
+        self._post_ok = POST_SECONDS.labels(name, "ok")
+        self._post_rejected = POST_SECONDS.labels(name, "rejected")
+        self._post_retry = POST_SECONDS.labels(name, "retry")
+        QUEUE_DEPTH.set_function((name,), self._queue.qsize)
+        SPOOL_BYTES.set_function((name,), lambda: self._spool_bytes)
+
+    # --- PRODUCER SIDE ---
+    def start(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, daemon=True, name=f"{self.name}-worker")
+            self._worker.start()
+        return self
+
+    def send(self, body, headers=None):
+        """Queue one encoded report. Returns False if it had to be spooled or dropped."""
+        self.start()
+        ctype = (headers or {}).get("Content-Type", JSON_TYPE)
+        try:
+            self._queue.put_nowait((body, ctype))
+            return True
+        except queue.Full:
+            self._spool([(body, ctype)])
+            return False
+
+    # --- WORKER SIDE ---
+    def _collect(self):
+        try: first = self._queue.get(timeout=0.5)
+        except queue.Empty: return []
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_max:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            try: batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty: break
+        return batch
+
+    def _post(self, items):
+        ctype = items[0][1]
+        if len(items) == 1: body = items[0][0]
+        elif ctype == JSON_TYPE: body = b"[" + b",".join(b for b, _ in items) + b"]"
+        else: body = b"".join(b for b, _ in items)
+        headers = {"Content-Type": ctype}
+        if len(items) > 1: headers["X-Cerberus-Batch"] = str(len(items))
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                delay = min(BACKOFF_MAX_SEC, self.backoff_base * 2 ** (attempt - 1))
+                if self._stop.wait(delay * random.uniform(0.8, 1.2)): break
+            self.in_flight += 1
+            t = time.perf_counter()
+            outcome = self._post_retry
+            try:
+                r = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+                if r.status_code < 500 and r.status_code != 429:
+                    if r.status_code >= 400:
+                        # The server rejected the content itself; retrying won't help
+                        print(f"   ⚠️ {self.name}: server rejected batch ({r.status_code})")
+                        outcome = self._post_rejected
+                        self.failed += len(items)
+                        return True
+                    outcome = self._post_ok
+                    self.sent += len(items)
+                    self.batches += 1
+                    return True
+            except requests.RequestException:
+                pass
+            finally:
+                self.in_flight -= 1
+                lap(outcome, t)
+        return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                # Idle: good moment to retry whatever is on disk (unless the server just failed us)
+                if time.monotonic() - self._last_failure > SPOOL_RETRY_SEC: self._drain_spool()
+                continue
+            # One POST per content type (JSON arrays and binary envelopes don't mix)
+            groups = {}
+            for item in batch: groups.setdefault(item[1], []).append(item)
+            for items in groups.values():
+                if self._post(items): self._drain_spool()
+                else:
+                    print(f"   ❌ {self.name}: {len(items)} report(s) undeliverable, spooling to disk")
+                    self._last_failure = time.monotonic()
+                    self._spool(items)
+            for _ in batch: self._queue.task_done()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._worker: self._worker.join(timeout)
+
+    def flush(self, timeout=10.0):
+        """Wait until everything queued so far was delivered or spooled (used by tests and shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self._queue.unfinished_tasks == 0
+
+    # --- DISK SPOOL ---
+    def _spool_size(self):
+        return sum(os.path.getsize(p) for p in glob.glob(os.path.join(self.spool_dir, "*.spool")))
+
+    def _spool(self, items):
+        # One append-only file per second, so a burst of overflow doesn't make thousands of files
+        with self._spool_lock:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            path = os.path.join(self.spool_dir, f"{int(time.time()):012d}.spool")
+            with open(path, "ab") as f:
+                for body, ctype in items:
+                    ct = ctype.encode("ascii")
+                    n = _RECORD.size + len(ct) + len(body)
+                    if self._spool_bytes + n > self.spool_max_bytes:
+                        self.dropped += 1
+                        continue
+                    f.write(_RECORD.pack(len(ct), len(body)))
+                    f.write(ct)
+                    f.write(body)
+                    self._spool_bytes += n
+                    self.spooled += 1
+            if os.path.getsize(path) == 0: os.remove(path)
+
+    def _drain_spool(self):
+        """Move the oldest spool file back into the queue while there is room."""
+        with self._spool_lock:
+            files = sorted(glob.glob(os.path.join(self.spool_dir, "*.spool")))
+            if not files or self._queue.qsize() > self._queue.maxsize // 2: return
+            path = files[0]
+            with open(path, "rb") as f: data = f.read()
+            os.remove(path)
+            self._spool_bytes = max(0, self._spool_bytes - len(data))
+        off, leftover = 0, []
+        while off + _RECORD.size <= len(data):
+            ct_len, n = _RECORD.unpack_from(data, off)
+            off += _RECORD.size
+            ctype = data[off:off + ct_len].decode("ascii")
+            off += ct_len
+            item = (data[off:off + n], ctype)
+            off += n
+            try: self._queue.put_nowait(item)
+            except queue.Full: leftover.append(item)
+        if leftover: self._spool(leftover)
+
+    def stats(self):
+        return {"queue_depth": self._queue.qsize(), "in_flight": self.in_flight, "sent": self.sent,
+                "batches": self.batches, "retries": self.retries, "failed": self.failed,
+                "spooled": self.spooled, "dropped": self.dropped,
+                "spool_bytes": self._spool_bytes}
+
+# --- SELF-CHECK AGAINST A LOCAL STAND-IN SERVER ---
+#   python uplink.py
+if __name__ == "__main__":
+    import json
+    import shutil
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    received, state = [], {"fail": 0}
+    class StandIn(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if state["fail"] > 0:
+                state["fail"] -= 1
+                self.send_response(503)
+            else:
+                items = json.loads(body)
+                received.extend(items if isinstance(items, list) else [items])
+                self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        def log_message(self, *a): pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/report"
+    spool = tempfile.mkdtemp()
+    try:
+        # 1. Batching over keep-alive
+        up = Uplink(url, spool_dir=spool, backoff_base_sec=0.01, batch_max=20)
+        for i in range(100): up.send(json.dumps({"i": i}).encode(), {"Content-Type": JSON_TYPE})
+        up.flush()
+        assert sorted(r["i"] for r in received) == list(range(100)), "Reports lost"
+        assert up.batches < 100, "Reports were not batched"
+
+        # 2. Retries with backoff
+        state["fail"] = 3
+        up.send(b'{"i": 100}'); up.flush(); time.sleep(0.3)
+        assert received[-1] == {"i": 100} and up.retries >= 3
+
+        # 3. Overflow -> spool -> re-sent later
+        small = Uplink(url, name="tiny", queue_size=2, batch_max=1, spool_dir=spool)
+        server_down = Uplink("http://127.0.0.1:9/none", name="tiny", queue_size=2, spool_dir=spool, max_retries=0, timeout_sec=0.2)
+        for i in range(5): server_down.send(json.dumps({"j": i}).encode())
+        time.sleep(1.0); server_down.stop()
+        assert server_down.spooled >= 5 and server_down.sent == 0, server_down.stats()
+        small.start(); time.sleep(1.5); small.flush()
+        assert sorted(r["j"] for r in received if "j" in r) == list(range(5)), small.stats()
+        print(f"✅ Uplink OK: {up.stats()}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(spool, ignore_errors=True)